@@ -0,0 +1,66 @@
+"""Startup-time benchmark for workers and CLI tools.
+
+Each scenario runs in a fresh interpreter so import caches do not hide the cost:
+
+    python benchmarks/startup_bench.py --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+SCENARIOS = {
+    "import_main": "import main",
+    "import_cli_tool": "import main.rescorer",
+    "create_app": "from main import create_app; create_app()",
+}
+
+TIMER = """
+import time
+start = time.perf_counter()
+{code}
+print(time.perf_counter() - start)
+"""
+
+
+def run_scenario(code, runs, env):
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", TIMER.format(code=code)],
+            cwd=ROOT, env=env, capture_output=True, text=True, check=True
+        ).stdout
+        timings.append(float(output.strip().splitlines()[-1]) * 1000)
+    return {
+        "runs": runs,
+        "median_ms": round(statistics.median(timings), 1),
+        "min_ms": round(min(timings), 1),
+        "max_ms": round(max(timings), 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), action="append")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as instance_dir:
+        env = dict(os.environ)
+        env.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(instance_dir, 'bench.db')}")
+        results = {
+            name: run_scenario(SCENARIOS[name], args.runs, env)
+            for name in (args.scenario or SCENARIOS)
+        }
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,29 +1,64 @@
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from dotenv import load_dotenv
 import os
+import threading
 
-load_dotenv()
+# Flask, SQLAlchemy and dotenv are imported on first use so that CLI tools and
+# offline jobs that only need helpers from this package start quickly.
+_db_lock = threading.Lock()
 
-db = SQLAlchemy()   
 
-def create_app():
+def __getattr__(name):
+    if name == "db":
+        global db
+        with _db_lock:
+            if "db" not in globals():
+                from flask_sqlalchemy import SQLAlchemy
+                db = SQLAlchemy()
+        return db
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def create_app(test_config=None):
+    from flask import Flask
+    from dotenv import load_dotenv
+
+    load_dotenv()
     app = Flask(__name__)
 
     app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///transactions.db')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key')
+    app.config['SCHEMA_AUTO_CREATE'] = os.getenv('SCHEMA_AUTO_CREATE', '1') == '1'
+    if test_config is not None:
+        app.config.update(test_config)
 
+    from main import db
     db.init_app(app)
 
     from .models import TransactionAnalysis
+    from .schema import ensure_schema, init_db_command
 
-    with app.app_context():
-        db.create_all()
+    if app.config['SCHEMA_AUTO_CREATE']:
+        ensure_schema(app)
+    app.cli.add_command(init_db_command)
+
+    from .analytics import rebuild_rollups_command
+    app.cli.add_command(rebuild_rollups_command)
 
     from .controller import main_bp
 
     app.register_blueprint(main_bp)
 
-    return app 
+    from .profiling import sampling_profiler, PROFILER_ON_START_SECONDS
+    if PROFILER_ON_START_SECONDS > 0:
+        sampling_profiler.start(PROFILER_ON_START_SECONDS)
+
+    # Tests run sweeps and warm-up themselves instead of racing threads against their databases
+    if not app.config['TESTING']:
+        from .admission import start_rescore_sweeper
+        start_rescore_sweeper(app)
+
+        from .warmup import start_warmup, WARMUP_ON_START
+        if WARMUP_ON_START:
+            start_warmup(app)
 
+    return app
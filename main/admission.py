@@ -0,0 +1,294 @@
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from . import deadline, profiling
+from .background import BackgroundQueue
+from .database_manager import DatabaseManager
+from .local_scorer import local_score
+
+load_dotenv()
+
+MAX_IN_FLIGHT = int(os.getenv("SCORING_MAX_IN_FLIGHT", "32"))
+MAX_WAITING = int(os.getenv("SCORING_MAX_QUEUE", "64"))
+QUEUE_TIMEOUT_SECONDS = float(os.getenv("SCORING_QUEUE_TIMEOUT", "2.0"))
+# off: shed with 503 + Retry-After; local: answer with a provisional local verdict and rescore later
+DEGRADED_MODE = os.getenv("DEGRADED_MODE", "off")
+# Scoring slots background rescoring may never take, kept free for live requests
+LIVE_RESERVE = int(os.getenv("SCORING_LIVE_RESERVE", str(MAX_IN_FLIGHT // 4)))
+# Retry backoff for failed provisional rescores: base doubles per attempt up to the cap
+RESCORE_BACKOFF_SECONDS = float(os.getenv("RESCORE_BACKOFF_SECONDS", "5"))
+RESCORE_BACKOFF_MAX_SECONDS = float(os.getenv("RESCORE_BACKOFF_MAX_SECONDS", "300"))
+# How often stored provisional verdicts are swept back into the rescore queue; 0 disables the sweeper
+RESCORE_SWEEP_SECONDS = float(os.getenv("RESCORE_SWEEP_SECONDS", "30"))
+RESCORE_SWEEP_BATCH = int(os.getenv("RESCORE_SWEEP_BATCH", "100"))
+
+deferred_queue = BackgroundQueue(
+    "deferred-rescore",
+    maxsize=int(os.getenv("DEFERRED_QUEUE_SIZE", "1000")),
+    workers=int(os.getenv("DEFERRED_WORKERS", "1"))
+)
+
+
+class Overloaded(Exception):
+    """Scoring capacity is exhausted; retry_after is a hint in seconds"""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class BudgetExceeded(Overloaded):
+    """The LLM call did not finish within its time budget"""
+
+
+class AdmissionController:
+    """Caps concurrent LLM scoring and bounds how long and how many requests may wait for a slot"""
+
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, max_waiting=MAX_WAITING, queue_timeout=QUEUE_TIMEOUT_SECONDS,
+                 live_reserve=LIVE_RESERVE):
+        self.max_in_flight = max_in_flight
+        self.max_waiting = max_waiting
+        self.queue_timeout = queue_timeout
+        # Background work may use at most this many slots, and only while no live request waits
+        self.background_limit = max(1, max_in_flight - live_reserve)
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._waiting = 0
+        # Exponentially weighted service time, used for Retry-After hints
+        self._service_seconds = 1.0
+        self._metrics = {"admitted": 0, "rejected": 0, "timed_out": 0, "degraded": 0, "background_admitted": 0}
+
+    def retry_after(self):
+        with self._condition:
+            backlog = (self._waiting + 1) / max(1, self.max_in_flight)
+            return max(1, int(math.ceil(backlog * self._service_seconds)))
+
+    def _acquire(self, timeout):
+        expires_at = time.monotonic() + timeout
+        with self._condition:
+            if self._in_flight >= self.max_in_flight and self._waiting >= self.max_waiting:
+                self._metrics["rejected"] += 1
+                raise Overloaded("Scoring queue is full")
+            self._waiting += 1
+            try:
+                while self._in_flight >= self.max_in_flight:
+                    remaining = expires_at - time.monotonic()
+                    if remaining <= 0:
+                        self._metrics["timed_out"] += 1
+                        raise Overloaded("Timed out waiting for a scoring slot")
+                    self._condition.wait(remaining)
+            finally:
+                self._waiting -= 1
+            self._in_flight += 1
+            self._metrics["admitted"] += 1
+
+    def _try_acquire_background(self):
+        with self._condition:
+            if self._waiting or self._in_flight >= min(self.background_limit, self.max_in_flight):
+                raise Overloaded("Scoring slots are reserved for live traffic")
+            self._in_flight += 1
+            self._metrics["background_admitted"] += 1
+
+    def _release(self, elapsed):
+        with self._condition:
+            self._in_flight -= 1
+            self._service_seconds = 0.8 * self._service_seconds + 0.2 * elapsed
+            self._condition.notify()
+
+    @contextmanager
+    def admit(self, timeout=None, background=False):
+        """Hold a scoring slot for the duration of the block; raises Overloaded instead of queueing unboundedly.
+
+        Background callers never wait: they get a slot only below background_limit
+        with no live request waiting, and otherwise poll again after retry_after.
+        """
+        if background:
+            try:
+                self._try_acquire_background()
+            except Overloaded as overloaded:
+                overloaded.retry_after = self.retry_after()
+                raise
+            started = time.monotonic()
+            try:
+                yield
+            finally:
+                self._release(time.monotonic() - started)
+            return
+        timeout = deadline.timeout_for("admission", self.queue_timeout if timeout is None else timeout)
+        try:
+            with profiling.stage("admission"):
+                self._acquire(timeout)
+        except Overloaded as overloaded:
+            # A wait cut short by the request's own deadline is not a capacity problem
+            left = deadline.remaining()
+            if left is not None and left <= deadline.RESPONSE_RESERVE_MS / 1000.0:
+                raise deadline.DeadlineExceeded("admission")
+            overloaded.retry_after = self.retry_after()
+            raise
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - started)
+
+    def record_degraded(self):
+        with self._condition:
+            self._metrics["degraded"] += 1
+
+    def metrics(self):
+        with self._condition:
+            metrics = dict(self._metrics)
+            metrics.update({
+                "in_flight": self._in_flight,
+                "waiting": self._waiting,
+                "max_in_flight": self.max_in_flight,
+                "max_waiting": self.max_waiting,
+                "background_limit": self.background_limit,
+                "queue_timeout_seconds": self.queue_timeout,
+                "service_seconds_ewma": round(self._service_seconds, 3),
+            })
+        return metrics
+
+
+scoring_admission = AdmissionController()
+
+
+def provisional_verdict(data):
+    """Local rule-based verdict, saved and queued for full LLM scoring"""
+    result = local_score(data)
+    result["provisional"] = True
+    analysis_id = DatabaseManager.save_transaction_analysis(data, result)
+    result["analysis_id"] = analysis_id
+    # A verdict not queued here stays flagged in the database and is picked up by the sweeper
+    result["rescore_queued"] = queue_rescore(analysis_id, data)
+    scoring_admission.record_degraded()
+    return result
+
+
+def best_available_verdict(data, stage):
+    """Answer for a request whose deadline ran out: a similar stored verdict, else the local score, else review.
+
+    Nothing is persisted on the request path; full scoring is queued instead.
+    """
+    from .similarity import nearest_verdict
+    result = None
+    try:
+        result = nearest_verdict(data)
+    except Exception as e:
+        print(f"Similar verdict lookup failed: {str(e)}")
+    if result is None:
+        try:
+            result = local_score(data)
+        except Exception as e:
+            print(f"Local scoring failed: {str(e)}")
+            result = {
+                "risk_score": 0.5,
+                "risk_factors": [],
+                "reasoning": "No verdict available within the deadline",
+                "recommended_action": "review",
+                "scorer": "fallback"
+            }
+    result["provisional"] = True
+    result["deadline_exceeded"] = stage
+    result["rescore_queued"] = deferred_queue.submit(score_deferred, data)
+    scoring_admission.record_degraded()
+    return result
+
+
+def _score_when_capacity_allows(data, save_to_db):
+    from .llm_int_deepseek import analyse_transaction_deepseek
+    while True:
+        try:
+            with scoring_admission.admit(background=True):
+                return analyse_transaction_deepseek(data, save_to_db=save_to_db)
+        except BudgetExceeded:
+            raise
+        except Overloaded as overloaded:
+            # Live traffic has priority; poll again once the backlog may have drained
+            time.sleep(overloaded.retry_after)
+
+
+def score_deferred(data):
+    """Full scoring and persistence for a transaction answered early"""
+    _score_when_capacity_allows(data, save_to_db=True)
+
+
+_rescore_lock = threading.Lock()
+# Provisional analyses queued or being rescored, and (attempts, retry_at) of failed ones
+_rescore_pending = set()
+_rescore_backoff = {}
+
+
+def queue_rescore(analysis_id, data):
+    """Queue a provisional verdict for rescoring unless it already is; False if the queue is full"""
+    with _rescore_lock:
+        if analysis_id in _rescore_pending:
+            return True
+        _rescore_pending.add(analysis_id)
+    queued = deferred_queue.submit(rescore_provisional, analysis_id, data)
+    if not queued:
+        with _rescore_lock:
+            _rescore_pending.discard(analysis_id)
+    return queued
+
+
+def rescore_provisional(analysis_id, data):
+    """Replace a provisional verdict with the LLM's once capacity is available.
+
+    A failed attempt leaves the verdict flagged provisional and backs off
+    before the sweeper queues it again.
+    """
+    from .similarity import remember
+    try:
+        result = _score_when_capacity_allows(data, save_to_db=False)
+        replaced = DatabaseManager.replace_analysis_result(analysis_id, result)
+    except Exception:
+        with _rescore_lock:
+            attempts = _rescore_backoff.get(analysis_id, (0, 0.0))[0] + 1
+            delay = min(RESCORE_BACKOFF_MAX_SECONDS, RESCORE_BACKOFF_SECONDS * 2 ** (attempts - 1))
+            _rescore_backoff[analysis_id] = (attempts, time.monotonic() + delay)
+        raise
+    finally:
+        with _rescore_lock:
+            _rescore_pending.discard(analysis_id)
+    with _rescore_lock:
+        _rescore_backoff.pop(analysis_id, None)
+    if replaced:
+        remember(analysis_id, data, result)
+
+
+def sweep_provisional(limit=RESCORE_SWEEP_BATCH):
+    """Queue stored provisional verdicts that are not queued and past their backoff; returns how many"""
+    now = time.monotonic()
+    queued = 0
+    for analysis_id, transaction_data in DatabaseManager.get_provisional_analyses(limit):
+        with _rescore_lock:
+            if analysis_id in _rescore_pending or _rescore_backoff.get(analysis_id, (0, 0.0))[1] > now:
+                continue
+        if not queue_rescore(analysis_id, json.loads(transaction_data)):
+            break
+        queued += 1
+    return queued
+
+
+def start_rescore_sweeper(app, interval=RESCORE_SWEEP_SECONDS):
+    """Sweep provisional verdicts from a daemon thread, covering dropped, failed and pre-restart rescores"""
+    if interval <= 0:
+        return None
+
+    def run():
+        while True:
+            try:
+                with app.app_context():
+                    sweep_provisional()
+            except Exception as e:
+                print(f"Provisional sweep failed: {str(e)}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name="provisional-sweeper", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,162 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from dotenv import load_dotenv
+from .shared_state import SHARED_STATE_URL
+
+load_dotenv()
+
+SUBSCRIBER_BUFFER_SIZE = int(os.getenv("ALERT_STREAM_BUFFER_SIZE", "256"))
+HISTORY_SIZE = int(os.getenv("ALERT_STREAM_HISTORY_SIZE", "1024"))
+MAX_SUBSCRIBERS = int(os.getenv("ALERT_STREAM_MAX_SUBSCRIBERS", "100"))
+HEARTBEAT_SECONDS = float(os.getenv("ALERT_STREAM_HEARTBEAT", "15"))
+# Each process only fans out its own alerts. With several processes (any shared
+# state backend) one poller per process reads every process's alerts from the
+# database this often and feeds its broker instead; 0 disables polling.
+POLL_SECONDS = float(os.getenv("ALERT_STREAM_POLL_SECONDS", "0" if SHARED_STATE_URL.startswith("memory:") else "2"))
+
+
+class Subscription:
+    """Bounded per-subscriber buffer; the oldest events are dropped when a slow reader falls behind"""
+
+    def __init__(self, buffer_size):
+        self._events = deque(maxlen=buffer_size)
+        self._condition = threading.Condition()
+        self.lagged = False
+
+    def push(self, event):
+        with self._condition:
+            if len(self._events) == self._events.maxlen:
+                self.lagged = True
+            self._events.append(event)
+            self._condition.notify()
+
+    def drain(self, timeout):
+        """Wait up to timeout for events; returns (events, lagged) and resets the lag flag"""
+        with self._condition:
+            if not self._events:
+                self._condition.wait(timeout)
+            events = list(self._events)
+            self._events.clear()
+            lagged, self.lagged = self.lagged, False
+            return events, lagged
+
+
+class AlertBroker:
+    """In-process fan-out of high-risk alerts to SSE subscribers.
+
+    With poll_seconds set, alerts come from a single poller thread that reads
+    the database past its cursor while anyone is subscribed, so alerts saved by
+    other processes arrive too, in id order, for the cost of one query per
+    interval however many streams are open.
+    """
+
+    def __init__(self, buffer_size=SUBSCRIBER_BUFFER_SIZE, history_size=HISTORY_SIZE,
+                 max_subscribers=MAX_SUBSCRIBERS, poll_seconds=POLL_SECONDS):
+        self.buffer_size = buffer_size
+        self.max_subscribers = max_subscribers
+        self.poll_seconds = poll_seconds
+        self._history = deque(maxlen=history_size)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._poller = None
+        self._poll_cursor = None
+
+    def subscribe(self):
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            subscription = Subscription(self.buffer_size)
+            self._subscribers.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, event):
+        """Fan out an alert committed by this process; when polling, the poller delivers it in order instead"""
+        if self.poll_seconds:
+            return
+        self._fan_out(event)
+
+    def _fan_out(self, event):
+        with self._lock:
+            self._history.append(event)
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.push(event)
+
+    def retract(self, event_id):
+        """Drop an alert from the replay history, e.g. once its analysis is no longer high risk"""
+        with self._lock:
+            self._history = deque((event for event in self._history if event["id"] != event_id),
+                                  maxlen=self._history.maxlen)
+
+    def replay_since(self, last_event_id):
+        """Events after last_event_id from memory, or None if the history no longer reaches back that far"""
+        with self._lock:
+            history = list(self._history)
+        if not history or history[0]["id"] > last_event_id + 1:
+            return None
+        return [event for event in history if event["id"] > last_event_id]
+
+    def follow(self, app, fetch, cursor):
+        """Make sure the poller runs, reading fetch(last_id) from cursor on if it has to start"""
+        with self._lock:
+            if self._poller is not None:
+                return
+            self._poll_cursor = cursor if self._poll_cursor is None else max(self._poll_cursor, cursor)
+            self._poller = threading.Thread(target=self._poll, args=(app, fetch), name="alert-poller", daemon=True)
+            self._poller.start()
+
+    def _poll(self, app, fetch):
+        while True:
+            time.sleep(self.poll_seconds)
+            with self._lock:
+                # Checked under the lock so a stream subscribing now either is seen here or restarts the poller
+                if not self._subscribers:
+                    self._poller = None
+                    return
+            try:
+                # The database holds every process's alerts, and SQLite commits in id
+                # order, so reading past the cursor misses none
+                with app.app_context():
+                    events = fetch(self._poll_cursor)
+            except Exception as e:
+                print(f"Alert poll failed: {str(e)}")
+                continue
+            for event in events:
+                self._fan_out(event)
+                self._poll_cursor = event["id"]
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+
+alert_broker = AlertBroker()
+
+
+def build_alert_event(analysis_id, transaction_data, llm_response, created_at=None):
+    """Compact alert payload; the event id is the analysis id so clients can resume across restarts"""
+    if isinstance(transaction_data, str):
+        transaction_data = json.loads(transaction_data or "{}")
+    if not isinstance(llm_response, dict):
+        llm_response = {}
+    return {
+        "id": analysis_id,
+        "alert_type": "high_risk_transaction",
+        "transaction_id": transaction_data.get("transaction_id", ""),
+        "risk_score": float(llm_response.get("risk_score", 0.0)),
+        "recommended_action": llm_response.get("recommended_action", "review"),
+        "risk_factors": llm_response.get("risk_factors", []),
+        "created_at": created_at.isoformat() if created_at else None
+    }
+
+
+def format_sse(event):
+    return f"id: {event['id']}\nevent: high_risk_transaction\ndata: {json.dumps(event, separators=(',', ':'))}\n\n"
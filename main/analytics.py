@@ -0,0 +1,77 @@
+import json
+import click
+from flask.cli import with_appcontext
+from .risk_config import RISK_BANDS, score_bucket
+
+# Dimensions maintained in risk_rollups; "total" has a single value per day
+ROLLUP_DIMENSIONS = ("total", "category", "customer_country", "payment_country", "score_bucket")
+GROUP_BY = ("day",) + ROLLUP_DIMENSIONS[1:]
+UNKNOWN = "unknown"
+
+
+def _value(value, upper=False):
+    if value is None or value == "":
+        return UNKNOWN
+    value = str(value)[:64]
+    return value.upper() if upper else value.lower()
+
+
+def rollup_keys(transaction, risk_score):
+    """(dimension, value) pairs an analysis contributes to"""
+    if isinstance(transaction, str):
+        try:
+            transaction = json.loads(transaction)
+        except ValueError:
+            transaction = {}
+    if not isinstance(transaction, dict):
+        transaction = {}
+    customer = transaction.get("customer") or {}
+    payment_method = transaction.get("payment_method") or {}
+    merchant = transaction.get("merchant") or {}
+    return [
+        ("total", "all"),
+        ("category", _value(merchant.get("category"))),
+        ("customer_country", _value(customer.get("country"), upper=True)),
+        ("payment_country", _value(payment_method.get("country_of_issue"), upper=True)),
+        # Zero-padded so buckets sort numerically as strings
+        ("score_bucket", f"{score_bucket(risk_score):03d}"),
+    ]
+
+
+def build_trend_rows(rows, group_by):
+    """Fold (key, recommended_action, count, score_sum) rows into one trend row per key"""
+    trends = {}
+    for key, action, count, score_sum in rows:
+        key = key.isoformat() if hasattr(key, "isoformat") else key
+        trend = trends.setdefault(key, {group_by: key, "total": 0, "score_sum": 0.0,
+                                        **{band: 0 for band in RISK_BANDS}})
+        trend["total"] += count
+        trend["score_sum"] += score_sum or 0.0
+        trend[action] = trend.get(action, 0) + count
+
+    result = []
+    for key in sorted(trends):
+        trend = trends[key]
+        total = trend["total"]
+        score_sum = trend.pop("score_sum")
+        if total <= 0:
+            continue
+        trend["block_rate"] = trend.get("block", 0) / total
+        trend["review_rate"] = trend.get("review", 0) / total
+        trend["mean_score"] = score_sum / total
+        result.append(trend)
+    return result
+
+
+@click.command("rebuild-rollups")
+@with_appcontext
+def rebuild_rollups_command():
+    """Recompute the risk summary, profiles and analytics rollups from stored analyses (after upgrades or threshold changes)."""
+    from .database_manager import DatabaseManager
+
+    count = DatabaseManager.rebuild_risk_summary()
+    click.echo(f"Rebuilt risk summary from {count} analyses.")
+    count = DatabaseManager.rebuild_risk_profiles()
+    click.echo(f"Rebuilt merchant and customer profiles from {count} analyses.")
+    count = DatabaseManager.rebuild_risk_rollups()
+    click.echo(f"Rebuilt rollups from {count} analyses.")
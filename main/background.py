@@ -0,0 +1,68 @@
+import queue
+import threading
+from flask import current_app
+
+
+class BackgroundQueue:
+    """Bounded queue of tasks run off the request path by daemon threads.
+
+    Tasks run inside an app context of the app that submitted them. When the
+    queue is full new tasks are dropped rather than blocking the caller.
+    """
+
+    def __init__(self, name, maxsize=100, workers=1):
+        self.name = name
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._metrics = {"submitted": 0, "dropped": 0, "completed": 0, "failed": 0}
+
+    def _ensure_started(self):
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            for i in range(len(self._threads), self.workers):
+                thread = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, task, *args, **kwargs):
+        """Queue task(*args, **kwargs); returns False if the queue is full"""
+        app = current_app._get_current_object()
+        try:
+            self._queue.put_nowait((app, task, args, kwargs))
+        except queue.Full:
+            with self._lock:
+                self._metrics["dropped"] += 1
+            return False
+        with self._lock:
+            self._metrics["submitted"] += 1
+        self._ensure_started()
+        return True
+
+    def _run(self):
+        while True:
+            app, task, args, kwargs = self._queue.get()
+            try:
+                with app.app_context():
+                    task(*args, **kwargs)
+                outcome = "completed"
+            except Exception as e:
+                print(f"Background task in {self.name} failed: {str(e)}")
+                outcome = "failed"
+            finally:
+                self._queue.task_done()
+            with self._lock:
+                self._metrics[outcome] += 1
+
+    def join(self):
+        """Block until every queued task has run (used by tests and shutdown hooks)"""
+        self._queue.join()
+
+    def metrics(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+        metrics["queued"] = self._queue.qsize()
+        metrics["capacity"] = self._queue.maxsize
+        metrics["workers"] = self.workers
+        return metrics
@@ -0,0 +1,139 @@
+import math
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# off: one provider call per request; combined: collected transactions are scored in a single
+# provider call. Concurrent single calls already reuse the shared session's pooled connections.
+BATCH_MODE = os.getenv("LLM_BATCH_MODE", "off")
+BATCH_MAX_SIZE = int(os.getenv("LLM_BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.getenv("LLM_BATCH_MAX_WAIT_MS", "5"))
+BATCH_CONCURRENCY = int(os.getenv("LLM_BATCH_CONCURRENCY", "16"))
+
+
+class MicroBatcher:
+    """Collects concurrently submitted items into batches for a dispatch function.
+
+    The collection window adapts to load: it is the time the observed
+    inter-arrival rate needs to fill a batch, capped at max_wait_ms, so sparse
+    traffic is dispatched immediately and bursts are grouped. The batch size
+    adapts too, up to max_batch: a batch holds what arrives within the latency
+    budget, or more when the dispatch pool needs bigger batches to keep pace
+    with arrivals at the observed dispatch latency. dispatch(items)
+    returns one result (or Exception instance) per item, in order; batches are
+    dispatched on a bounded pool so collection continues while calls run.
+    """
+
+    def __init__(self, name, dispatch, max_batch=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS,
+                 concurrency=BATCH_CONCURRENCY):
+        self.name = name
+        self.dispatch = dispatch
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.concurrency = concurrency
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last_arrival = None
+        self._interarrival = None
+        self._dispatch_seconds = None
+        self._metrics = {"items": 0, "batches": 0, "max_batch_seen": 0}
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._collect, name=f"{self.name}-collector", daemon=True)
+                self._thread.start()
+
+    def _plan(self):
+        """(collection window in seconds, batch size) from the arrival and dispatch latency estimates"""
+        with self._lock:
+            interarrival = self._interarrival
+            dispatch_seconds = self._dispatch_seconds
+        max_wait = self.max_wait
+        if dispatch_seconds is not None:
+            # Never add more than a few percent to the provider's own latency
+            max_wait = min(max_wait, 0.05 * dispatch_seconds)
+        if interarrival is None or interarrival <= 0:
+            return 0.0, self.max_batch
+        # Items that arrive within the budget, and the size that lets `concurrency` calls of
+        # dispatch_seconds each absorb one arrival every interarrival seconds
+        size = 1 + int(max_wait / interarrival)
+        if dispatch_seconds is not None:
+            size = max(size, math.ceil(dispatch_seconds / (interarrival * self.concurrency)))
+        size = max(1, min(self.max_batch, size))
+        if interarrival >= max_wait:
+            return 0.0, size
+        return min(max_wait, interarrival * (size - 1)), size
+
+    def window(self):
+        """Current collection window in seconds"""
+        return self._plan()[0]
+
+    def batch_size(self):
+        """Current batch size limit"""
+        return self._plan()[1]
+
+    def submit(self, item):
+        """Queue an item; the returned Future resolves to its result"""
+        now = time.monotonic()
+        with self._lock:
+            if self._last_arrival is not None:
+                gap = now - self._last_arrival
+                self._interarrival = gap if self._interarrival is None else 0.8 * self._interarrival + 0.2 * gap
+            self._last_arrival = now
+        future = Future()
+        self._queue.put((item, future))
+        self._ensure_started()
+        return future
+
+    def _collect(self):
+        while True:
+            batch = [self._queue.get()]
+            window, size = self._plan()
+            expires_at = time.monotonic() + window
+            while len(batch) < size:
+                remaining = expires_at - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            with self._lock:
+                self._metrics["items"] += len(batch)
+                self._metrics["batches"] += 1
+                self._metrics["max_batch_seen"] = max(self._metrics["max_batch_seen"], len(batch))
+            self._executor.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch):
+        futures = [future for _, future in batch]
+        started = time.monotonic()
+        try:
+            results = self.dispatch([item for item, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self._dispatch_seconds = elapsed if self._dispatch_seconds is None \
+                else 0.8 * self._dispatch_seconds + 0.2 * elapsed
+        for future, result in zip(futures, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def metrics(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+        metrics["mean_batch_size"] = metrics["items"] / metrics["batches"] if metrics["batches"] else None
+        window, size = self._plan()
+        metrics["window_ms"] = round(window * 1000, 3)
+        metrics["batch_size"] = size
+        metrics["dispatch_ms_ewma"] = round(self._dispatch_seconds * 1000, 1) if self._dispatch_seconds else None
+        metrics["queued"] = self._queue.qsize()
+        return metrics
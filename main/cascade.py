@@ -0,0 +1,94 @@
+import os
+import threading
+from dotenv import load_dotenv
+from .risk_config import get_thresholds
+from .warmup import provider_health
+
+load_dotenv()
+
+# A cheap first tier scores every transaction; only scores inside the uncertainty band go on to
+# the stronger model. Tiers are provider specs (see providers.get_provider); "deepseek" as the
+# first tier is the regular scoring path, with profiles, similar cases and batching.
+CASCADE_ENABLED = os.getenv("CASCADE_ENABLED", "0") == "1"
+CASCADE_FIRST = os.getenv("CASCADE_FIRST", "deepseek")
+CASCADE_ESCALATE = os.getenv("CASCADE_ESCALATE", "openai:inline:gpt-4o")
+# "low,high"; empty uses the review range [review_threshold, block_threshold)
+CASCADE_BAND = os.getenv("CASCADE_BAND", "")
+
+
+def uncertainty_band(band=None):
+    band = CASCADE_BAND if band is None else band
+    if not band:
+        return get_thresholds()
+    low, high = (float(part) for part in band.split(","))
+    if not 0.0 <= low <= high <= 1.0:
+        raise ValueError(f"Invalid CASCADE_BAND: {band!r}")
+    return low, high
+
+
+def is_uncertain(score, band=None):
+    low, high = uncertainty_band(band)
+    return low <= float(score) < high
+
+
+class CascadeStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {"scored": 0, "escalated": 0, "escalation_failed": 0}
+
+    def record(self, escalated, failed=False):
+        with self._lock:
+            self._counts["scored"] += 1
+            self._counts["escalated"] += int(escalated)
+            self._counts["escalation_failed"] += int(failed)
+
+    def metrics(self):
+        with self._lock:
+            counts = dict(self._counts)
+        counts["escalation_rate"] = counts["escalated"] / counts["scored"] if counts["scored"] else None
+        return counts
+
+
+cascade_stats = CascadeStats()
+
+
+def run_cascade(data, first_tier, first=None, escalate=None, band=None):
+    """Score with the first tier and escalate uncertain scores.
+
+    first_tier scores with the regular path when the first tier spec is
+    "deepseek". The result carries decision_path, e.g. "deepseek" or
+    "deepseek>openai:inline:gpt-4o"; if escalation fails, or the provider's
+    health probes are failing, the first tier's verdict stands and the path
+    ends in "!".
+    """
+    from .providers import get_provider
+
+    first = CASCADE_FIRST if first is None else first
+    escalate = CASCADE_ESCALATE if escalate is None else escalate
+    result = first_tier(data) if first == "deepseek" else get_provider(first)(data)
+    path = first
+
+    if escalate and is_uncertain(result.get("risk_score", 0.0), band):
+        if not provider_health.is_healthy(escalate.split(":", 1)[0]):
+            cascade_stats.record(escalated=True, failed=True)
+            return {**result, "decision_path": f"{first}>{escalate}!"}
+        try:
+            escalated = get_provider(escalate)(data)
+        except Exception as e:
+            print(f"Cascade escalation to {escalate} failed, keeping {first} verdict: "
+                  f"{getattr(e, 'description', None) or str(e)}")
+            cascade_stats.record(escalated=True, failed=True)
+            return {**result, "decision_path": f"{first}>{escalate}!"}
+        cascade_stats.record(escalated=True)
+        return {**escalated, "first_tier_score": result.get("risk_score"), "decision_path": f"{first}>{escalate}"}
+
+    cascade_stats.record(escalated=False)
+    return {**result, "decision_path": path}
+
+
+def cascade_metrics():
+    """Escalation counters, None when the cascade is off"""
+    if not CASCADE_ENABLED:
+        return None
+    low, high = uncertainty_band()
+    return {"first": CASCADE_FIRST, "escalate": CASCADE_ESCALATE, "band": [low, high], **cascade_stats.metrics()}
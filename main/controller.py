@@ -1,16 +1,53 @@
-from flask import Blueprint, request, jsonify, abort
-from .get_financial_risk import get_financial_risk_analysis, get_high_risk_history, get_risk_history
+from flask import Blueprint, request, jsonify, abort, Response, stream_with_context, g, current_app
+from .get_financial_risk import get_financial_risk_analysis, get_high_risk_history, get_risk_history, get_filtered_risk_history, get_risk_summary, get_history_version, get_high_risk_alerts_since, get_latest_analysis_id, get_llm_usage_report, get_shadow_report, get_profiles, get_alerts, update_alerts, get_risk_trends
+from .shadow import shadow_queue
+from .admission import scoring_admission, deferred_queue
+from .alert_stream import alert_broker, format_sse, HEARTBEAT_SECONDS
+from .worker_pool import get_scoring_pool, PoolSaturated
+from .http_cache import conditional_history, parse_fields, project_fields
+from .analytics import ROLLUP_DIMENSIONS
+from .cascade import cascade_metrics
+from .risk_config import normalize_risk_level, RISK_BANDS
 from .validator import validate_transaction
-from .llm_int_deepseek import analyse_transaction_deepseek
+from .llm_int_deepseek import analyse_transaction_deepseek, batching_metrics
 from .authenticator import require_auth
+from .deadline import start_deadline
+from .profiling import begin_request, finish_request, slow_requests, sampling_profiler, stage, PROFILER_INTERVAL_MS
+from .sql_instrumentation import begin_scope, end_scope, sql_stats
+from .history_export import generate_json_array, generate_ndjson, EXPORT_FIELDS
+from .database_manager import DatabaseManager
+from .warmup import health_report
 import json
+import os
+import time
+from datetime import datetime
 
 main_bp = Blueprint('main', __name__)
 
+
+@main_bp.before_request
+def start_request_profile():
+    g.request_profile = begin_request(request.method, request.path)
+    g.sql_scope = begin_scope()
+
+
+@main_bp.after_request
+def finish_request_profile(response):
+    repeated = end_scope(g.pop("sql_scope", None))
+    finish_request(g.pop("request_profile", None), response.status_code, repeated)
+    return response
+
+
+@main_bp.teardown_request
+def discard_request_profile(exception=None):
+    repeated = end_scope(g.pop("sql_scope", None))
+    finish_request(g.pop("request_profile", None), 500, repeated)
+
 @main_bp.route("/transaction", methods=["POST"])
 @require_auth
 def create_transaction():
     try:
+        start_deadline(request.headers)
         transaction = request.get_json(force=True)
         
         llm_response= get_financial_risk_analysis(transaction, save_to_db=True)
@@ -25,34 +62,110 @@ def create_transaction():
             "error": "Internal server error",
             "details": str(e)
         }), 500
+
+
+MAX_SCORE_BATCH = int(os.getenv("MAX_SCORE_BATCH", "10000"))
+
+
+@main_bp.route("/transactions/score-batch", methods=["POST"])
+@require_auth
+def score_transaction_batch():
+    """Locally score a list of transactions on the worker pool, without LLM calls or persistence"""
+    transactions = request.get_json(force=True, silent=True)
+    if not isinstance(transactions, list):
+        return jsonify({"error": "Request body must be a JSON list of transactions"}), 422
+    if len(transactions) > MAX_SCORE_BATCH:
+        return jsonify({"error": f"Batch exceeds {MAX_SCORE_BATCH} transactions"}), 413
+
+    try:
+        results = get_scoring_pool().score_batch(transactions)
+    except PoolSaturated as ps:
+        response = jsonify({"error": str(ps)})
+        response.headers["Retry-After"] = "1"
+        return response, 503
+
+    return jsonify({
+        "success": True,
+        "results": results,
+        "count": len(results),
+        "errors": sum(1 for result in results if "error" in result)
+    })
+
+
+@main_bp.route("/admin/worker-pool", methods=["GET"])
+@require_auth
+def get_worker_pool_metrics():
+    return jsonify({"success": True, "worker_pool": get_scoring_pool().metrics()})
+
+
+@main_bp.route("/health", methods=["GET"])
+def health():
+    """Unauthenticated liveness check; provider details are on /admin/providers"""
+    return jsonify({"status": health_report()["status"]})
+
+
+@main_bp.route("/admin/providers", methods=["GET"])
+@require_auth
+def get_provider_health():
+    return jsonify({"success": True, **health_report()})
+
+
+@main_bp.route("/admin/admission", methods=["GET"])
+@require_auth
+def get_admission_metrics():
+    return jsonify({
+        "success": True,
+        "admission": scoring_admission.metrics(),
+        "deferred_rescoring": deferred_queue.metrics(),
+        "batching": batching_metrics(),
+        "cascade": cascade_metrics()
+    })
+
     
 @main_bp.route("/analyses", methods=["GET"])
 @require_auth
+@conditional_history(get_history_version)
 def get_analyses():
     try:
         risk_level = request.args.get('risk_level', None)
-        
-        if risk_level == 'high':
-            analyses = get_high_risk_history()
-        else:
-            analyses = get_risk_history()
+        recommended_action = request.args.get('recommended_action', None)
+        band = normalize_risk_level(risk_level)
+
+        if risk_level is not None and band is None:
+            return jsonify({"error": f"Unknown risk_level: {risk_level}"}), 400
+        if recommended_action is not None and recommended_action not in RISK_BANDS:
+            return jsonify({"error": f"Unknown recommended_action: {recommended_action}"}), 400
+
+        limit = request.args.get('limit', 100, type=int)
+        offset = request.args.get('offset', 0, type=int)
+
+        with stage("query"):
+            if risk_level == 'high' and recommended_action is None:
+                analyses = get_high_risk_history()
+            elif band is not None or recommended_action is not None:
+                analyses = get_filtered_risk_history(band, recommended_action, limit, offset)
+            else:
+                analyses = get_risk_history()
             
         if analyses is None:
             analyses = []
 
-        transformed_analyses = []
-        for analysis in analyses:
-            transaction_data = analysis.get("transaction_data", {})
-            if isinstance(transaction_data, str):
-                transaction_data = json.loads(transaction_data)
+        with stage("serialize"):
+            transformed_analyses = []
+            for analysis in analyses:
+                transaction_data = analysis.get("transaction_data", {})
+                if isinstance(transaction_data, str):
+                    transaction_data = json.loads(transaction_data)
 
-            transformed_analyses.append({
-                "transaction_id": transaction_data.get("transaction_id", ""),
-                "risk_score": analysis.get("risk_score", 0.0),
-                "recommended_action": analysis.get("recommended_action", ""),
-                "created_at": analysis.get("created_at", ""),
-                "transaction_details": transaction_data
-            })
+                transformed_analyses.append({
+                    "transaction_id": transaction_data.get("transaction_id", ""),
+                    "risk_score": analysis.get("risk_score", 0.0),
+                    "recommended_action": analysis.get("recommended_action", ""),
+                    "created_at": analysis.get("created_at", ""),
+                    "transaction_details": transaction_data
+                })
+
+            transformed_analyses = project_fields(transformed_analyses, parse_fields(request.args.get('fields')))
 
         return jsonify({
             'success': True,
@@ -64,9 +177,185 @@ def get_analyses():
         abort(500, description=f"Failed to retrieve analyses: {str(e)}")
 
 
+@main_bp.route("/analyses/export", methods=["GET"])
+@require_auth
+def export_analyses():
+    """Stream history newest first as NDJSON (default) or a JSON array, a chunk of rows at a time.
+
+    Filters match /analyses; resume an interrupted export with before_id=<last id received>.
+    """
+    risk_level = request.args.get('risk_level', None)
+    recommended_action = request.args.get('recommended_action', None)
+    band = normalize_risk_level(risk_level)
+    if risk_level is not None and band is None:
+        return jsonify({"error": f"Unknown risk_level: {risk_level}"}), 400
+    if recommended_action is not None and recommended_action not in RISK_BANDS:
+        return jsonify({"error": f"Unknown recommended_action: {recommended_action}"}), 400
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'json'):
+        return jsonify({"error": "format must be ndjson or json"}), 400
+    fields = parse_fields(request.args.get('fields'))
+    if fields and not set(fields) <= set(EXPORT_FIELDS):
+        return jsonify({"error": f"Unknown fields; available: {', '.join(EXPORT_FIELDS)}"}), 400
+
+    rows = DatabaseManager.iter_history_rows(
+        band=band,
+        recommended_action=recommended_action,
+        before_id=request.args.get('before_id', None, type=int),
+        limit=request.args.get('limit', None, type=int)
+    )
+    if export_format == 'json':
+        return Response(stream_with_context(generate_json_array(rows, fields)), mimetype="application/json")
+    return Response(stream_with_context(generate_ndjson(rows, fields)), mimetype="application/x-ndjson")
+
+
+@main_bp.route("/analyses/summary", methods=["GET"])
+@require_auth
+def get_analyses_summary():
+    summary = get_risk_summary()
+    if summary is None:
+        abort(500, description="Failed to retrieve risk summary")
+    return jsonify({"success": True, **summary})
+
+
+@main_bp.route("/analytics/risk", methods=["GET"])
+@require_auth
+@conditional_history(get_history_version)
+def get_risk_analytics():
+    """Risk trends from the rollups, e.g. ?group_by=day&category=electronics&since=2025-05-01"""
+    group_by = request.args.get("group_by", "day")
+    filters = [(dimension, request.args[dimension]) for dimension in ROLLUP_DIMENSIONS[1:] if dimension in request.args]
+    if len(filters) > 1:
+        return jsonify({"error": "At most one dimension filter is supported"}), 400
+    dimension, value = filters[0] if filters else (None, None)
+    if dimension in ("customer_country", "payment_country"):
+        value = value.upper()
+    elif dimension == "category":
+        value = value.lower()
+
+    try:
+        since = request.args.get("since")
+        until = request.args.get("until")
+        since = datetime.fromisoformat(since).date() if since else None
+        until = datetime.fromisoformat(until).date() if until else None
+        trends = get_risk_trends(group_by, since, until, dimension, value)
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+
+    return jsonify({"success": True, "group_by": group_by, "trends": trends, "count": len(trends)})
+
+
+@main_bp.route("/admin/usage", methods=["GET"])
+@require_auth
+def get_llm_usage():
+    """Token and cost totals, e.g. /admin/usage?since=2025-05-01&until=2025-06-01&group_by=model"""
+    try:
+        since = request.args.get("since")
+        until = request.args.get("until")
+        since = datetime.fromisoformat(since) if since else None
+        until = datetime.fromisoformat(until) if until else None
+        group_by = request.args.get("group_by", "api_key")
+        report = get_llm_usage_report(since, until, group_by)
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+
+    return jsonify({
+        "success": True,
+        "group_by": group_by,
+        "usage": report,
+        "totals": {
+            "calls": sum(row["calls"] for row in report),
+            "total_tokens": sum(row["total_tokens"] for row in report),
+            "cost": sum(row["cost"] for row in report)
+        }
+    })
+
+
+@main_bp.route("/admin/slow-requests", methods=["GET"])
+@require_auth
+def get_slow_requests():
+    """Most recent requests slower than SLOW_REQUEST_MS, newest first, with stage timings and SQL"""
+    limit = request.args.get("limit", None, type=int)
+    return jsonify({
+        "success": True,
+        "slow_requests": slow_requests.entries(limit),
+        "buffer": slow_requests.metrics()
+    })
+
+
+@main_bp.route("/admin/sql", methods=["GET", "DELETE"])
+@require_auth
+def get_sql_statistics():
+    """Statement totals by fingerprint, e.g. /admin/sql?order_by=max_ms&limit=10; DELETE resets them"""
+    if request.method == "DELETE":
+        sql_stats.reset()
+    try:
+        statements = sql_stats.report(request.args.get("order_by", "total_ms"),
+                                      request.args.get("limit", 20, type=int))
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    return jsonify({"success": True, "statements": statements})
+
+
+@main_bp.route("/admin/profiler", methods=["GET", "POST", "DELETE"])
+@require_auth
+def sampling_profiler_control():
+    """POST {"seconds": 30, "interval_ms": 5} starts a sampling window, DELETE stops it;
+    GET reports progress, or the collapsed stacks with ?format=collapsed"""
+    if request.method == "POST":
+        options = request.get_json(silent=True) or {}
+        try:
+            started = sampling_profiler.start(float(options.get("seconds", 30)),
+                                              float(options.get("interval_ms", PROFILER_INTERVAL_MS)))
+        except (TypeError, ValueError) as ve:
+            return jsonify({"error": str(ve)}), 400
+        if not started:
+            return jsonify({"error": "Profiler is already running", "profiler": sampling_profiler.status()}), 409
+        return jsonify({"success": True, "profiler": sampling_profiler.status()}), 202
+    if request.method == "DELETE":
+        sampling_profiler.stop()
+    if request.args.get("format") == "collapsed":
+        return Response(sampling_profiler.collapsed(), mimetype="text/plain")
+    return jsonify({"success": True, "profiler": sampling_profiler.status()})
+
+
+@main_bp.route("/profiles/<entity_id>", methods=["GET"])
+@require_auth
+def get_entity_profiles(entity_id):
+    """Running merchant/customer history, e.g. /profiles/merch_1?type=merchant"""
+    entity_type = request.args.get("type")
+    if entity_type not in (None, "merchant", "customer"):
+        return jsonify({"error": "type must be merchant or customer"}), 400
+
+    profiles, cache_stats = get_profiles(entity_id, entity_type)
+    if not profiles:
+        return jsonify({"error": "Profile not found"}), 404
+    return jsonify({"success": True, "profiles": profiles, "cache": cache_stats})
+
+
+@main_bp.route("/admin/shadow/report", methods=["GET"])
+@require_auth
+def get_shadow_evaluation_report():
+    """Agreement and latency of shadow candidates against the primary scorer"""
+    try:
+        since = request.args.get("since")
+        since = datetime.fromisoformat(since) if since else None
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+
+    return jsonify({
+        "success": True,
+        "candidates": get_shadow_report(request.args.get("candidate"), since),
+        "queue": shadow_queue.metrics()
+    })
+
+
 @main_bp.route("/admin/notifications", methods=["GET"])
 @require_auth  
+@conditional_history(get_history_version)
 def get_admin_notifications():
+    if "status" in request.args or "since" in request.args:
+        return get_alert_queue()
     try:
         high_risk_analyses = get_high_risk_history()
         if high_risk_analyses is None:
@@ -103,6 +392,8 @@ def get_admin_notifications():
                 print(f"Error processing analysis: {str(e)}")
                 continue
 
+        notifications = project_fields(notifications, parse_fields(request.args.get('fields')))
+
         return jsonify({
             "success": True,
             "notifications": notifications,
@@ -111,3 +402,113 @@ def get_admin_notifications():
 
     except Exception as e:
         abort(500, description=f"Failed to retrieve admin notifications: {str(e)}")
+
+
+MAX_ALERT_PAGE = 1000
+MAX_ALERT_UPDATE = int(os.getenv("MAX_ALERT_UPDATE", "10000"))
+
+
+def get_alert_queue():
+    """Alerts in one triage state after a cursor, e.g. ?status=open&since=1234; cost follows new alerts only"""
+    try:
+        since = int(request.args.get("since", 0))
+        limit = max(1, min(int(request.args.get("limit", 500)), MAX_ALERT_PAGE))
+        alerts = get_alerts(request.args.get("status", "open"), since, limit)
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+
+    cursor = alerts[-1]["id"] if alerts else since
+    alerts = project_fields(alerts, parse_fields(request.args.get('fields')))
+    return jsonify({
+        "success": True,
+        "notifications": alerts,
+        "count": len(alerts),
+        "cursor": cursor
+    }), 200
+
+
+@main_bp.route("/admin/notifications/ack", methods=["POST"])
+@require_auth
+def acknowledge_notifications():
+    """Bulk state change from {"ids": [...]} or {"up_to": id}; "status" defaults to acknowledged"""
+    body = request.get_json(force=True, silent=True) or {}
+    ids = body.get("ids")
+    up_to = body.get("up_to")
+    try:
+        if ids is not None:
+            if not isinstance(ids, list):
+                raise ValueError("ids must be a list of analysis ids")
+            if len(ids) > MAX_ALERT_UPDATE:
+                return jsonify({"error": f"At most {MAX_ALERT_UPDATE} ids per request"}), 413
+            ids = [int(analysis_id) for analysis_id in ids]
+        if up_to is not None:
+            up_to = int(up_to)
+        updated = update_alerts(body.get("status", "acknowledged"), ids, up_to, body.get("assignee"))
+    except (TypeError, ValueError) as ve:
+        return jsonify({"error": str(ve)}), 400
+
+    return jsonify({"success": True, "updated": updated})
+
+
+@main_bp.route("/admin/notifications/stream", methods=["GET"])
+@require_auth
+def stream_admin_notifications():
+    """Server-Sent Events stream of new high-risk transactions, resumable with Last-Event-ID"""
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    try:
+        last_event_id = int(last_event_id) if last_event_id is not None else None
+    except ValueError:
+        return jsonify({"error": "Last-Event-ID must be an integer"}), 400
+
+    # Without Last-Event-ID the stream starts at the newest analysis; taking that cursor before
+    # subscribing lets a lagged buffer be refilled from it instead of losing the gap
+    start_after = last_event_id if last_event_id is not None else get_latest_analysis_id()
+
+    subscription = alert_broker.subscribe()
+    if subscription is None:
+        response = jsonify({"error": "Too many alert stream subscribers"})
+        response.headers["Retry-After"] = "30"
+        return response, 503
+    if alert_broker.poll_seconds:
+        alert_broker.follow(current_app._get_current_object(), get_high_risk_alerts_since, start_after)
+
+    def backlog_since(event_id):
+        events = alert_broker.replay_since(event_id)
+        if events is None:
+            events = get_high_risk_alerts_since(event_id)
+        return events
+
+    def generate():
+        last_sent = start_after
+        try:
+            yield "retry: 3000\n\n"
+            if last_event_id is not None:
+                for event in backlog_since(last_sent):
+                    last_sent = event["id"]
+                    yield format_sse(event)
+
+            idle_since = time.monotonic()
+            while True:
+                events, lagged = subscription.drain(HEARTBEAT_SECONDS)
+                if lagged:
+                    # The buffer overflowed; fill the gap before continuing with live events
+                    events = backlog_since(last_sent) + events
+                events = [event for event in events if event["id"] > last_sent]
+                if not events:
+                    if time.monotonic() - idle_since >= HEARTBEAT_SECONDS:
+                        idle_since = time.monotonic()
+                        yield ": keep-alive\n\n"
+                    continue
+                for event in events:
+                    if event["id"] <= last_sent:
+                        continue
+                    last_sent = event["id"]
+                    yield format_sse(event)
+                idle_since = time.monotonic()
+        finally:
+            alert_broker.unsubscribe(subscription)
+
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
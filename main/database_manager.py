@@ -1,9 +1,78 @@
 from main import db
-from .models import TransactionAnalysis
+from .models import TransactionAnalysis, ANALYSIS_COLUMNS, EXPORT_COLUMNS, analysis_to_dict, RiskSummary, RiskRollup, LLMUsage, ShadowAnalysis, RiskProfile, AlertState, ALERT_STATUSES
+from .risk_config import get_high_risk_threshold, band_score_range, score_bucket, get_thresholds, RISK_BANDS
+from .alert_stream import alert_broker, build_alert_event
+from .profiles import profile_cache, profile_keys, push_recent, RECENT_VALUES
+from .analytics import rollup_keys, build_trend_rows, ROLLUP_DIMENSIONS, GROUP_BY
 import json
+import threading
 from datetime import datetime
+from sqlalchemy import case, func, text
 from sqlalchemy.exc import SQLAlchemyError
 
+# Held from commit to publish for analyses that raise an alert. An alert-bearing
+# transaction has already flushed (and so holds SQLite's write lock) when it takes
+# this lock, so ids commit in order and the lock keeps publishing in the same order.
+_alert_publish_lock = threading.Lock()
+
+# The payload's top-level transaction_id, extracted by SQLite; a key of the same
+# name nested deeper in the payload is not matched
+_EXPORT_TRANSACTION_ID = case(
+    (func.json_valid(TransactionAnalysis.transaction_data),
+     func.json_extract(TransactionAnalysis.transaction_data, '$.transaction_id')),
+).label('transaction_id')
+
+
+def _push_recent_sql(column, value):
+    # push_recent in SQL: the new value first, then the other stored values, at most :recent_limit
+    return (f"CASE WHEN :{value} IS NULL THEN risk_profiles.{column} ELSE ("
+            f"SELECT json_group_array(value) FROM ("
+            f"SELECT value FROM (SELECT :{value} AS value, -1 AS position UNION ALL "
+            f"SELECT value, key FROM json_each(risk_profiles.{column}) WHERE value != :{value}) "
+            f"ORDER BY position LIMIT :recent_limit)) END")
+
+
+# Right-hand sides of the UPDATE all read the old row, as in the Welford update
+# mean' = mean + (x - mean) / n', m2' = m2 + (x - mean) * (x - mean')
+_PROFILE_UPSERT = text(f"""
+    INSERT INTO risk_profiles (entity_type, entity_id, count, amount_mean, amount_m2, allow_count, review_count,
+                               block_count, recent_countries, recent_ips, first_seen, last_seen)
+    VALUES (:entity_type, :entity_id, 1, :amount, 0.0, :allow, :review, :block, :countries, :ips, :now, :now)
+    ON CONFLICT (entity_type, entity_id) DO UPDATE SET
+        count = count + 1,
+        amount_mean = amount_mean + (:amount - amount_mean) / (count + 1),
+        amount_m2 = amount_m2 + (:amount - amount_mean) * (:amount - amount_mean - (:amount - amount_mean) / (count + 1)),
+        allow_count = allow_count + :allow,
+        review_count = review_count + :review,
+        block_count = block_count + :block,
+        recent_countries = {_push_recent_sql("recent_countries", "country")},
+        recent_ips = {_push_recent_sql("recent_ips", "ip_address")},
+        last_seen = :now
+""")
+
+# Counter upserts: one statement per key, with no savepoint or follow-up read.
+# Plain text() like _PROFILE_UPSERT: the dialect's on_conflict constructs carry
+# no cache key and would be recompiled on every save. Decrements only ever
+# touch rows an earlier increment created.
+_SUMMARY_UPSERT = text("""
+    INSERT INTO risk_summary (bucket, recommended_action, count) VALUES (:bucket, :recommended_action, :delta)
+    ON CONFLICT (bucket, recommended_action) DO UPDATE SET count = count + :delta
+""")
+_SUMMARY_DECREMENT = text("""
+    UPDATE risk_summary SET count = count + :delta WHERE bucket = :bucket AND recommended_action = :recommended_action
+""")
+_ROLLUP_UPSERT = text("""
+    INSERT INTO risk_rollups (day, dimension, value, recommended_action, count, score_sum)
+    VALUES (:day, :dimension, :value, :recommended_action, :delta, :score)
+    ON CONFLICT (day, dimension, value, recommended_action) DO UPDATE SET
+        count = count + :delta, score_sum = score_sum + :score
+""")
+_ROLLUP_DECREMENT = text("""
+    UPDATE risk_rollups SET count = count + :delta, score_sum = score_sum + :score
+    WHERE day = :day AND dimension = :dimension AND value = :value AND recommended_action = :recommended_action
+""")
+
+
 class DatabaseManager:
     @staticmethod
     def save_transaction_analysis(transaction_data, llm_response):
@@ -13,13 +82,30 @@ class DatabaseManager:
                 llm_response=json.dumps(llm_response) if isinstance(llm_response, dict) else llm_response,
                 risk_score=llm_response.get('risk_score', 0.0) if isinstance(llm_response, dict) else 0.0,
                 recommended_action=llm_response.get('recommended_action', 'review') if isinstance(llm_response, dict) else 'review',
-                risk_factors=json.dumps(llm_response.get('risk_factors', [])) if isinstance(llm_response, dict) else '[]'
+                risk_factors=json.dumps(llm_response.get('risk_factors', [])) if isinstance(llm_response, dict) else '[]',
+                decision_path=llm_response.get('decision_path') if isinstance(llm_response, dict) else None,
+                provisional=True if isinstance(llm_response, dict) and llm_response.get('provisional') else None,
+                created_at=datetime.utcnow()
             )
             
             db.session.add(analysis)
-            db.session.commit()
+            DatabaseManager._increment_risk_summary(analysis.risk_score, analysis.recommended_action)
+            DatabaseManager._increment_rollups(analysis.created_at.date(), transaction_data,
+                                               analysis.risk_score, analysis.recommended_action)
+            alert = DatabaseManager._open_alert(analysis)
+            updated_keys = DatabaseManager._update_profiles(transaction_data, analysis.recommended_action)
+            if alert:
+                with _alert_publish_lock:
+                    db.session.commit()
+                    DatabaseManager._publish_alert(analysis, transaction_data, llm_response)
+            else:
+                db.session.commit()
             
             print(f"Saved transaction analysis with ID: {analysis.id}")
+            # Dropped rather than overwritten: a put here could race another writer's
+            # and leave the older profile cached; the next read loads the committed row
+            for key in updated_keys:
+                profile_cache.invalidate(key)
             return analysis.id
             
         except SQLAlchemyError as e:
@@ -31,33 +117,658 @@ class DatabaseManager:
             print(f"Unexpected error: {str(e)}")
             raise
 
+    @staticmethod
+    def _analysis_rows(*columns):
+        """Column-only query: plain rows instead of tracked ORM objects"""
+        return db.session.query(*(getattr(TransactionAnalysis, name) for name in columns or ANALYSIS_COLUMNS))
+
     @staticmethod
     def get_all_analyses(limit=100, offset=0):
         try:
-            analyses = TransactionAnalysis.query.order_by(
+            analyses = DatabaseManager._analysis_rows().order_by(
                 TransactionAnalysis.created_at.desc()
             ).offset(offset).limit(limit).all()
             
-            return [analysis.to_dict() for analysis in analyses]
+            return [analysis_to_dict(analysis) for analysis in analyses]
         except Exception as e:
             print(f"Error retrieving analyses: {str(e)}")
             return []
         
+    @staticmethod
+    def get_recent_verdicts(limit):
+        """(id, transaction_data, llm_response) of the latest settled analyses, oldest first"""
+        rows = db.session.query(
+            TransactionAnalysis.id, TransactionAnalysis.transaction_data, TransactionAnalysis.llm_response
+        ).filter(TransactionAnalysis.provisional.is_(None)).order_by(TransactionAnalysis.id.desc()).limit(limit).all()
+        verdicts = []
+        for analysis_id, transaction_data, llm_response in reversed(rows):
+            try:
+                verdicts.append((analysis_id, transaction_data, json.loads(llm_response)))
+            except (TypeError, ValueError):
+                continue
+        return verdicts
+
+    @staticmethod
+    def get_provisional_analyses(limit=100):
+        """(id, transaction_data) of stored provisional verdicts still waiting for a rescore, oldest first"""
+        return db.session.query(
+            TransactionAnalysis.id, TransactionAnalysis.transaction_data
+        ).filter(TransactionAnalysis.provisional == True).order_by(TransactionAnalysis.id).limit(limit).all()
+
     @staticmethod
     def get_high_risk_analyses():
         try:
-            analyses = TransactionAnalysis.query.filter(
-                TransactionAnalysis.risk_score > 0.7
+            analyses = DatabaseManager._analysis_rows().filter(
+                TransactionAnalysis.risk_score > get_high_risk_threshold()
             ).order_by(TransactionAnalysis.created_at.desc()).all()
 
-            return [analysis.to_dict() for analysis in analyses]
+            return [analysis_to_dict(analysis) for analysis in analyses]
         except Exception as e:
             print(f"Error retrieving high-risk analyses: {str(e)}")
             return []
 
+    @staticmethod
+    def iter_history_rows(band=None, recommended_action=None, before_id=None, limit=None, chunk_size=1000):
+        """Rows of EXPORT_COLUMNS plus transaction_id, newest id first, read in keyset-paginated chunks.
+
+        Only one chunk of plain rows is held at a time, and the read transaction
+        is ended between chunks so a long export does not hold locks.
+        """
+        if band is not None:
+            lower, upper = band_score_range(band)
+        remaining = limit
+        while remaining is None or remaining > 0:
+            query = DatabaseManager._analysis_rows(*EXPORT_COLUMNS).add_columns(_EXPORT_TRANSACTION_ID)
+            if before_id is not None:
+                query = query.filter(TransactionAnalysis.id < before_id)
+            if band is not None:
+                if lower is not None:
+                    query = query.filter(TransactionAnalysis.risk_score > lower)
+                if upper is not None:
+                    query = query.filter(TransactionAnalysis.risk_score <= upper)
+            if recommended_action is not None:
+                query = query.filter(TransactionAnalysis.recommended_action == recommended_action)
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            rows = query.order_by(TransactionAnalysis.id.desc()).limit(size).all()
+            db.session.commit()
+            yield from rows
+            if len(rows) < size:
+                return
+            before_id = rows[-1].id
+            if remaining is not None:
+                remaining -= len(rows)
+
+    @staticmethod
+    def get_latest_analysis_id():
+        return db.session.query(func.max(TransactionAnalysis.id)).scalar() or 0
+
+    @staticmethod
+    def get_high_risk_since(last_id, limit=500):
+        """High-risk alert events with an id above last_id, oldest first"""
+        try:
+            analyses = TransactionAnalysis.query.filter(
+                TransactionAnalysis.id > last_id,
+                TransactionAnalysis.risk_score > get_high_risk_threshold()
+            ).order_by(TransactionAnalysis.id).limit(limit).all()
+
+            return [
+                build_alert_event(analysis.id, analysis.transaction_data,
+                                  json.loads(analysis.llm_response or "{}"), analysis.created_at)
+                for analysis in analyses
+            ]
+        except Exception as e:
+            print(f"Error retrieving high-risk alerts: {str(e)}")
+            return []
+
+    @staticmethod
+    def get_filtered_analyses(band=None, recommended_action=None, limit=100, offset=0):
+        """Analyses in a risk band and/or with a recommended action, newest first.
+
+        The ids are resolved from covering indexes first, so only the requested
+        page of rows is read from the table, and every filter walks an index in
+        created_at order and stops at the limit.
+        """
+        try:
+            id_query = db.session.query(TransactionAnalysis.id)
+            if band is not None:
+                lower, upper = band_score_range(band)
+                score = TransactionAnalysis.risk_score
+                if lower is not None and upper is not None:
+                    # A two-sided range would pick the score index and sort every match; "+ 0"
+                    # keeps it a residual filter on ix_transaction_analyses_created instead
+                    score = score + 0
+                if lower is not None:
+                    id_query = id_query.filter(score > lower)
+                if upper is not None:
+                    id_query = id_query.filter(score <= upper)
+            if recommended_action is not None:
+                id_query = id_query.filter(TransactionAnalysis.recommended_action == recommended_action)
+
+            ids = [row.id for row in id_query.order_by(
+                TransactionAnalysis.created_at.desc(), TransactionAnalysis.id.desc()
+            ).offset(offset).limit(limit)]
+            if not ids:
+                return []
+
+            by_id = {
+                analysis.id: analysis
+                for analysis in DatabaseManager._analysis_rows().filter(TransactionAnalysis.id.in_(ids))
+            }
+            return [analysis_to_dict(by_id[analysis_id]) for analysis_id in ids if analysis_id in by_id]
+        except ValueError:
+            raise
+        except Exception as e:
+            print(f"Error retrieving filtered analyses: {str(e)}")
+            return []
+
+    @staticmethod
+    def get_risk_summary():
+        """Per-band and per-action counts served from the risk_summary table"""
+        try:
+            review_threshold, block_threshold = get_thresholds()
+            review_bucket = score_bucket(review_threshold)
+            block_bucket = score_bucket(block_threshold)
+
+            bands = {band: 0 for band in RISK_BANDS}
+            actions = {}
+            rows = db.session.query(
+                RiskSummary.bucket, RiskSummary.recommended_action, func.sum(RiskSummary.count)
+            ).group_by(RiskSummary.bucket, RiskSummary.recommended_action)
+            for bucket, action, count in rows:
+                if bucket > block_bucket:
+                    bands["block"] += count
+                elif bucket > review_bucket:
+                    bands["review"] += count
+                else:
+                    bands["allow"] += count
+                actions[action] = actions.get(action, 0) + count
+
+            return {
+                "bands": bands,
+                "recommended_actions": actions,
+                "total": sum(bands.values()),
+                "thresholds": {"review": review_threshold, "block": block_threshold}
+            }
+        except Exception as e:
+            print(f"Error retrieving risk summary: {str(e)}")
+            return None
+
+    @staticmethod
+    def get_risk_trends(group_by="day", since=None, until=None, dimension=None, value=None):
+        """Counts, block/review rates and mean score from the rollups, never from transaction_analyses.
+
+        group_by is "day" or a rollup dimension; a dimension/value filter can be
+        combined with group_by="day", e.g. the daily block rate of one category.
+        """
+        if group_by not in GROUP_BY:
+            raise ValueError(f"group_by must be one of {', '.join(GROUP_BY)}")
+        if dimension is not None and dimension not in ROLLUP_DIMENSIONS:
+            raise ValueError(f"filter must be one of {', '.join(ROLLUP_DIMENSIONS[1:])}")
+        if dimension is not None and group_by != "day":
+            raise ValueError("A dimension filter can only be combined with group_by=day")
+
+        if group_by == "day":
+            key_column = RiskRollup.day
+            query_dimension = dimension or "total"
+        else:
+            key_column = RiskRollup.value
+            query_dimension = group_by
+        query = db.session.query(
+            key_column, RiskRollup.recommended_action,
+            func.sum(RiskRollup.count), func.sum(RiskRollup.score_sum)
+        ).filter(RiskRollup.dimension == query_dimension)
+        if dimension is not None:
+            query = query.filter(RiskRollup.value == value)
+        if since is not None:
+            query = query.filter(RiskRollup.day >= since)
+        if until is not None:
+            query = query.filter(RiskRollup.day < until)
+
+        rows = query.group_by(key_column, RiskRollup.recommended_action).all()
+        return build_trend_rows(rows, group_by)
+
+    @staticmethod
+    def _iter_analysis_chunks(*columns, chunk_size=1000):
+        """Lists of (id, *columns) rows over the whole history, in id-ordered keyset chunks"""
+        last_id = 0
+        while True:
+            rows = db.session.query(
+                TransactionAnalysis.id, *(getattr(TransactionAnalysis, name) for name in columns)
+            ).filter(TransactionAnalysis.id > last_id).order_by(TransactionAnalysis.id).limit(chunk_size).all()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            yield rows
+
+    @staticmethod
+    def rebuild_risk_rollups(chunk_size=1000):
+        """Recompute risk_rollups from transaction_analyses in id-ordered chunks; returns the analyses read.
+
+        Runs in one transaction that deletes first, so it holds the write lock
+        for the whole scan: live writers wait (up to the busy timeout) instead
+        of incrementing rows the rebuild then overwrites.
+        """
+        try:
+            RiskRollup.query.delete(synchronize_session=False)
+            totals = {}
+            read = 0
+            for rows in DatabaseManager._iter_analysis_chunks(
+                    'transaction_data', 'risk_score', 'recommended_action', 'created_at', chunk_size=chunk_size):
+                read += len(rows)
+                for _, transaction_data, risk_score, recommended_action, created_at in rows:
+                    day = (created_at or datetime.utcnow()).date()
+                    for dimension, value in rollup_keys(transaction_data, risk_score):
+                        key = (day, dimension, value, recommended_action)
+                        count, score_sum = totals.get(key, (0, 0.0))
+                        totals[key] = (count + 1, score_sum + (risk_score or 0.0))
+            db.session.add_all([
+                RiskRollup(day=day, dimension=dimension, value=value, recommended_action=action,
+                           count=count, score_sum=score_sum)
+                for (day, dimension, value, action), (count, score_sum) in totals.items()
+            ])
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            raise Exception(f"Failed to rebuild rollups: {str(e)}")
+        return read
+
+    @staticmethod
+    def rebuild_risk_summary(chunk_size=1000):
+        """Recompute risk_summary from transaction_analyses, e.g. for history saved before it existed.
+
+        Holds the write lock throughout, like rebuild_risk_rollups.
+        """
+        try:
+            RiskSummary.query.delete(synchronize_session=False)
+            counts = {}
+            read = 0
+            for rows in DatabaseManager._iter_analysis_chunks('risk_score', 'recommended_action', chunk_size=chunk_size):
+                read += len(rows)
+                for _, risk_score, recommended_action in rows:
+                    key = (score_bucket(risk_score), recommended_action)
+                    counts[key] = counts.get(key, 0) + 1
+            db.session.add_all([
+                RiskSummary(bucket=bucket, recommended_action=action, count=count)
+                for (bucket, action), count in counts.items()
+            ])
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            raise Exception(f"Failed to rebuild risk summary: {str(e)}")
+        return read
+
+    @staticmethod
+    def rebuild_risk_profiles(chunk_size=1000):
+        """Recompute risk_profiles by folding every stored analysis in id order, e.g. to backfill history.
+
+        Holds the write lock throughout, like rebuild_risk_rollups.
+        """
+        try:
+            RiskProfile.query.delete(synchronize_session=False)
+            profiles = {}
+            read = 0
+            for rows in DatabaseManager._iter_analysis_chunks(
+                    'transaction_data', 'recommended_action', 'created_at', chunk_size=chunk_size):
+                read += len(rows)
+                for _, transaction_data, recommended_action, created_at in rows:
+                    try:
+                        transaction = json.loads(transaction_data)
+                    except (TypeError, ValueError):
+                        continue
+                    try:
+                        amount = float(transaction.get('amount') or 0.0) if isinstance(transaction, dict) else 0.0
+                    except (TypeError, ValueError):
+                        amount = 0.0
+                    seen_at = created_at or datetime.utcnow()
+                    for entity_type, entity_id, country, ip_address in profile_keys(transaction):
+                        profile = profiles.get((entity_type, entity_id))
+                        if profile is None:
+                            profile = profiles[(entity_type, entity_id)] = RiskProfile(
+                                entity_type=entity_type, entity_id=entity_id, count=0, amount_mean=0.0,
+                                amount_m2=0.0, allow_count=0, review_count=0, block_count=0,
+                                recent_countries=[], recent_ips=[], first_seen=seen_at
+                            )
+                        profile.count += 1
+                        delta = amount - profile.amount_mean
+                        profile.amount_mean += delta / profile.count
+                        profile.amount_m2 += delta * (amount - profile.amount_mean)
+                        if recommended_action in ('allow', 'review', 'block'):
+                            column = f'{recommended_action}_count'
+                            setattr(profile, column, getattr(profile, column) + 1)
+                        profile.recent_countries = push_recent(profile.recent_countries, country)
+                        profile.recent_ips = push_recent(profile.recent_ips, ip_address)
+                        profile.last_seen = seen_at
+
+            for profile in profiles.values():
+                profile.recent_countries = json.dumps(profile.recent_countries)
+                profile.recent_ips = json.dumps(profile.recent_ips)
+            db.session.add_all(profiles.values())
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            raise Exception(f"Failed to rebuild risk profiles: {str(e)}")
+        profile_cache.invalidate()
+        return read
+
+    @staticmethod
+    def get_history_version():
+        """Cheap token that changes whenever an analysis is inserted or updated"""
+        # One aggregate per query: SQLite only answers a lone max() from the end of an index,
+        # and scans the whole index when two are combined
+        max_id = db.session.query(func.max(TransactionAnalysis.id)).scalar()
+        max_updated_at = db.session.query(func.max(TransactionAnalysis.updated_at)).scalar()
+        alerts_updated_at = db.session.query(func.max(AlertState.updated_at)).scalar()
+        return (f"{max_id or 0}:{max_updated_at.isoformat() if max_updated_at else ''}"
+                f":{alerts_updated_at.isoformat() if alerts_updated_at else ''}")
+
+    @staticmethod
+    def get_alerts(status='open', since_id=0, limit=500):
+        """Alert events in a triage state with an id above since_id, oldest first"""
+        if status not in ALERT_STATUSES:
+            raise ValueError(f"status must be one of {', '.join(ALERT_STATUSES)}")
+        rows = db.session.query(AlertState, TransactionAnalysis).join(
+            TransactionAnalysis, TransactionAnalysis.id == AlertState.analysis_id
+        ).filter(
+            AlertState.status == status,
+            AlertState.analysis_id > since_id
+        ).order_by(AlertState.analysis_id).limit(limit).all()
+
+        alerts = []
+        for state, analysis in rows:
+            event = build_alert_event(analysis.id, analysis.transaction_data,
+                                      json.loads(analysis.llm_response or "{}"), analysis.created_at)
+            event["status"] = state.status
+            event["assignee"] = state.assignee
+            alerts.append(event)
+        return alerts
+
+    @staticmethod
+    def update_alert_states(status, ids=None, up_to=None, assignee=None):
+        """Move many alerts to a new state in one UPDATE, by explicit ids or every open alert up to an id"""
+        if status not in ALERT_STATUSES:
+            raise ValueError(f"status must be one of {', '.join(ALERT_STATUSES)}")
+        query = AlertState.query
+        if ids:
+            query = query.filter(AlertState.analysis_id.in_(ids))
+        elif up_to is not None:
+            query = query.filter(AlertState.status == 'open', AlertState.analysis_id <= up_to)
+        else:
+            raise ValueError("Either ids or up_to is required")
+
+        values = {AlertState.status: status, AlertState.updated_at: datetime.utcnow()}
+        if assignee is not None or status == 'assigned':
+            values[AlertState.assignee] = assignee
+        try:
+            updated = query.update(values, synchronize_session=False)
+            db.session.commit()
+            return updated
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            print(f" Database error: {str(e)}")
+            raise Exception(f"Failed to update alert states: {str(e)}")
+
+    @staticmethod
+    def save_llm_usage(api_key_id, provider, model, purpose, prompt_tokens, completion_tokens, cost):
+        """Insert one usage row on its own connection and transaction.
+
+        Usage is recorded in the middle of a request, so committing or rolling
+        back the shared db.session here would end the request's own transaction.
+        """
+        try:
+            with db.engine.begin() as conn:
+                result = conn.execute(LLMUsage.__table__.insert().values(
+                    api_key_id=api_key_id,
+                    provider=provider,
+                    model=model,
+                    purpose=purpose,
+                    prompt_tokens=prompt_tokens,
+                    completion_tokens=completion_tokens,
+                    cost=cost
+                ))
+            return result.inserted_primary_key[0]
+        except SQLAlchemyError as e:
+            raise Exception(f"Failed to save LLM usage: {str(e)}")
+
+    @staticmethod
+    def get_llm_usage_report(since=None, until=None, group_by="api_key"):
+        """Token and cost totals over a time window, grouped by api_key, model or day"""
+        group_columns = {
+            "api_key": LLMUsage.api_key_id,
+            "model": LLMUsage.model,
+            "day": func.date(LLMUsage.created_at),
+        }
+        if group_by not in group_columns:
+            raise ValueError(f"Unknown group_by: {group_by}")
+        group_column = group_columns[group_by]
+
+        query = db.session.query(
+            group_column.label("group"),
+            func.count(LLMUsage.id),
+            func.sum(LLMUsage.prompt_tokens),
+            func.sum(LLMUsage.completion_tokens),
+            func.sum(LLMUsage.cost)
+        )
+        if since is not None:
+            query = query.filter(LLMUsage.created_at >= since)
+        if until is not None:
+            query = query.filter(LLMUsage.created_at < until)
+
+        report = []
+        for group, calls, prompt_tokens, completion_tokens, cost in query.group_by(group_column).order_by(group_column):
+            report.append({
+                group_by: str(group),
+                "calls": calls,
+                "prompt_tokens": int(prompt_tokens or 0),
+                "completion_tokens": int(completion_tokens or 0),
+                "total_tokens": int((prompt_tokens or 0) + (completion_tokens or 0)),
+                "tokens_per_call": ((prompt_tokens or 0) + (completion_tokens or 0)) / calls if calls else 0.0,
+                "cost": float(cost or 0.0)
+            })
+        return report
+
+    @staticmethod
+    def save_shadow_analysis(analysis_id, candidate, primary_result, candidate_result,
+                             latency_ms, primary_latency_ms, error=None):
+        try:
+            shadow = ShadowAnalysis(
+                analysis_id=analysis_id,
+                candidate=candidate,
+                risk_score=candidate_result.get('risk_score') if candidate_result else None,
+                recommended_action=candidate_result.get('recommended_action') if candidate_result else None,
+                primary_risk_score=primary_result.get('risk_score'),
+                primary_action=primary_result.get('recommended_action'),
+                latency_ms=latency_ms,
+                primary_latency_ms=primary_latency_ms,
+                llm_response=json.dumps(candidate_result) if candidate_result else None,
+                error=error
+            )
+            db.session.add(shadow)
+            db.session.commit()
+            return shadow.id
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            raise Exception(f"Failed to save shadow analysis: {str(e)}")
+
+    @staticmethod
+    def get_shadow_rows(candidate=None, since=None):
+        """Comparison columns of shadow analyses, without the stored responses"""
+        query = db.session.query(
+            ShadowAnalysis.candidate,
+            ShadowAnalysis.risk_score,
+            ShadowAnalysis.recommended_action,
+            ShadowAnalysis.primary_risk_score,
+            ShadowAnalysis.primary_action,
+            ShadowAnalysis.latency_ms,
+            ShadowAnalysis.primary_latency_ms,
+            ShadowAnalysis.error
+        )
+        if candidate is not None:
+            query = query.filter(ShadowAnalysis.candidate == candidate)
+        if since is not None:
+            query = query.filter(ShadowAnalysis.created_at >= since)
+        return query.all()
+
+    @staticmethod
+    def replace_analysis_result(analysis_id, llm_response):
+        """Overwrite a stored provisional verdict, keeping summary, profile and alert state consistent.
+
+        Returns False when the analysis is gone or was already rescored, so a
+        rescore queued twice (e.g. by the sweeper) is applied once.
+        """
+        try:
+            analysis = db.session.get(TransactionAnalysis, analysis_id)
+            if analysis is None or not analysis.provisional:
+                return False
+            old_score, old_action = analysis.risk_score, analysis.recommended_action
+            threshold = get_high_risk_threshold()
+            was_high_risk = float(old_score) > threshold
+
+            analysis.llm_response = json.dumps(llm_response)
+            analysis.risk_score = llm_response.get('risk_score', 0.0)
+            analysis.recommended_action = llm_response.get('recommended_action', 'review')
+            analysis.risk_factors = json.dumps(llm_response.get('risk_factors', []))
+            analysis.decision_path = llm_response.get('decision_path')
+            analysis.provisional = None
+            lowered = was_high_risk and float(analysis.risk_score) <= threshold
+
+            DatabaseManager._increment_risk_summary(old_score, old_action, -1)
+            DatabaseManager._increment_risk_summary(analysis.risk_score, analysis.recommended_action)
+            day = (analysis.created_at or datetime.utcnow()).date()
+            DatabaseManager._increment_rollups(day, analysis.transaction_data, old_score, old_action, -1)
+            DatabaseManager._increment_rollups(day, analysis.transaction_data,
+                                               analysis.risk_score, analysis.recommended_action)
+            alert = not was_high_risk and DatabaseManager._open_alert(analysis)
+            if lowered:
+                # The provisional alert no longer applies
+                AlertState.query.filter(
+                    AlertState.analysis_id == analysis.id, AlertState.status != 'resolved'
+                ).update({AlertState.status: 'resolved', AlertState.updated_at: datetime.utcnow()},
+                         synchronize_session=False)
+            transaction_data = json.loads(analysis.transaction_data)
+            keys = DatabaseManager._shift_profile_action(transaction_data, old_action, analysis.recommended_action)
+            if alert:
+                with _alert_publish_lock:
+                    db.session.commit()
+                    DatabaseManager._publish_alert(analysis, transaction_data, llm_response)
+            else:
+                db.session.commit()
+
+            for key in keys:
+                profile_cache.invalidate(key)
+            if lowered:
+                alert_broker.retract(analysis.id)
+            return True
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            print(f" Database error: {str(e)}")
+            raise Exception(f"Failed to replace analysis {analysis_id}: {str(e)}")
+
+    @staticmethod
+    def _shift_profile_action(transaction_data, old_action, new_action):
+        """Move one verdict between action counters of the transaction's profiles"""
+        columns = {
+            'allow': RiskProfile.allow_count,
+            'review': RiskProfile.review_count,
+            'block': RiskProfile.block_count,
+        }
+        keys = [(entity_type, entity_id) for entity_type, entity_id, _, _ in profile_keys(transaction_data)]
+        if old_action == new_action:
+            return keys
+        values = {}
+        if old_action in columns:
+            values[columns[old_action]] = columns[old_action] - 1
+        if new_action in columns:
+            values[columns[new_action]] = columns[new_action] + 1
+        for entity_type, entity_id in keys:
+            RiskProfile.query.filter_by(
+                entity_type=entity_type, entity_id=entity_id
+            ).update(values, synchronize_session=False)
+        return keys
+
+    @staticmethod
+    def get_profile(entity_type, entity_id):
+        """Profile dict for a merchant or customer, served from the LRU cache when hot"""
+        key = (entity_type, str(entity_id))
+        profile = profile_cache.get(key)
+        if profile is None:
+            row = db.session.get(RiskProfile, key)
+            profile = row.to_dict() if row is not None else {}
+            profile_cache.put(key, profile)
+        return profile or None
+
+    @staticmethod
+    def _update_profiles(transaction_data, recommended_action):
+        """Fold one transaction into its merchant and customer profiles in the caller's transaction.
+
+        One upsert per profile (_PROFILE_UPSERT) updates the counters, the Welford
+        mean/M2 and the recent country/IP lists from the old row values, so
+        concurrent writers cannot lose updates. Returns the updated profile keys.
+        """
+        if isinstance(transaction_data, str):
+            try:
+                transaction_data = json.loads(transaction_data)
+            except ValueError:
+                return []
+        if not isinstance(transaction_data, dict):
+            return []
+        try:
+            amount = float(transaction_data.get('amount') or 0.0)
+        except (TypeError, ValueError):
+            amount = 0.0
+
+        updated = []
+        now = datetime.utcnow()
+        for entity_type, entity_id, country, ip_address in profile_keys(transaction_data):
+            db.session.execute(_PROFILE_UPSERT, {
+                "entity_type": entity_type, "entity_id": entity_id, "amount": amount,
+                "allow": int(recommended_action == 'allow'),
+                "review": int(recommended_action == 'review'),
+                "block": int(recommended_action == 'block'),
+                "country": country or None, "ip_address": ip_address or None,
+                "countries": json.dumps(push_recent([], country)),
+                "ips": json.dumps(push_recent([], ip_address)),
+                "recent_limit": RECENT_VALUES, "now": now,
+            })
+            updated.append((entity_type, entity_id))
+        return updated
+
+    @staticmethod
+    def _open_alert(analysis):
+        """Create the open alert state for a high-risk analysis in the caller's transaction; True if one was added"""
+        if float(analysis.risk_score) <= get_high_risk_threshold():
+            return False
+        if analysis.id is None:
+            db.session.flush()
+        elif db.session.get(AlertState, analysis.id) is not None:
+            return False
+        db.session.add(AlertState(analysis_id=analysis.id))
+        return True
 
-    
+    @staticmethod
+    def _publish_alert(analysis, transaction_data, llm_response):
+        try:
+            if float(analysis.risk_score) > get_high_risk_threshold():
+                alert_broker.publish(build_alert_event(
+                    analysis.id, transaction_data, llm_response, analysis.created_at
+                ))
+        except Exception as e:
+            # Alerts are best effort; the analysis is already committed
+            print(f"Failed to publish alert for analysis {analysis.id}: {str(e)}")
 
-    
+    @staticmethod
+    def _increment_rollups(day, transaction_data, risk_score, recommended_action, delta=1):
+        """Adjust the analytics rollups in the caller's transaction: one executemany upsert over the keys"""
+        score = (risk_score or 0.0) * delta
+        params = [
+            {"day": day.isoformat(), "dimension": dimension, "value": value, "recommended_action": recommended_action,
+             "delta": delta, "score": score}
+            for dimension, value in rollup_keys(transaction_data, risk_score)
+        ]
+        db.session.execute(_ROLLUP_UPSERT if delta > 0 else _ROLLUP_DECREMENT, params)
 
-    
\ No newline at end of file
+    @staticmethod
+    def _increment_risk_summary(risk_score, recommended_action, delta=1):
+        """Adjust the summary counter in the caller's transaction"""
+        db.session.execute(_SUMMARY_UPSERT if delta > 0 else _SUMMARY_DECREMENT, {
+            "bucket": score_bucket(risk_score), "recommended_action": recommended_action, "delta": delta
+        })
@@ -0,0 +1,66 @@
+import os
+import time
+from dotenv import load_dotenv
+from flask import g, has_app_context
+
+load_dotenv()
+
+# Relative budget in milliseconds; preferred because it is immune to clock skew
+TIMEOUT_HEADER = "X-Request-Timeout-Ms"
+# Absolute deadline as Unix epoch milliseconds
+DEADLINE_HEADER = "X-Request-Deadline"
+DEFAULT_BUDGET_MS = float(os.getenv("REQUEST_BUDGET_MS", "0"))
+# Time kept back from the LLM call for persisting and serialising the response
+RESPONSE_RESERVE_MS = float(os.getenv("DEADLINE_RESERVE_MS", "50"))
+
+
+class DeadlineExceeded(Exception):
+    """The request's latency budget ran out before stage"""
+
+    def __init__(self, stage):
+        super().__init__(f"Deadline exceeded before {stage}")
+        self.stage = stage
+
+
+def _budget_seconds(headers):
+    try:
+        if headers.get(TIMEOUT_HEADER):
+            return float(headers[TIMEOUT_HEADER]) / 1000.0
+        if headers.get(DEADLINE_HEADER):
+            return float(headers[DEADLINE_HEADER]) / 1000.0 - time.time()
+    except (TypeError, ValueError):
+        pass
+    return DEFAULT_BUDGET_MS / 1000.0 if DEFAULT_BUDGET_MS > 0 else None
+
+
+def start_deadline(headers):
+    """Record the request's deadline on the app context; returns the budget in seconds or None"""
+    budget = _budget_seconds(headers)
+    g.deadline = time.monotonic() + budget if budget is not None else None
+    return budget
+
+
+def remaining():
+    """Seconds left for the current request, or None without a deadline"""
+    deadline = g.get("deadline") if has_app_context() else None
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def check(stage):
+    """Raise DeadlineExceeded if the budget is already spent"""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(stage)
+
+
+def timeout_for(stage, default):
+    """Timeout for a blocking call: default, capped by what is left after the response reserve"""
+    left = remaining()
+    if left is None:
+        return default
+    left -= RESPONSE_RESERVE_MS / 1000.0
+    if left <= 0:
+        raise DeadlineExceeded(stage)
+    return min(default, left)
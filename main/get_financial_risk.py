@@ -1,14 +1,45 @@
 from .llm_int_deepseek import analyse_transaction_deepseek
+from .admission import scoring_admission, provisional_verdict, best_available_verdict, Overloaded, DEGRADED_MODE
+from .deadline import DeadlineExceeded, check as check_deadline
 from .database_manager import DatabaseManager
 from .validator import validate_transaction
+from .risk_config import get_thresholds
+from .shadow import maybe_shadow, build_shadow_report
+from .profiles import profile_cache
 from flask import jsonify
+import time
 
 def get_financial_risk_analysis(data,save_to_db=True):
     try:
         if not validate_transaction(data):
             raise ValueError("Invalid transaction data format")
                 
-        llm_response = analyse_transaction_deepseek(data)
+        started = time.perf_counter()
+        try:
+            check_deadline("scoring")
+            with scoring_admission.admit():
+                llm_response = analyse_transaction_deepseek(data)
+        except DeadlineExceeded as de:
+            response = jsonify({
+                "message": "Deadline reached; best available verdict returned, full analysis queued.",
+                "llm_result": best_available_verdict(data, de.stage)
+            })
+            response.headers["X-Deadline-Exceeded"] = de.stage
+            return response, 202
+        except Overloaded as overloaded:
+            if DEGRADED_MODE != "local":
+                response = jsonify({"error": f"Scoring capacity exhausted: {str(overloaded)}"})
+                response.headers["Retry-After"] = str(overloaded.retry_after)
+                return response, 503
+            return jsonify({
+                "message": "Transaction validated; provisional local verdict, full analysis queued.",
+                "llm_result": provisional_verdict(data)
+            }), 202
+        primary_latency_ms = (time.perf_counter() - started) * 1000
+        try:
+            maybe_shadow(data, llm_response, primary_latency_ms)
+        except Exception as shadow_error:
+            print(f"Shadow evaluation skipped: {str(shadow_error)}")
         response = jsonify({
             "message": "Transaction validated and analyzed.",
             "llm_result": llm_response
@@ -41,3 +72,55 @@ def get_high_risk_history():
     except Exception as e:
         print(f"Error getting analyses: {str(e)}")
         return jsonify({"error": "Failed to retrieve analyses"}), 500
+
+def get_filtered_risk_history(band=None, recommended_action=None, limit=100, offset=0):
+    try:
+        analyses = DatabaseManager.get_filtered_analyses(band, recommended_action, limit, offset)
+        if analyses is None:
+            return []
+        return analyses
+    except Exception as e:
+        print(f"Error getting analyses: {str(e)}")
+        return jsonify({"error": "Failed to retrieve analyses"}), 500
+
+def get_risk_summary():
+    try:
+        return DatabaseManager.get_risk_summary()
+    except Exception as e:
+        print(f"Error getting risk summary: {str(e)}")
+        return None
+
+def get_history_version():
+    # Thresholds are part of the version because they change what the band filters return
+    return f"{DatabaseManager.get_history_version()}|{get_thresholds()}"
+
+def get_high_risk_alerts_since(last_id, limit=500):
+    return DatabaseManager.get_high_risk_since(last_id, limit)
+
+def get_latest_analysis_id():
+    return DatabaseManager.get_latest_analysis_id()
+
+def get_llm_usage_report(since=None, until=None, group_by="api_key"):
+    return DatabaseManager.get_llm_usage_report(since, until, group_by)
+
+def get_shadow_report(candidate=None, since=None):
+    return build_shadow_report(DatabaseManager.get_shadow_rows(candidate, since))
+
+def get_profiles(entity_id, entity_type=None):
+    """Profiles for an id, keyed by entity type, plus profile cache statistics"""
+    entity_types = [entity_type] if entity_type else ["merchant", "customer"]
+    profiles = {}
+    for profile_type in entity_types:
+        profile = DatabaseManager.get_profile(profile_type, entity_id)
+        if profile is not None:
+            profiles[profile_type] = profile
+    return profiles, profile_cache.stats()
+
+def get_alerts(status="open", since_id=0, limit=500):
+    return DatabaseManager.get_alerts(status, since_id, limit)
+
+def update_alerts(status, ids=None, up_to=None, assignee=None):
+    return DatabaseManager.update_alert_states(status, ids, up_to, assignee)
+
+def get_risk_trends(group_by="day", since=None, until=None, dimension=None, value=None):
+    return DatabaseManager.get_risk_trends(group_by, since, until, dimension, value)
@@ -0,0 +1,141 @@
+"""Streaming export of analysis history without per-row object graphs.
+
+Rows come from DatabaseManager.iter_history_rows as plain column tuples and
+are encoded straight to JSON text; the stored transaction payload is passed
+through as-is instead of being decoded and re-encoded. Compare the memory
+cost per row with the ORM/to_dict path:
+
+    python -m main.history_export benchmark --rows 20000
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+EXPORT_FIELDS = ("id", "transaction_id", "risk_score", "recommended_action", "decision_path", "created_at",
+                 "transaction_details")
+
+_ENCODERS = {
+    "id": lambda row: str(row.id),
+    "transaction_id": lambda row: json.dumps("" if row.transaction_id is None else row.transaction_id),
+    "risk_score": lambda row: json.dumps(row.risk_score),
+    "recommended_action": lambda row: json.dumps(row.recommended_action),
+    "decision_path": lambda row: json.dumps(row.decision_path),
+    "created_at": lambda row: json.dumps(row.created_at.isoformat() if row.created_at else None),
+    "transaction_details": lambda row: row.transaction_data or "{}",
+}
+
+
+def encode_history_row(row, fields=None):
+    """One export record as JSON text; fields limits and orders the keys"""
+    return "{" + ",".join(
+        f'"{field}":{_ENCODERS[field](row)}' for field in fields or EXPORT_FIELDS if field in _ENCODERS
+    ) + "}"
+
+
+def generate_ndjson(rows, fields=None):
+    for row in rows:
+        yield encode_history_row(row, fields) + "\n"
+
+
+def generate_json_array(rows, fields=None):
+    yield "["
+    separator = ""
+    for row in rows:
+        yield separator + encode_history_row(row, fields)
+        separator = ","
+    yield "]"
+
+
+def _synthetic_payload(index):
+    return json.dumps({
+        "transaction_id": f"tx_bench_{index}",
+        "timestamp": "2025-05-07T14:30:45Z",
+        "amount": 100.0 + index % 900,
+        "currency": "USD",
+        "customer": {"id": f"cust_{index % 5000}", "country": "US", "ip_address": "192.168.1.1"},
+        "payment_method": {"type": "credit_card", "last_four": "4242", "country_of_issue": "CA"},
+        "merchant": {"id": f"merch_{index % 700}", "name": "Example Store", "category": "electronics"}
+    })
+
+
+def _peak_bytes(work):
+    tracemalloc.start()
+    try:
+        work()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure_memory_per_row(rows=20000, database_url="sqlite:///:memory:"):
+    """Peak traced bytes per row for the ORM/to_dict read path and the streaming export path"""
+    from datetime import datetime
+    from flask import Flask
+    from main import db
+    from .database_manager import DatabaseManager
+    from .models import TransactionAnalysis
+    from .schema import create_schema
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    db.init_app(app)
+    with app.app_context():
+        create_schema(db)
+        now = datetime.utcnow()
+        db.session.execute(TransactionAnalysis.__table__.insert(), [
+            {"transaction_data": _synthetic_payload(i), "llm_response": '{"risk_score": 0.5}',
+             "risk_score": (i % 100) / 100.0, "recommended_action": "review", "risk_factors": "[]",
+             "created_at": now, "updated_at": now}
+            for i in range(rows)
+        ])
+        db.session.commit()
+
+        def orm_path():
+            analyses = [analysis.to_dict() for analysis in TransactionAnalysis.query.limit(rows).all()]
+            transformed = [{
+                "transaction_id": analysis["transaction_data"].get("transaction_id", ""),
+                "risk_score": analysis["risk_score"],
+                "recommended_action": analysis["recommended_action"],
+                "created_at": analysis["created_at"],
+                "transaction_details": analysis["transaction_data"]
+            } for analysis in analyses]
+            json.dumps(transformed)
+            db.session.expunge_all()
+
+        def column_path():
+            json.dumps(DatabaseManager.get_all_analyses(limit=rows))
+
+        def export_path():
+            size = 0
+            for chunk in generate_ndjson(DatabaseManager.iter_history_rows(limit=rows)):
+                size += len(chunk)
+
+        results = {}
+        for name, work in (("orm_to_dict", orm_path), ("column_rows", column_path), ("streaming_export", export_path)):
+            started = time.perf_counter()
+            peak = _peak_bytes(work)
+            results[name] = {
+                "peak_bytes_per_row": round(peak / rows, 1),
+                "seconds": round(time.perf_counter() - started, 3)
+            }
+        db.session.remove()
+        return {"rows": rows, **results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="History export utilities")
+    commands = parser.add_subparsers(dest="command", required=True)
+    benchmark = commands.add_parser("benchmark", help="Measure read-path memory per row on synthetic data")
+    benchmark.add_argument("--rows", type=int, default=20000)
+    benchmark.add_argument("--database-url", default="sqlite:///:memory:")
+    args = parser.parse_args(argv)
+
+    json.dump(measure_memory_per_row(args.rows, args.database_url), sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+import gzip
+import hashlib
+from functools import wraps
+from flask import request, make_response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_MIN_SIZE = 1024
+
+
+def history_etag(version):
+    """ETag value for a history view: the data version plus the path and query string"""
+    key = f"{request.path}?{request.query_string.decode('utf-8', 'replace')}|{version}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def _preferred_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"] > 0:
+        return "br"
+    if accepted["gzip"] > 0:
+        return "gzip"
+    return None
+
+
+def compress_response(response):
+    """Compress a buffered response body with br or gzip when the client accepts it"""
+    response.vary.add("Accept-Encoding")
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code != 200 or "Content-Encoding" in response.headers):
+        return response
+
+    encoding = _preferred_encoding()
+    if encoding is None:
+        return response
+
+    body = response.get_data()
+    if len(body) < COMPRESSION_MIN_SIZE:
+        return response
+
+    if encoding == "br":
+        body = brotli.compress(body, quality=5)
+    else:
+        body = gzip.compress(body, compresslevel=6)
+    response.set_data(body)
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def conditional_history(version_getter):
+    """Serve history endpoints with ETag revalidation and response compression.
+
+    version_getter returns a cheap token that changes whenever the underlying
+    rows change. A matching If-None-Match short-circuits to 304 before the view
+    queries or serializes anything.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                version = version_getter()
+            except Exception as e:
+                print(f"Error computing history version: {str(e)}")
+                version = None
+
+            etag = history_etag(version) if version is not None else None
+            if etag is not None and request.if_none_match.contains_weak(etag):
+                response = make_response("", 304)
+                response.set_etag(etag, weak=True)
+                return response
+
+            response = make_response(view(*args, **kwargs))
+            if etag is not None and response.status_code == 200:
+                # Weak because the byte representation depends on the content coding
+                response.set_etag(etag, weak=True)
+                response.headers["Cache-Control"] = "private, no-cache"
+            return compress_response(response)
+        return wrapper
+    return decorator
+
+
+def project_fields(items, fields):
+    """Keep only the requested top-level keys of each item; None keeps everything"""
+    if not fields:
+        return items
+    return [{key: item[key] for key in fields if key in item} for item in items]
+
+
+def parse_fields(value):
+    if not value:
+        return None
+    return [field.strip() for field in value.split(",") if field.strip()]
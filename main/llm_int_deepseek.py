@@ -1,73 +1,256 @@
 import os
 from importlib import resources
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import requests
-from flask import abort
+from requests.adapters import HTTPAdapter
+from flask import abort, current_app
 from dotenv import load_dotenv
+from . import deadline
+from .admission import BudgetExceeded, Overloaded
+from . import cascade
+from .batching import BATCH_CONCURRENCY, BATCH_MAX_SIZE, BATCH_MODE, MicroBatcher
 from .database_manager import DatabaseManager
+from .llm_parsing import coerce_result, extract_json_object, parse_llm_result, repair_messages, LLMResponseError
+from .prompt_payload import render_batch_prompt, render_prompt
+from .profiles import attach_profiles
+from .profiling import stage
+from .similarity import find_similar, remember
+from .token_usage import api_key_id, attribute_usage, record_usage
 
 load_dotenv() 
 API_URL = 'https://openrouter.ai/api/v1/chat/completions'
 API_KEY = os.getenv("DEEPSEEK_API_KEY2")
+MODEL = "deepseek/deepseek-chat:free"
+JSON_MODE = os.getenv("LLM_JSON_MODE", "1") == "1"
+# "openrouter" calls the real provider; "mock" serves synthetic completions for load tests;
+# "replay" serves completions captured with LLM_RECORD=1 (see main/llm_log.py)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openrouter")
+LLM_RECORD = os.getenv("LLM_RECORD", "0") == "1"
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
 headers = {
     'Authorization': f'Bearer {API_KEY}',
     'Content-Type': 'application/json'
 }
+# Keep-alive connections to the provider, sized for every batch falling back to single calls at once
+http = requests.Session()
+http.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=BATCH_CONCURRENCY * BATCH_MAX_SIZE))
 
 def get_prompt_path():
     """Get the path to the prompt file regardless of how the package is installed"""
     try:
-        with resources.files('main').joinpath('transaction_risk_analysis_prompt.txt') as path:
-            return str(path)
+        return str(resources.files('main').joinpath('transaction_risk_analysis_prompt.txt'))
     except (ImportError, TypeError):
         current_dir = os.path.dirname(os.path.abspath(__file__))
         return os.path.join(current_dir, 'transaction_risk_analysis_prompt.txt')
 
 
-def analyse_transaction_deepseek(data,save_to_db=True,prompt_file_path='transaction_risk_analysis_prompt.txt'):
-    try:
-        prompt_file_path = get_prompt_path()
-
-        with open(prompt_file_path, 'r', encoding='utf-8') as file:
-            prompt_template = file.read()
-        prompt = prompt_template.replace('{transaction_data}', json.dumps(data))
-        
-        data_prompt = {
-            "model": "deepseek/deepseek-chat:free",
-            "messages": [{"role": "user", "content": prompt}]
-        }
-
-        response = requests.post(API_URL, json=data_prompt, headers=headers)
-
-        if response.status_code != 200:
-            raise Exception(f"Error code: {response.status_code} - {response.text}")
-        
-        response_json = response.json()
-        if "choices" not in response_json or not response_json["choices"]:
-            raise Exception("Malformed API response: 'choices' key missing or empty")
-
-
-        result_text = response.json()["choices"][0]["message"]["content"]
+@lru_cache(maxsize=1)
+def load_prompt_template():
+    """Prompt file contents, read once per process"""
+    with open(get_prompt_path(), 'r', encoding='utf-8') as file:
+        return file.read()
 
-        if result_text.startswith("```json"):
-            result_text = result_text.strip("```json").strip("```").strip()
 
-        if not result_text.strip():
-            raise Exception("Empty result text from API")
-
-        result = json.loads(result_text)
-        if "risk_score" not in result or "recommended_action" not in result:
-            abort(500, description="Malformed response from LLM")
+def analyse_transaction_deepseek(data,save_to_db=True,prompt_file_path='transaction_risk_analysis_prompt.txt',
+                                 model=None,prompt_template=None,use_cascade=True):
+    try:
+        with stage("similarity"):
+            result, similar_cases = find_similar(data)
+        if result is None:
+            if use_cascade and cascade.CASCADE_ENABLED:
+                result = cascade.run_cascade(
+                    data, lambda transaction: _score_with_llm(transaction, prompt_template, model, similar_cases))
+            else:
+                result = _score_with_llm(data, prompt_template, model, similar_cases)
 
         if save_to_db:
             try:
-                analysis_id = DatabaseManager.save_transaction_analysis(data, result)
+                with stage("save"):
+                    analysis_id = DatabaseManager.save_transaction_analysis(data, result)
                 result['analysis_id'] = analysis_id
                 print(f"Saved to database with ID: {analysis_id}")
+                remember(analysis_id, data, result)
             except Exception as db_error:
                 print(f"Database save failed: {str(db_error)}")
 
         return result
 
+    except (Overloaded, deadline.DeadlineExceeded):
+        raise
     except Exception as e:
         abort(500, description=f"LLM integration failed deepseek: {str(e)}")
+
+
+def _score_with_llm(data, prompt_template=None, model=None, similar_cases=None):
+    if prompt_template is None:
+        prompt_template = load_prompt_template()
+    with stage("profiles"):
+        prompt_data = attach_profiles(data, DatabaseManager.get_profile)
+    if similar_cases:
+        prompt_data = {**prompt_data, "similar_cases": similar_cases}
+
+    if BATCH_MODE == "combined":
+        item = (current_app._get_current_object(), prompt_template, prompt_data, model or MODEL, api_key_id())
+        timeout = deadline.timeout_for("llm_call", LLM_TIMEOUT_SECONDS)
+        try:
+            return combined_batcher.submit(item).result(timeout=timeout)
+        except TimeoutError:
+            raise _timeout_error(timeout)
+    return _score_prompt(render_prompt(prompt_template, prompt_data), model or MODEL)
+
+
+def _completion_payload(prompt, model):
+    payload = {
+        "model": model,
+        "messages": [{"role": "user", "content": prompt}]
+    }
+    if JSON_MODE:
+        payload["response_format"] = {"type": "json_object"}
+    return payload
+
+
+def _score_prompt(prompt, model):
+    data_prompt = _completion_payload(prompt, model)
+    result_text = _post_completion(data_prompt)
+    try:
+        return parse_llm_result(result_text)
+    except LLMResponseError as parse_error:
+        print(f"Unparseable LLM response, attempting repair: {str(parse_error)}")
+        return _repair_result(result_text, data_prompt["model"])
+
+
+def _dispatch_combined(items):
+    """Score batched transactions with one completion per (template, model) group"""
+    groups = {}
+    for index, (app, template, prompt_data, model, key_id) in enumerate(items):
+        groups.setdefault((template, model), []).append(index)
+
+    results = [None] * len(items)
+    for (template, model), indexes in groups.items():
+        app = items[indexes[0]][0]
+        with app.app_context():
+            transactions = [items[index][2] for index in indexes]
+            key_ids = [items[index][4] for index in indexes]
+            for index, result in zip(indexes, _score_group(template, model, transactions, key_ids, app)):
+                results[index] = result
+    return results
+
+
+def _score_single(app, template, model, prompt_data, key_id):
+    with app.app_context(), attribute_usage([key_id]):
+        return _score_prompt(render_prompt(template, prompt_data), model)
+
+
+def _score_group(template, model, transactions, key_ids, app=None):
+    """Score transactions with one batch completion, falling back to one call each; usage goes to key_ids.
+
+    The fallback calls run concurrently on fallback_pool, so a failed batch
+    costs about one extra call of latency rather than one per transaction.
+    """
+    if len(transactions) > 1:
+        try:
+            prompt = render_batch_prompt(template, transactions)
+            with attribute_usage(key_ids):
+                answer = extract_json_object(
+                    _post_completion(_completion_payload(prompt, model), purpose="score_batch"))
+            results = answer.get("results")
+            if not isinstance(results, list) or len(results) != len(transactions):
+                raise LLMResponseError("Batch response does not hold one result per transaction")
+            return [coerce_result(result) if isinstance(result, dict) else LLMResponseError("Malformed batch entry")
+                    for result in results]
+        except Exception as e:
+            print(f"Combined scoring failed, scoring individually: {str(e)}")
+
+    app = current_app._get_current_object() if app is None else app
+    calls = [fallback_pool.submit(_score_single, app, template, model, prompt_data, key_id)
+             for prompt_data, key_id in zip(transactions, key_ids)]
+    results = []
+    for call in calls:
+        try:
+            results.append(call.result())
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+combined_batcher = MicroBatcher("llm-combined", _dispatch_combined)
+fallback_pool = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY * BATCH_MAX_SIZE, thread_name_prefix="llm-fallback")
+
+
+def batching_metrics():
+    """Metrics of the active LLM batcher, None when batching is off"""
+    if BATCH_MODE == "combined":
+        return {"mode": BATCH_MODE, **combined_batcher.metrics()}
+    return None
+
+
+def _post_completion(payload, purpose="score"):
+    """Send a chat completion request, record its token usage and return the message content"""
+    response_json = _send_completion(payload)
+    if "choices" not in response_json or not response_json["choices"]:
+        raise Exception("Malformed API response: 'choices' key missing or empty")
+
+    record_usage(LLM_BACKEND, payload["model"], response_json.get("usage"), purpose)
+    return response_json["choices"][0]["message"]["content"] or ""
+
+
+def _send_completion(payload):
+    """Return the completion response JSON from the configured backend"""
+    timeout = deadline.timeout_for("llm_call", LLM_TIMEOUT_SECONDS)
+    with stage("llm_call"):
+        return _send_within(payload, timeout)
+
+
+def _send_within(payload, timeout):
+    try:
+        if LLM_BACKEND == "replay":
+            from .llm_log import replay_completion
+            return replay_completion(payload, timeout=timeout)
+
+        started = time.perf_counter()
+        response_json = _call_backend(payload, timeout)
+    except (requests.Timeout, TimeoutError):
+        raise _timeout_error(timeout)
+
+    if LLM_RECORD:
+        try:
+            from .llm_log import get_llm_log
+            get_llm_log().append(payload, response_json, (time.perf_counter() - started) * 1000)
+        except Exception as e:
+            print(f"Failed to record LLM completion: {str(e)}")
+    return response_json
+
+
+def _timeout_error(timeout):
+    if timeout < LLM_TIMEOUT_SECONDS:
+        return deadline.DeadlineExceeded("llm_call")
+    return BudgetExceeded(f"LLM call exceeded {LLM_TIMEOUT_SECONDS:g}s")
+
+
+def _call_backend(payload, timeout):
+    if LLM_BACKEND == "mock":
+        from .mock_llm import mock_completion
+        return mock_completion(payload, timeout=timeout)
+
+    response = http.post(API_URL, json=payload, headers=headers, timeout=timeout)
+
+    if response.status_code != 200:
+        raise Exception(f"Error code: {response.status_code} - {response.text}")
+
+    return response.json()
+
+
+def _repair_result(result_text, model=MODEL):
+    """Ask the model to reformat a malformed answer instead of re-scoring from scratch"""
+    payload = {
+        "model": model,
+        "messages": repair_messages(result_text),
+        "max_tokens": 400,
+        "temperature": 0
+    }
+    if JSON_MODE:
+        payload["response_format"] = {"type": "json_object"}
+    return parse_llm_result(_post_completion(payload, purpose="repair"))
@@ -1,18 +1,27 @@
-from openai import OpenAI
 import json
 import os
 from flask import abort
 from dotenv import load_dotenv
+from .llm_parsing import parse_llm_result, repair_messages, LLMResponseError
+from .prompt_payload import render_prompt
+from .token_usage import record_usage
 
 load_dotenv()
 
 api_key = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=api_key)
+_client = None
 
-def analyse_transaction(data):
-    try:
-        transaction_json = json.dumps(data, indent=2)
-        prompt = f"""
+
+def get_client():
+    """Create the OpenAI client on first use; the SDK is only imported when this provider is used"""
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        _client = OpenAI(api_key=api_key)
+    return _client
+
+
+INLINE_PROMPT_TEMPLATE = """
             # Transaction Risk Analysis Prompt
             ## System Instructions
             You are a specialised financial risk analyst. Your task is to evaluate
@@ -22,12 +31,12 @@ def analyse_transaction(data):
             ## Response Format
             Respond in JSON format with the following structure:
             
-            {{
+            {
             "risk_score": 0.0-1.0,
             "risk_factors": ["factor1", "factor2"...],
             "reasoning": "A brief explanation of your analysis",
             "recommended_action": "allow|review|block"
-            }}
+            }
             
             ## Risk Factors to Consider
             1. **Geographic Anomalies**:
@@ -56,27 +65,43 @@ def analyse_transaction(data):
             combinations
             - Provide actionable reasoning that explains why the transaction received
             its risk score
-            - Recommend "allow" for scores 0.0-0.3, "review" for scores 0.3-0.7, and
-            "block" for scores 0.7-1.0
+            - Recommend "allow" for scores 0.0-{review_threshold}, "review" for scores {review_threshold}-{block_threshold}, and
+            "block" for scores {block_threshold}-1.0
             ## Transaction Data
-            {transaction_json}
+            {transaction_data}
             """
+
+
+def analyse_transaction(data, model="gpt-4o", prompt_template=INLINE_PROMPT_TEMPLATE):
+    try:
+        prompt = render_prompt(prompt_template, data)
         
+        client = get_client()
         response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": prompt}]
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            response_format={"type": "json_object"}
         )
 
+        record_usage("openai", model, response.usage)
         result_text = response.choices[0].message.content
 
         try:
-            result = json.loads(result_text)
-        except json.JSONDecodeError:
-            abort(500, description="LLM response is not valid JSON")
-
-        required_keys = {"risk_score", "risk_factors", "reasoning", "recommended_action"}
-        if not required_keys.issubset(result.keys()):
-            abort(500, description="Malformed response from LLM: missing required fields")
+            result = parse_llm_result(result_text)
+        except LLMResponseError as parse_error:
+            print(f"Unparseable LLM response, attempting repair: {str(parse_error)}")
+            repair = client.chat.completions.create(
+                model=model,
+                messages=repair_messages(result_text),
+                response_format={"type": "json_object"},
+                max_tokens=400,
+                temperature=0
+            )
+            record_usage("openai", model, repair.usage, purpose="repair")
+            try:
+                result = parse_llm_result(repair.choices[0].message.content)
+            except LLMResponseError:
+                abort(500, description="LLM response is not valid JSON")
 
         return result
     
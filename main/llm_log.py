@@ -0,0 +1,208 @@
+"""Append-only log of raw LLM completions for offline, deterministic replay.
+
+With LLM_RECORD=1 every provider call is forwarded as usual and the raw
+completion and its latency are appended to the log. With
+LLM_BACKEND=replay completions are served from the log, keyed by a hash of
+the request payload, after sleeping for the recorded latency divided by
+LLM_REPLAY_SPEED (0 disables the delay).
+
+The payload holds the full prompt, including the merchant/customer profiles
+and similar cases read from the database, so a replay only hits when it
+starts from a copy of the database the recording started from and sends the
+same transactions in the same order. Otherwise the prompts differ and calls
+miss (see LLM_REPLAY_ON_MISS).
+
+Layout of LLM_LOG_DIR:
+    completions.log  zlib-compressed JSON records, each prefixed by its length
+    index.log        one "request_hash offset length latency_ms" line per record
+
+    python -m main.llm_log stats
+"""
+import argparse
+import hashlib
+import json
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from dotenv import load_dotenv
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+load_dotenv()
+
+LLM_LOG_DIR = os.getenv("LLM_LOG_DIR", os.path.join("instance", "llm-log"))
+REPLAY_SPEED = float(os.getenv("LLM_REPLAY_SPEED", "1.0"))
+# error: fail calls that were never recorded; mock: answer them from the mock backend
+REPLAY_ON_MISS = os.getenv("LLM_REPLAY_ON_MISS", "error")
+
+DATA_FILE = "completions.log"
+INDEX_FILE = "index.log"
+_LENGTH = struct.Struct(">I")
+
+
+class ReplayMiss(Exception):
+    """The request was never recorded"""
+
+
+def request_hash(payload):
+    """Stable key for a completion request"""
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class LLMLog:
+    def __init__(self, directory=LLM_LOG_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._index = None
+        self._cursors = {}
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def append(self, payload, response, latency_ms):
+        """Append one completion; safe across threads and processes"""
+        key = request_hash(payload)
+        record = zlib.compress(json.dumps({
+            "request_hash": key,
+            "payload": payload,
+            "response": response,
+            "latency_ms": latency_ms,
+            "recorded_at": time.time()
+        }, separators=(",", ":")).encode("utf-8"))
+
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock, open(self._path(DATA_FILE), "ab") as data, open(self._path(INDEX_FILE), "a") as index:
+            if fcntl is not None:
+                fcntl.flock(data, fcntl.LOCK_EX)
+            try:
+                offset = data.seek(0, os.SEEK_END)
+                data.write(_LENGTH.pack(len(record)) + record)
+                data.flush()
+                index.write(f"{key} {offset} {len(record)} {latency_ms:.1f}\n")
+                index.flush()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(data, fcntl.LOCK_UN)
+            if self._index is not None:
+                self._index.setdefault(key, []).append((offset, len(record), latency_ms))
+
+    def _load_index(self):
+        index = {}
+        try:
+            with open(self._path(INDEX_FILE)) as lines:
+                for line in lines:
+                    parts = line.split()
+                    if len(parts) != 4:
+                        continue
+                    key, offset, length, latency_ms = parts
+                    index.setdefault(key, []).append((int(offset), int(length), float(latency_ms)))
+        except FileNotFoundError:
+            pass
+        return index
+
+    def lookup(self, payload):
+        """(response, latency_ms) for a recorded request; repeated requests cycle through their recordings"""
+        key = request_hash(payload)
+        with self._lock:
+            if self._index is None:
+                self._index = self._load_index()
+            entries = self._index.get(key)
+            if not entries:
+                return None
+            cursor = self._cursors.get(key, 0)
+            self._cursors[key] = cursor + 1
+            offset, length, latency_ms = entries[cursor % len(entries)]
+
+        with open(self._path(DATA_FILE), "rb") as data:
+            data.seek(offset + _LENGTH.size)
+            record = json.loads(zlib.decompress(data.read(length)))
+        return record["response"], latency_ms
+
+    def records(self):
+        """Every record in append order"""
+        try:
+            data = open(self._path(DATA_FILE), "rb")
+        except FileNotFoundError:
+            return
+        with data:
+            while True:
+                header = data.read(_LENGTH.size)
+                if len(header) < _LENGTH.size:
+                    return
+                (length,) = _LENGTH.unpack(header)
+                body = data.read(length)
+                if len(body) < length:
+                    return
+                yield json.loads(zlib.decompress(body))
+
+    def stats(self):
+        with self._lock:
+            index = self._load_index()
+        latencies = sorted(entry[2] for entries in index.values() for entry in entries)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(round(p / 100.0 * (len(latencies) - 1))))]
+
+        return {
+            "records": len(latencies),
+            "unique_requests": len(index),
+            "latency_ms": {"p50": percentile(50), "p90": percentile(90), "p99": percentile(99)},
+            "bytes": os.path.getsize(self._path(DATA_FILE)) if os.path.exists(self._path(DATA_FILE)) else 0
+        }
+
+
+_log = None
+_log_lock = threading.Lock()
+
+
+def get_llm_log():
+    global _log
+    with _log_lock:
+        if _log is None:
+            _log = LLMLog()
+        return _log
+
+
+def replay_completion(payload, speed=None, timeout=None, log=None):
+    """Serve a recorded completion with its original latency scaled by 1/speed"""
+    speed = REPLAY_SPEED if speed is None else speed
+    log = get_llm_log() if log is None else log
+    recorded = log.lookup(payload)
+    if recorded is None:
+        if REPLAY_ON_MISS == "mock":
+            from .mock_llm import mock_completion
+            return mock_completion(payload, timeout=timeout)
+        raise ReplayMiss(f"No recorded completion for request {request_hash(payload)[:12]}")
+
+    response, latency_ms = recorded
+    if speed > 0:
+        delay = latency_ms / 1000.0 / speed
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"recorded completion took longer than {timeout:.3f}s")
+        time.sleep(delay)
+    return response
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect the recorded LLM completion log")
+    parser.add_argument("command", choices=["stats"])
+    parser.add_argument("--dir", default=LLM_LOG_DIR)
+    args = parser.parse_args(argv)
+
+    json.dump(LLMLog(args.dir).stats(), sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+import json
+from .risk_config import band_for_score
+
+REQUIRED_KEYS = ("risk_score", "risk_factors", "reasoning", "recommended_action")
+
+ACTION_ALIASES = {
+    "allow": "allow",
+    "approve": "allow",
+    "accept": "allow",
+    "review": "review",
+    "manual review": "review",
+    "manual_review": "review",
+    "flag": "review",
+    "block": "block",
+    "decline": "block",
+    "deny": "block",
+    "reject": "block",
+}
+
+REPAIR_INSTRUCTIONS = (
+    "Rewrite the following text as a single JSON object with exactly the keys "
+    '"risk_score" (number 0.0-1.0), "risk_factors" (list of strings), "reasoning" (string) '
+    'and "recommended_action" ("allow", "review" or "block"). Respond with the JSON object only.'
+)
+REPAIR_MAX_INPUT_CHARS = 4000
+
+
+class LLMResponseError(ValueError):
+    """The LLM output could not be turned into a risk analysis"""
+
+
+def _object_end(text, start):
+    """Index just past the JSON object starting at text[start], or -1 if it never closes"""
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return -1
+
+
+def extract_json_object(text):
+    """Find the first JSON object in text, whether bare, fenced or embedded in prose"""
+    if not text or not text.strip():
+        raise LLMResponseError("Empty result text from LLM")
+
+    stripped = text.strip()
+    if stripped.startswith("{"):
+        try:
+            result = json.loads(stripped)
+            if isinstance(result, dict):
+                return result
+        except json.JSONDecodeError:
+            pass
+
+    # Prefer the body of a ``` fence if there is one, then scan forward for balanced objects
+    search_from = 0
+    fence = text.find("```")
+    if fence != -1:
+        search_from = fence + 3
+
+    start = text.find("{", search_from)
+    if start == -1 and search_from:
+        start = text.find("{")
+    while start != -1:
+        end = _object_end(text, start)
+        if end == -1:
+            break
+        try:
+            result = json.loads(text[start:end])
+            if isinstance(result, dict):
+                return result
+        except json.JSONDecodeError:
+            pass
+        start = text.find("{", start + 1)
+
+    raise LLMResponseError("No JSON object found in LLM response")
+
+
+def _coerce_score(value):
+    # The prompts ask for 0.0-1.0, so only an explicit "85%" is rescaled; a bare 1.2 or 5
+    # means "off the scale high" and is clamped to 1.0 rather than read as 1.2% or 5%
+    if isinstance(value, str):
+        value = value.strip()
+        percent = value.endswith("%")
+        value = float(value.rstrip("%").strip())
+        if percent:
+            value /= 100.0
+    score = float(value)
+    if score != score:
+        raise ValueError("risk_score is NaN")
+    return min(max(score, 0.0), 1.0)
+
+
+def coerce_result(result):
+    """Normalise types of an LLM risk analysis; the score is required, the rest is defaulted"""
+    if "risk_score" not in result:
+        raise LLMResponseError("Malformed response from LLM: missing risk_score")
+    try:
+        risk_score = _coerce_score(result["risk_score"])
+    except (TypeError, ValueError):
+        raise LLMResponseError(f"Malformed risk_score from LLM: {result['risk_score']!r}")
+
+    action = result.get("recommended_action")
+    action = ACTION_ALIASES.get(action.strip().lower()) if isinstance(action, str) else None
+    if action is None:
+        action = band_for_score(risk_score)
+
+    risk_factors = result.get("risk_factors") or []
+    if isinstance(risk_factors, str):
+        risk_factors = [risk_factors]
+    elif not isinstance(risk_factors, list):
+        risk_factors = [str(risk_factors)]
+
+    reasoning = result.get("reasoning", "")
+    if not isinstance(reasoning, str):
+        reasoning = json.dumps(reasoning)
+
+    return {
+        **result,
+        "risk_score": risk_score,
+        "risk_factors": risk_factors,
+        "reasoning": reasoning,
+        "recommended_action": action,
+    }
+
+
+def parse_llm_result(text):
+    """Extract and coerce a risk analysis from raw LLM output"""
+    return coerce_result(extract_json_object(text))
+
+
+def repair_messages(text):
+    """Messages for a cheap follow-up call that only reformats a bad response"""
+    return [
+        {"role": "system", "content": REPAIR_INSTRUCTIONS},
+        {"role": "user", "content": (text or "")[:REPAIR_MAX_INPUT_CHARS]},
+    ]
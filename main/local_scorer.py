@@ -0,0 +1,110 @@
+import math
+import os
+from datetime import datetime
+from dotenv import load_dotenv
+from .risk_config import band_for_score
+
+load_dotenv()
+
+# Jurisdictions under FATF call-for-action / increased monitoring; override with HIGH_RISK_COUNTRIES=IR,KP,...
+HIGH_RISK_COUNTRIES = frozenset(
+    code.strip().upper()
+    for code in os.getenv("HIGH_RISK_COUNTRIES", "IR,KP,MM,SY,AF,YE").split(",")
+    if code.strip()
+)
+
+CATEGORY_RISK = {
+    "electronics": 0.1,
+    "jewelry": 0.15,
+    "gift_cards": 0.2,
+    "crypto": 0.2,
+    "gambling": 0.2,
+    "money_transfer": 0.2,
+    "travel": 0.1,
+}
+
+BASE_SCORE = 0.05
+WEIGHTS = {
+    "cross_border": 0.25,
+    "high_risk_country": 0.35,
+    "large_amount": 0.3,
+    "elevated_amount": 0.1,
+    "off_hours": 0.1,
+}
+LARGE_AMOUNT = 10000.0
+ELEVATED_AMOUNT = 1000.0
+
+
+def _hour(timestamp):
+    if not isinstance(timestamp, str):
+        return None
+    try:
+        return datetime.fromisoformat(timestamp.replace("Z", "+00:00")).hour
+    except ValueError:
+        return None
+
+
+def extract_features(transaction):
+    """Numeric and boolean features of a validated transaction used by local scoring"""
+    customer = transaction.get("customer") or {}
+    payment_method = transaction.get("payment_method") or {}
+    merchant = transaction.get("merchant") or {}
+
+    try:
+        amount = float(transaction.get("amount") or 0.0)
+    except (TypeError, ValueError):
+        amount = 0.0
+    customer_country = str(customer.get("country", "")).upper()
+    payment_country = str(payment_method.get("country_of_issue", "")).upper()
+    category = str(merchant.get("category", "")).lower()
+    hour = _hour(transaction.get("timestamp"))
+
+    return {
+        "amount": amount,
+        "log_amount": math.log10(amount + 1.0) if amount > 0 else 0.0,
+        "customer_country": customer_country,
+        "payment_country": payment_country,
+        "category": category,
+        "cross_border": bool(customer_country and payment_country and customer_country != payment_country),
+        "high_risk_country": customer_country in HIGH_RISK_COUNTRIES or payment_country in HIGH_RISK_COUNTRIES,
+        "off_hours": hour is not None and (hour < 6 or hour >= 23),
+        "category_risk": CATEGORY_RISK.get(category, 0.0),
+    }
+
+
+def score_features(features):
+    """Rule-based score and the risk factors that contributed to it"""
+    score = BASE_SCORE + features["category_risk"]
+    risk_factors = []
+    if features["category_risk"]:
+        risk_factors.append(f"Higher-risk merchant category: {features['category']}")
+    if features["cross_border"]:
+        score += WEIGHTS["cross_border"]
+        risk_factors.append("Customer country differs from payment method country")
+    if features["high_risk_country"]:
+        score += WEIGHTS["high_risk_country"]
+        risk_factors.append("High-risk jurisdiction involved")
+    if features["amount"] >= LARGE_AMOUNT:
+        score += WEIGHTS["large_amount"]
+        risk_factors.append("Large transaction amount")
+    elif features["amount"] >= ELEVATED_AMOUNT:
+        score += WEIGHTS["elevated_amount"]
+        risk_factors.append("Elevated transaction amount")
+    if features["off_hours"]:
+        score += WEIGHTS["off_hours"]
+        risk_factors.append("Transaction outside normal business hours")
+    return round(min(max(score, 0.0), 1.0), 4), risk_factors
+
+
+def local_score(transaction, features=None):
+    """Score a transaction without calling an LLM; same result shape as the LLM integrations"""
+    if features is None:
+        features = extract_features(transaction)
+    risk_score, risk_factors = score_features(features)
+    return {
+        "risk_score": risk_score,
+        "risk_factors": risk_factors,
+        "reasoning": "Rule-based local score",
+        "recommended_action": band_for_score(risk_score),
+        "scorer": "local"
+    }
@@ -0,0 +1,72 @@
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import time
+from dotenv import load_dotenv
+from .risk_config import band_for_score
+
+load_dotenv()
+
+MOCK_LATENCY_MS = float(os.getenv("LLM_MOCK_LATENCY_MS", "800"))
+MOCK_LATENCY_SIGMA = float(os.getenv("LLM_MOCK_LATENCY_SIGMA", "0.35"))
+MOCK_ERROR_RATE = float(os.getenv("LLM_MOCK_ERROR_RATE", "0.0"))
+BATCH_PATTERN = re.compile(r"## Batch of (\d+) transactions")
+
+
+class MockLLMError(Exception):
+    """Injected provider failure"""
+
+
+def _prompt_text(payload):
+    return "\n".join(str(message.get("content", "")) for message in payload.get("messages", []))
+
+
+def _verdict(byte):
+    risk_score = round(byte / 255.0, 2)
+    action = band_for_score(risk_score)
+    return {
+        "risk_score": risk_score,
+        "risk_factors": ["mock risk factor"] if action != "allow" else [],
+        "reasoning": "Mock LLM verdict",
+        "recommended_action": action
+    }
+
+
+def mock_completion(payload, latency_ms=None, sigma=None, error_rate=None, timeout=None):
+    """OpenAI-shaped completion with a deterministic verdict and log-normal latency.
+
+    The score is derived from a hash of the prompt, so the same transaction
+    always gets the same verdict, while latency follows a production-like tail.
+    """
+    latency_ms = MOCK_LATENCY_MS if latency_ms is None else latency_ms
+    sigma = MOCK_LATENCY_SIGMA if sigma is None else sigma
+    error_rate = MOCK_ERROR_RATE if error_rate is None else error_rate
+
+    if latency_ms > 0:
+        delay = random.lognormvariate(math.log(latency_ms), sigma) / 1000.0
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"mock provider did not answer within {timeout:.3f}s")
+        time.sleep(delay)
+    if error_rate and random.random() < error_rate:
+        raise MockLLMError("Error code: 503 - mock provider unavailable")
+
+    prompt = _prompt_text(payload)
+    digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+    batch = BATCH_PATTERN.search(prompt)
+    if batch:
+        content = json.dumps({"results": [_verdict(digest[index % len(digest)]) for index in range(int(batch.group(1)))]})
+    else:
+        content = json.dumps(_verdict(digest[0]))
+    return {
+        "id": "mock-" + digest.hex()[:12],
+        "model": payload.get("model", "mock"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": max(1, len(prompt) // 4),
+            "completion_tokens": max(1, len(content) // 4)
+        }
+    }
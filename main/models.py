@@ -4,6 +4,17 @@ import json
 
 class TransactionAnalysis(db.Model):
     __tablename__ = 'transaction_analyses'
+    __table_args__ = (
+        # Covering indexes for banded score and action filters ordered by recency
+        db.Index('ix_transaction_analyses_score_created', 'risk_score', 'created_at', 'id'),
+        db.Index('ix_transaction_analyses_action_created', 'recommended_action', 'created_at', 'id'),
+        # Serves the unfiltered latest page and the score bands in created_at order without a sort
+        db.Index('ix_transaction_analyses_created', 'created_at', 'id', 'risk_score'),
+        # Lets max(updated_at) for ETag versions be answered from the index
+        db.Index('ix_transaction_analyses_updated_at', 'updated_at'),
+        # Partial index over the few provisional verdicts still waiting for a full rescore
+        db.Index('ix_transaction_analyses_provisional', 'id', sqlite_where=db.text('provisional = 1')),
+    )
 
     id = db.Column(db.Integer, primary_key= True)
     transaction_data = db.Column(db.Text, nullable = False)
@@ -11,34 +22,177 @@ class TransactionAnalysis(db.Model):
     risk_score = db.Column(db.Float, nullable=False, default=0.0)
     recommended_action = db.Column(db.String(20), nullable=False, default='review')
     risk_factors = db.Column(db.Text, default='[]')
+    # Model cascade tiers that produced the verdict, e.g. "deepseek>openai:inline:gpt-4o"
+    decision_path = db.Column(db.String(120), nullable=True)
+    # True while a local verdict given under overload waits for its LLM rescore, else NULL
+    provisional = db.Column(db.Boolean, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def to_dict(self):
-        try:
-            return {
-                'id': self.id,
-                'transaction_data': json.loads(self.transaction_data) if self.transaction_data else {},
-                'llm_response': json.loads(self.llm_response) if self.llm_response else {},
-                'risk_score': self.risk_score,
-                'recommended_action': self.recommended_action,
-                'risk_factors': json.loads(self.risk_factors) if self.risk_factors else [],
-                'created_at': self.created_at.isoformat() if self.created_at else None,
-                'updated_at': self.updated_at.isoformat() if self.updated_at else None
-            }
-        except json.JSONDecodeError as e:
-            print(f"JSON decode error in model {self.id}: {str(e)}")
-            return {
-                'id': self.id,
-                'transaction_data': {},
-                'llm_response': {},
-                'risk_score': self.risk_score,
-                'recommended_action': self.recommended_action,
-                'risk_factors': [],
-                'created_at': self.created_at.isoformat() if self.created_at else None,
-                'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-                'error': 'Data parsing error'
-            }
+        return analysis_to_dict(self)
     
 def __repr__(self):
     return f'<TransactionAnalysis {self.id}: {self.recommended_action} (Risk: {self.risk_score})>'
+
+
+# Columns read by column-only history queries; rows expose them as attributes like the model does
+ANALYSIS_COLUMNS = ('id', 'transaction_data', 'llm_response', 'risk_score', 'recommended_action',
+                    'risk_factors', 'decision_path', 'created_at', 'updated_at')
+# Subset streamed by history exports; transaction_data stays the stored JSON text
+EXPORT_COLUMNS = ('id', 'transaction_data', 'risk_score', 'recommended_action', 'decision_path', 'created_at')
+
+
+def analysis_to_dict(analysis):
+    """Dict form of a TransactionAnalysis, or of a row selected with ANALYSIS_COLUMNS"""
+    try:
+        return {
+            'id': analysis.id,
+            'transaction_data': json.loads(analysis.transaction_data) if analysis.transaction_data else {},
+            'llm_response': json.loads(analysis.llm_response) if analysis.llm_response else {},
+            'risk_score': analysis.risk_score,
+            'recommended_action': analysis.recommended_action,
+            'risk_factors': json.loads(analysis.risk_factors) if analysis.risk_factors else [],
+            'decision_path': analysis.decision_path,
+            'created_at': analysis.created_at.isoformat() if analysis.created_at else None,
+            'updated_at': analysis.updated_at.isoformat() if analysis.updated_at else None
+        }
+    except json.JSONDecodeError as e:
+        print(f"JSON decode error in model {analysis.id}: {str(e)}")
+        return {
+            'id': analysis.id,
+            'transaction_data': {},
+            'llm_response': {},
+            'risk_score': analysis.risk_score,
+            'recommended_action': analysis.recommended_action,
+            'risk_factors': [],
+            'decision_path': analysis.decision_path,
+            'created_at': analysis.created_at.isoformat() if analysis.created_at else None,
+            'updated_at': analysis.updated_at.isoformat() if analysis.updated_at else None,
+            'error': 'Data parsing error'
+        }
+
+
+class RiskSummary(db.Model):
+    """Per score-bucket and action counts, maintained on write"""
+    __tablename__ = 'risk_summary'
+
+    bucket = db.Column(db.Integer, primary_key=True)
+    recommended_action = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class RiskRollup(db.Model):
+    """Daily counts and score sums per dimension value and action, maintained on write for analytics"""
+    __tablename__ = 'risk_rollups'
+    __table_args__ = (
+        db.Index('ix_risk_rollups_dimension_day', 'dimension', 'day'),
+    )
+
+    day = db.Column(db.Date, primary_key=True)
+    dimension = db.Column(db.String(20), primary_key=True)
+    value = db.Column(db.String(64), primary_key=True)
+    recommended_action = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    score_sum = db.Column(db.Float, nullable=False, default=0.0)
+
+
+class LLMUsage(db.Model):
+    """Token usage of a single LLM call"""
+    __tablename__ = 'llm_usage'
+    __table_args__ = (
+        db.Index('ix_llm_usage_created', 'created_at'),
+        db.Index('ix_llm_usage_key_created', 'api_key_id', 'created_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    api_key_id = db.Column(db.String(16), nullable=False, default='internal')
+    provider = db.Column(db.String(40), nullable=False)
+    model = db.Column(db.String(100), nullable=False)
+    purpose = db.Column(db.String(20), nullable=False, default='score')
+    prompt_tokens = db.Column(db.Integer, nullable=False, default=0)
+    completion_tokens = db.Column(db.Integer, nullable=False, default=0)
+    cost = db.Column(db.Float, nullable=False, default=0.0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class ShadowAnalysis(db.Model):
+    """Result of a candidate provider/prompt scoring the same transaction as a primary analysis"""
+    __tablename__ = 'shadow_analyses'
+    __table_args__ = (
+        db.Index('ix_shadow_analyses_candidate_created', 'candidate', 'created_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    analysis_id = db.Column(db.Integer, db.ForeignKey('transaction_analyses.id'), index=True)
+    candidate = db.Column(db.String(100), nullable=False)
+    risk_score = db.Column(db.Float)
+    recommended_action = db.Column(db.String(20))
+    primary_risk_score = db.Column(db.Float)
+    primary_action = db.Column(db.String(20))
+    latency_ms = db.Column(db.Float)
+    primary_latency_ms = db.Column(db.Float)
+    llm_response = db.Column(db.Text)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class RiskProfile(db.Model):
+    """Running statistics for one merchant or customer, updated on every saved analysis"""
+    __tablename__ = 'risk_profiles'
+
+    entity_type = db.Column(db.String(20), primary_key=True)
+    entity_id = db.Column(db.String(100), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    amount_mean = db.Column(db.Float, nullable=False, default=0.0)
+    # Sum of squared deviations from the mean (Welford), variance = amount_m2 / (count - 1)
+    amount_m2 = db.Column(db.Float, nullable=False, default=0.0)
+    allow_count = db.Column(db.Integer, nullable=False, default=0)
+    review_count = db.Column(db.Integer, nullable=False, default=0)
+    block_count = db.Column(db.Integer, nullable=False, default=0)
+    recent_countries = db.Column(db.Text, default='[]')
+    recent_ips = db.Column(db.Text, default='[]')
+    first_seen = db.Column(db.DateTime, default=datetime.utcnow)
+    last_seen = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return profile_to_dict(self)
+
+
+def profile_to_dict(profile):
+    """Dict form of a RiskProfile, or of a risk_profiles row returned by an upsert"""
+    variance = profile.amount_m2 / (profile.count - 1) if profile.count and profile.count > 1 else 0.0
+    return {
+        'entity_type': profile.entity_type,
+        'entity_id': profile.entity_id,
+        'count': profile.count,
+        'amount_mean': float(profile.amount_mean),
+        'amount_variance': variance,
+        'amount_std': variance ** 0.5,
+        'allow_rate': profile.allow_count / profile.count if profile.count else 0.0,
+        'review_rate': profile.review_count / profile.count if profile.count else 0.0,
+        'block_rate': profile.block_count / profile.count if profile.count else 0.0,
+        'recent_countries': json.loads(profile.recent_countries or '[]'),
+        'recent_ips': json.loads(profile.recent_ips or '[]'),
+        'first_seen': profile.first_seen.isoformat() if profile.first_seen else None,
+        'last_seen': profile.last_seen.isoformat() if profile.last_seen else None
+    }
+
+
+ALERT_STATUSES = ('open', 'acknowledged', 'assigned', 'resolved')
+
+
+class AlertState(db.Model):
+    """Triage state of a high-risk analysis; rows are created open when the alert is raised"""
+    __tablename__ = 'alert_states'
+    __table_args__ = (
+        # Unread-since-cursor queries walk (status, analysis_id) without touching other alerts
+        db.Index('ix_alert_states_status_analysis', 'status', 'analysis_id'),
+        db.Index('ix_alert_states_updated_at', 'updated_at'),
+    )
+
+    analysis_id = db.Column(db.Integer, db.ForeignKey('transaction_analyses.id'), primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='open')
+    assignee = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,193 @@
+import os
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+# Lifetime of profiles cached in shared state (multi-process / multi-node deployments)
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "300"))
+RECENT_VALUES = int(os.getenv("PROFILE_RECENT_VALUES", "5"))
+
+PROFILE_KEYS = (
+    # (entity_type, path to the id, path to the country, path to the ip)
+    ("merchant", ("merchant", "id"), ("customer", "country"), ("customer", "ip_address")),
+    ("customer", ("customer", "id"), ("customer", "country"), ("customer", "ip_address")),
+)
+
+
+class ProfileCache:
+    """Thread-safe LRU of profile dicts keyed by (entity_type, entity_id)"""
+
+    def __init__(self, capacity=PROFILE_CACHE_SIZE):
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            profile = self._entries.get(key)
+            if profile is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return profile
+
+    def put(self, key, profile):
+        with self._lock:
+            self._entries[key] = profile
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "capacity": self.capacity, "hits": self.hits, "misses": self.misses}
+
+
+class SharedProfileCache:
+    """Profile cache kept in shared state, so writes and invalidations on one node are seen by all.
+
+    Same interface as ProfileCache; backend failures degrade to cache misses.
+    """
+
+    def __init__(self, state_getter, ttl=PROFILE_CACHE_TTL):
+        self._state_getter = state_getter
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _count(self, outcome):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def _key(self, key):
+        # A full invalidate bumps the generation, orphaning every older entry until it expires.
+        # It is read on every call (one extra round trip) so an invalidate on any node applies at once.
+        generation = self._state_getter().get("profiles:generation") or 0
+        entity_type, entity_id = key
+        return f"profile:{generation}:{entity_type}:{entity_id}"
+
+    def get(self, key):
+        try:
+            profile = self._state_getter().get(self._key(key))
+        except Exception as e:
+            print(f"Shared profile cache read failed: {str(e)}")
+            self._count("errors")
+            profile = None
+        self._count("hits" if profile is not None else "misses")
+        return profile
+
+    def put(self, key, profile):
+        try:
+            self._state_getter().set(self._key(key), profile, self.ttl)
+        except Exception as e:
+            print(f"Shared profile cache write failed: {str(e)}")
+            self._count("errors")
+
+    def invalidate(self, key=None):
+        try:
+            if key is None:
+                self._state_getter().incr("profiles:generation")
+            else:
+                self._state_getter().delete(self._key(key))
+        except Exception as e:
+            print(f"Shared profile cache invalidation failed: {str(e)}")
+            self._count("errors")
+
+    def stats(self):
+        with self._lock:
+            return {"shared": True, "ttl": self.ttl, "hits": self.hits, "misses": self.misses, "errors": self.errors}
+
+
+def _create_profile_cache():
+    from .shared_state import SHARED_STATE_URL, get_shared_state
+    if SHARED_STATE_URL.startswith("memory:"):
+        return ProfileCache()
+    return SharedProfileCache(get_shared_state)
+
+
+profile_cache = _create_profile_cache()
+
+
+def _lookup(data, path):
+    value = data
+    for key in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def profile_keys(transaction):
+    """(entity_type, entity_id, country, ip) for every profile a transaction touches"""
+    keys = []
+    if not isinstance(transaction, dict):
+        return keys
+    for entity_type, id_path, country_path, ip_path in PROFILE_KEYS:
+        entity_id = _lookup(transaction, id_path)
+        if entity_id is None or entity_id == "":
+            continue
+        keys.append((entity_type, str(entity_id), _lookup(transaction, country_path), _lookup(transaction, ip_path)))
+    return keys
+
+
+def push_recent(values, value, limit=RECENT_VALUES):
+    """Most-recent-first list of distinct values"""
+    if value is None or value == "":
+        return values
+    return ([value] + [existing for existing in values if existing != value])[:limit]
+
+
+def summarize_profile(profile, transaction):
+    """Compact history for the prompt, relative to the transaction being scored"""
+    if not profile or not profile.get("count"):
+        return {"seen_before": False}
+    summary = {
+        "seen_before": True,
+        "transactions": profile["count"],
+        "avg_amount": round(profile["amount_mean"], 2),
+        "block_rate": round(profile["block_rate"], 3),
+        "review_rate": round(profile["review_rate"], 3),
+    }
+    try:
+        amount = float(transaction.get("amount"))
+        if profile["amount_std"] > 0:
+            summary["amount_zscore"] = round((amount - profile["amount_mean"]) / profile["amount_std"], 2)
+    except (TypeError, ValueError):
+        pass
+    country = _lookup(transaction, ("customer", "country"))
+    ip_address = _lookup(transaction, ("customer", "ip_address"))
+    if country:
+        summary["new_country"] = country not in profile["recent_countries"]
+    if ip_address:
+        summary["new_ip"] = ip_address not in profile["recent_ips"]
+    return summary
+
+
+def attach_profiles(transaction, get_profile):
+    """Copy of the transaction with merchant_history / customer_history added for the prompt"""
+    if not isinstance(transaction, dict):
+        return transaction
+    enriched = dict(transaction)
+    for entity_type, entity_id, _, _ in profile_keys(transaction):
+        try:
+            profile = get_profile(entity_type, entity_id)
+        except Exception as e:
+            print(f"Profile lookup failed for {entity_type} {entity_id}: {str(e)}")
+            continue
+        enriched[f"{entity_type}_history"] = summarize_profile(profile, transaction)
+    return enriched
@@ -0,0 +1,240 @@
+"""Request profiling: stage timings and SQL of slow requests, and an on-demand sampling profiler.
+
+Statements are attached to the current profile by sql_instrumentation.
+
+Requests slower than SLOW_REQUEST_MS are kept in a bounded ring buffer
+(GET /admin/slow-requests). The sampling profiler walks every thread's stack
+at a fixed interval for a time window and reports collapsed stacks, the input
+format of flamegraph.pl and speedscope (POST/GET /admin/profiler).
+"""
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 0 disables slow-request capture and with it all per-request bookkeeping
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+SLOW_REQUEST_BUFFER = int(os.getenv("SLOW_REQUEST_BUFFER", "100"))
+SLOW_REQUEST_MAX_STATEMENTS = int(os.getenv("SLOW_REQUEST_MAX_STATEMENTS", "100"))
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "5"))
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "300"))
+# Start the sampling profiler for this many seconds when the app starts
+PROFILER_ON_START_SECONDS = float(os.getenv("PROFILER_ON_START_SECONDS", "0"))
+
+_current = contextvars.ContextVar("request_profile", default=None)
+
+
+class RequestProfile:
+    __slots__ = ("method", "path", "started_at", "started", "stages", "statements", "dropped_statements")
+
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+        self.started_at = datetime.utcnow()
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.statements = []
+        self.dropped_statements = 0
+
+    def add_stage(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_statement(self, record):
+        """Keep a sql_instrumentation.StatementRecord, up to SLOW_REQUEST_MAX_STATEMENTS"""
+        if len(self.statements) >= SLOW_REQUEST_MAX_STATEMENTS:
+            self.dropped_statements += 1
+            return
+        self.statements.append(record)
+
+    def to_dict(self, status, elapsed, repeated=None):
+        return {
+            "method": self.method,
+            "path": self.path,
+            "status": status,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round(elapsed * 1000, 1),
+            "stages": {name: round(seconds * 1000, 1) for name, seconds in self.stages.items()},
+            "sql": {
+                "count": len(self.statements) + self.dropped_statements,
+                "total_ms": round(sum(record.seconds for record in self.statements) * 1000, 1),
+                "statements": [
+                    {"statement": record.statement, "fingerprint": record.fingerprint,
+                     "duration_ms": round(record.seconds * 1000, 2), "rows": record.rows}
+                    for record in self.statements
+                ],
+                "dropped": self.dropped_statements,
+                "repeated": repeated or {}
+            }
+        }
+
+
+class SlowRequestLog:
+    """Ring buffer of the most recent slow requests"""
+
+    def __init__(self, size=SLOW_REQUEST_BUFFER):
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self._captured = 0
+
+    def add(self, entry):
+        with self._lock:
+            self._entries.append(entry)
+            self._captured += 1
+
+    def entries(self, limit=None):
+        """Newest first"""
+        with self._lock:
+            entries = list(self._entries)
+        entries.reverse()
+        return entries[:limit] if limit else entries
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self):
+        with self._lock:
+            return {"buffered": len(self._entries), "capacity": self._entries.maxlen, "captured": self._captured}
+
+
+slow_requests = SlowRequestLog()
+
+
+def current_profile():
+    return _current.get()
+
+
+def begin_request(method, path):
+    """Start profiling the current request; returns a token for finish_request, None when disabled"""
+    if SLOW_REQUEST_MS <= 0:
+        return None
+    return _current.set(RequestProfile(method, path))
+
+
+def finish_request(token, status, repeated=None):
+    """Stop profiling; slow requests are added to the ring buffer and returned"""
+    if token is None:
+        return None
+    profile = _current.get()
+    try:
+        _current.reset(token)
+    except ValueError:
+        # Finished from a different context, e.g. the tail of a streamed response
+        return None
+    if profile is None:
+        return None
+    elapsed = time.perf_counter() - profile.started
+    if elapsed * 1000 < SLOW_REQUEST_MS:
+        return None
+    entry = profile.to_dict(status, elapsed, repeated)
+    slow_requests.add(entry)
+    return entry
+
+
+@contextmanager
+def stage(name):
+    """Time a block as a named stage of the current request"""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_stage(name, time.perf_counter() - started)
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Samples all thread stacks at an interval; aggregates them as collapsed stacks"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._stacks = {}
+        self._samples = 0
+        self._started_at = None
+        self._seconds = None
+        self._interval = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds, interval_ms=PROFILER_INTERVAL_MS):
+        """Begin a sampling window; False if one is already running"""
+        if not 0 < seconds <= PROFILER_MAX_SECONDS:
+            raise ValueError(f"seconds must be between 0 and {PROFILER_MAX_SECONDS:g}")
+        if not 0 < interval_ms <= 1000:
+            raise ValueError("interval_ms must be between 0 and 1000")
+        with self._lock:
+            if self.running:
+                return False
+            self._stop.clear()
+            self._stacks = {}
+            self._samples = 0
+            self._started_at = datetime.utcnow()
+            self._seconds = seconds
+            self._interval = interval_ms / 1000.0
+            self._thread = threading.Thread(target=self._run, args=(time.monotonic() + seconds,),
+                                            name="sampling-profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout=5)
+
+    def _run(self, ends_at):
+        own_id = threading.get_ident()
+        while not self._stop.is_set() and time.monotonic() < ends_at:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(thread_id, str(thread_id)))
+                stack = ";".join(reversed(labels))
+                with self._lock:
+                    self._stacks[stack] = self._stacks.get(stack, 0) + 1
+            with self._lock:
+                self._samples += 1
+            self._stop.wait(self._interval)
+
+    def collapsed(self):
+        """One 'frame;frame;frame count' line per distinct stack, most frequent first"""
+        with self._lock:
+            stacks = sorted(self._stacks.items(), key=lambda item: -item[1])
+        return "\n".join(f"{stack} {count}" for stack, count in stacks)
+
+    def status(self):
+        with self._lock:
+            return {
+                "running": self.running,
+                "started_at": self._started_at.isoformat() if self._started_at else None,
+                "seconds": self._seconds,
+                "interval_ms": self._interval * 1000 if self._interval else None,
+                "samples": self._samples,
+                "distinct_stacks": len(self._stacks)
+            }
+
+
+sampling_profiler = SamplingProfiler()
@@ -0,0 +1,88 @@
+import json
+import os
+from dotenv import load_dotenv
+from .risk_config import get_thresholds
+
+load_dotenv()
+
+MINIMIZE_PAYLOAD = os.getenv("PROMPT_MINIMIZE", "1") == "1"
+SHORT_KEYS = os.getenv("PROMPT_SHORT_KEYS", "0") == "1"
+
+# (path in the transaction, key in the minimized payload, short key)
+# Only fields the risk prompt actually reasons about are sent to the model.
+PROMPT_FIELDS = (
+    (("timestamp",), "timestamp", "ts"),
+    (("amount",), "amount", "amt"),
+    (("currency",), "currency", "cur"),
+    (("customer", "country"), "customer_country", "c_cc"),
+    (("customer", "ip_address"), "ip_address", "ip"),
+    (("payment_method", "type"), "payment_type", "pm"),
+    (("payment_method", "country_of_issue"), "payment_country", "pm_cc"),
+    (("payment_method", "added_at"), "payment_added_at", "pm_add"),
+    (("merchant", "name"), "merchant_name", "m"),
+    (("merchant", "category"), "merchant_category", "m_cat"),
+    (("merchant_history",), "merchant_history", "m_hist"),
+    (("customer_history",), "customer_history", "c_hist"),
+    (("similar_cases",), "similar_cases", "sim"),
+)
+
+SHORT_KEY_LEGEND = "Keys: " + ", ".join(f"{short}={name}" for _, name, short in PROMPT_FIELDS)
+
+
+def _lookup(data, path):
+    value = data
+    for key in path:
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def minimize_transaction(data, short_keys=False):
+    """Project a transaction down to a flat dict of the fields the risk prompt uses"""
+    minimized = {}
+    for path, name, short in PROMPT_FIELDS:
+        value = _lookup(data, path)
+        if value is not None:
+            minimized[short if short_keys else name] = value
+    return minimized
+
+
+def serialize_for_prompt(data, minimize=None, short_keys=None):
+    """JSON text for the {transaction_data} placeholder"""
+    minimize = MINIMIZE_PAYLOAD if minimize is None else minimize
+    short_keys = SHORT_KEYS if short_keys is None else short_keys
+    if not minimize:
+        return json.dumps(data)
+
+    payload = json.dumps(minimize_transaction(data, short_keys), separators=(",", ":"))
+    if short_keys:
+        return f"{SHORT_KEY_LEGEND}\n{payload}"
+    return payload
+
+
+BATCH_INSTRUCTIONS = (
+    "\n\n## Batch of {count} transactions\n"
+    "The transactions above are numbered from 0. Assess each one independently and respond with a "
+    "single JSON object {{\"results\": [...]}} holding one analysis per transaction, in the same order, "
+    "each with the structure given under Response Format."
+)
+
+
+def _fill(template, transaction_text):
+    review_threshold, block_threshold = get_thresholds()
+    return (template
+            .replace('{review_threshold}', f"{review_threshold:g}")
+            .replace('{block_threshold}', f"{block_threshold:g}")
+            .replace('{transaction_data}', transaction_text))
+
+
+def render_prompt(template, data):
+    """Fill the threshold and transaction placeholders of a prompt template"""
+    return _fill(template, serialize_for_prompt(data))
+
+
+def render_batch_prompt(template, transactions):
+    """One prompt scoring several transactions, answered as {"results": [...]}"""
+    text = "\n".join(f"{index}: {serialize_for_prompt(data)}" for index, data in enumerate(transactions))
+    return _fill(template, text) + BATCH_INSTRUCTIONS.format(count=len(transactions))
@@ -0,0 +1,46 @@
+from .llm_int_deepseek import analyse_transaction_deepseek, load_prompt_template
+from .local_scorer import local_score
+
+PROVIDERS = ("deepseek", "openai", "local")
+PROMPTS = ("file", "inline")
+
+
+def _prompt_template(prompt):
+    if prompt == "file":
+        return load_prompt_template()
+    if prompt == "inline":
+        from .llm_integrator import INLINE_PROMPT_TEMPLATE
+        return INLINE_PROMPT_TEMPLATE
+    raise ValueError(f"Unknown prompt: {prompt}")
+
+
+def get_provider(spec):
+    """Build a scoring callable from 'provider[:prompt[:model]]'.
+
+    Examples: 'deepseek', 'deepseek:inline', 'openai:file:gpt-4o-mini', 'local'.
+    The callable takes a transaction and returns a result without saving it.
+    """
+    parts = spec.split(":", 2)
+    provider = parts[0]
+    prompt = parts[1] if len(parts) > 1 and parts[1] else None
+    model = parts[2] if len(parts) > 2 and parts[2] else None
+
+    if provider == "local":
+        return local_score
+    if provider == "deepseek":
+        def score(data):
+            template = _prompt_template(prompt) if prompt else None
+            return analyse_transaction_deepseek(data, save_to_db=False, model=model, prompt_template=template,
+                                                use_cascade=False)
+        return score
+    if provider == "openai":
+        def score(data):
+            from .llm_integrator import analyse_transaction
+            kwargs = {}
+            if prompt:
+                kwargs["prompt_template"] = _prompt_template(prompt)
+            if model:
+                kwargs["model"] = model
+            return analyse_transaction(data, **kwargs)
+        return score
+    raise ValueError(f"Unknown provider: {provider}")
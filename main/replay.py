@@ -0,0 +1,195 @@
+"""Replay stored transactions against a running instance.
+
+Streams transaction_data from transaction_analyses and sends it to
+POST /transaction with open-loop arrivals, either at a fixed rate or at the
+original (time-compressed) spacing, and reports latency percentiles and
+error rates. Start the target with LLM_BACKEND=mock to load-test without
+provider calls:
+
+    python -m main.replay --target http://localhost:5000 --rate 50 --duration 60
+    python -m main.replay --target http://localhost:5000 --speedup 100 --max-requests 5000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import create_engine, text
+
+CORPUS_QUERY = text(
+    "SELECT id, transaction_data, created_at FROM transaction_analyses "
+    "WHERE id > :last_id ORDER BY id LIMIT :limit"
+)
+
+
+def iter_corpus(database_url, chunk_size=1000):
+    """Yield (transaction, created_at) pairs from stored analyses, reading in id-ordered chunks"""
+    engine = create_engine(database_url)
+    last_id = 0
+    try:
+        with engine.connect() as conn:
+            while True:
+                rows = conn.execute(CORPUS_QUERY, {"last_id": last_id, "limit": chunk_size}).all()
+                if not rows:
+                    return
+                last_id = rows[-1][0]
+                for _, transaction_data, created_at in rows:
+                    try:
+                        transaction = json.loads(transaction_data)
+                    except (TypeError, ValueError):
+                        continue
+                    if isinstance(created_at, str):
+                        created_at = datetime.fromisoformat(created_at)
+                    yield transaction, created_at
+    finally:
+        engine.dispose()
+
+
+def schedule(corpus, rate=None, speedup=None, poisson=False, loop=False):
+    """Yield (offset_seconds, transaction) arrivals independent of response times (open loop)"""
+    offset = 0.0
+    while True:
+        base = offset
+        first_created = None
+        produced = False
+        for transaction, created_at in corpus():
+            produced = True
+            if rate:
+                offset += random.expovariate(rate) if poisson else 1.0 / rate
+            elif created_at is not None:
+                if first_created is None:
+                    first_created = created_at
+                offset = base + (created_at - first_created).total_seconds() / speedup
+            yield offset, transaction
+        if not loop or not produced:
+            return
+
+
+def _percentile(values, percentile):
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, int(round(percentile / 100.0 * (len(values) - 1)))))
+    return round(values[index], 2)
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies_ms = []
+        self.service_ms = []
+        self.statuses = {}
+        self.errors = {}
+
+    def record(self, status, latency_ms, service_ms, error=None):
+        with self._lock:
+            self.latencies_ms.append(latency_ms)
+            self.service_ms.append(service_ms)
+            key = str(status) if status is not None else "exception"
+            self.statuses[key] = self.statuses.get(key, 0) + 1
+            if error:
+                self.errors[error] = self.errors.get(error, 0) + 1
+
+    def summary(self, elapsed):
+        latencies = sorted(self.latencies_ms)
+        service = sorted(self.service_ms)
+        total = len(latencies)
+        failed = sum(count for status, count in self.statuses.items()
+                     if status == "exception" or not status.startswith("2"))
+        return {
+            "requests": total,
+            "elapsed_seconds": round(elapsed, 2),
+            "achieved_rate": round(total / elapsed, 2) if elapsed else None,
+            "error_rate": failed / total if total else 0.0,
+            "statuses": self.statuses,
+            "errors": dict(sorted(self.errors.items(), key=lambda item: -item[1])[:10]),
+            # Measured from the scheduled send time, so client-side queueing is included
+            "latency_ms": {p: _percentile(latencies, float(p[1:])) for p in ("p50", "p90", "p99", "p99.9")}
+                          | {"max": round(latencies[-1], 2) if latencies else None},
+            "service_time_ms": {p: _percentile(service, float(p[1:])) for p in ("p50", "p90", "p99")},
+        }
+
+
+def run(arrivals, target, api_key, concurrency=64, timeout=30.0, unique_ids=True,
+        duration=None, max_requests=None, deadline_ms=None):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    headers = {"X-API-KEY": api_key, "Content-Type": "application/json"}
+    if deadline_ms:
+        headers["X-Request-Timeout-Ms"] = str(deadline_ms)
+    url = target.rstrip("/") + "/transaction"
+    recorder = Recorder()
+
+    def send(scheduled_at, transaction):
+        started = time.perf_counter()
+        try:
+            response = session.post(url, data=json.dumps(transaction), headers=headers, timeout=timeout)
+            status, error = response.status_code, None
+        except requests.RequestException as e:
+            status, error = None, type(e).__name__
+        finished = time.perf_counter()
+        recorder.record(status, (finished - scheduled_at) * 1000, (finished - started) * 1000, error)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for sent, (offset, transaction) in enumerate(arrivals):
+            if max_requests is not None and sent >= max_requests:
+                break
+            if duration is not None and offset > duration:
+                break
+            scheduled_at = start + offset
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            if unique_ids:
+                transaction = dict(transaction)
+                transaction["transaction_id"] = f"tx_replay_{sent}_{transaction.get('transaction_id', '')}"
+            pool.submit(send, scheduled_at, transaction)
+    return recorder.summary(time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay stored transactions against a running instance")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:///instance/transactions.db"))
+    parser.add_argument("--target", default="http://localhost:5000")
+    parser.add_argument("--api-key", default=os.getenv("SECRET_API_KEY", ""))
+    pacing = parser.add_mutually_exclusive_group(required=True)
+    pacing.add_argument("--rate", type=float, help="Target arrivals per second")
+    pacing.add_argument("--speedup", type=float, help="Replay original spacing compressed by this factor")
+    parser.add_argument("--poisson", action="store_true", help="Exponential inter-arrival times at --rate")
+    parser.add_argument("--loop", action="store_true", help="Restart the corpus when it is exhausted")
+    parser.add_argument("--duration", type=float, help="Stop scheduling after this many seconds")
+    parser.add_argument("--max-requests", type=int)
+    parser.add_argument("--concurrency", type=int, default=64, help="Maximum outstanding requests")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--deadline-ms", type=float, help="Latency budget sent in X-Request-Timeout-Ms")
+    parser.add_argument("--keep-ids", action="store_true", help="Send the stored transaction ids unchanged")
+    args = parser.parse_args(argv)
+
+    if (args.rate is not None and args.rate <= 0) or (args.speedup is not None and args.speedup <= 0):
+        parser.error("--rate and --speedup must be positive")
+
+    arrivals = schedule(
+        lambda: iter_corpus(args.database_url),
+        rate=args.rate, speedup=args.speedup, poisson=args.poisson, loop=args.loop
+    )
+    summary = run(
+        arrivals, args.target, args.api_key,
+        concurrency=args.concurrency, timeout=args.timeout, unique_ids=not args.keep_ids,
+        duration=args.duration, max_requests=args.max_requests, deadline_ms=args.deadline_ms
+    )
+    json.dump(summary, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 0 if summary["requests"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
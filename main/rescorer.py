@@ -0,0 +1,216 @@
+"""Offline re-scoring of stored transaction analyses.
+
+Loads the stored history in columnar chunks, with the transaction fields
+pulled out of the stored JSON by SQLite's json_extract rather than parsed row
+by row in Python, applies a rule set and a new set of threshold bands with
+vectorised NumPy operations and reports how the recommended actions would
+shift. Runs without the Flask app:
+
+    python -m main.rescorer --review-threshold 0.25 --block-threshold 0.65 --rules rules.json
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sqlalchemy import create_engine, text
+
+from .risk_config import RISK_BANDS as ACTIONS, DEFAULT_REVIEW_THRESHOLD, DEFAULT_BLOCK_THRESHOLD, get_thresholds
+
+
+def _field(path, default):
+    # json_valid guards against malformed payloads, which would fail the whole chunk
+    return (f"COALESCE(CASE WHEN json_valid(transaction_data) "
+            f"THEN json_extract(transaction_data, '{path}') END, {default})")
+
+
+# Rows come back as (id, amount, customer_country, payment_country, category, risk_score, recommended_action)
+CHUNK_QUERY = text(
+    "SELECT id, "
+    + ", ".join([
+        f"CAST({_field('$.amount', '0.0')} AS REAL)",
+        _field("$.customer.country", "''"),
+        _field("$.payment_method.country_of_issue", "''"),
+        _field("$.merchant.category", "''"),
+    ])
+    + ", COALESCE(risk_score, 0.0), recommended_action "
+    "FROM transaction_analyses WHERE id > :last_id ORDER BY id LIMIT :limit"
+)
+
+
+def iter_chunks(database_url, chunk_size=50000):
+    """Yield chunks of extracted rows (see CHUNK_QUERY) in id order"""
+    engine = create_engine(database_url)
+    last_id = 0
+    try:
+        with engine.connect() as conn:
+            while True:
+                rows = conn.execute(CHUNK_QUERY, {"last_id": last_id, "limit": chunk_size}).all()
+                if not rows:
+                    return
+                last_id = rows[-1][0]
+                yield [tuple(row) for row in rows]
+    finally:
+        engine.dispose()
+
+
+def to_columns(rows):
+    """Turn a chunk of extracted rows into a dict of NumPy column arrays"""
+    n = len(rows)
+    if n:
+        _, amount, customer_country, payment_country, category, risk_score, recommended_action = zip(*rows)
+    else:
+        amount = customer_country = payment_country = category = risk_score = recommended_action = ()
+
+    actions = np.array(recommended_action, dtype=str)
+    action = np.ones(n, dtype=np.int8)
+    for code, name in enumerate(ACTIONS):
+        action[actions == name] = code
+
+    return {
+        "amount": np.array(amount, dtype=np.float64),
+        "customer_country": np.array(customer_country, dtype=str),
+        "payment_country": np.array(payment_country, dtype=str),
+        "category": np.array(category, dtype=str),
+        "risk_score": np.array(risk_score, dtype=np.float64),
+        "action": action,
+    }
+
+
+def _rule_mask(rule, columns):
+    when = rule["when"]
+    value = rule.get("value")
+    if when == "cross_border":
+        return columns["customer_country"] != columns["payment_country"]
+    if when == "amount_gte":
+        return columns["amount"] >= float(value)
+    if when == "amount_lt":
+        return columns["amount"] < float(value)
+    if when == "category_in":
+        return np.isin(columns["category"], list(value))
+    if when == "customer_country_in":
+        return np.isin(columns["customer_country"], list(value))
+    if when == "payment_country_in":
+        return np.isin(columns["payment_country"], list(value))
+    raise ValueError(f"Unknown rule condition: {when}")
+
+
+def classify(scores, review_threshold, block_threshold):
+    """Map scores to action codes; bands match get_high_risk_analyses (block is > block_threshold)"""
+    return np.digitize(scores, [review_threshold, block_threshold], right=True).astype(np.int8)
+
+
+def rescore_chunk(rows, review_threshold=DEFAULT_REVIEW_THRESHOLD,
+                  block_threshold=DEFAULT_BLOCK_THRESHOLD, rules=()):
+    """Re-score one chunk and return its partial report"""
+    columns = to_columns(rows)
+    scores = columns["risk_score"].copy()
+    rule_hits = {}
+    for rule in rules:
+        mask = _rule_mask(rule, columns)
+        scores += mask * float(rule.get("delta", 0.0))
+        rule_hits[rule.get("name", rule["when"])] = int(mask.sum())
+    np.clip(scores, 0.0, 1.0, out=scores)
+
+    new_action = classify(scores, review_threshold, block_threshold)
+    shift = np.zeros((len(ACTIONS), len(ACTIONS)), dtype=np.int64)
+    np.add.at(shift, (columns["action"], new_action), 1)
+
+    return {
+        "rows": len(rows),
+        "shift": shift,
+        "rule_hits": rule_hits,
+        "score_delta_sum": float((scores - columns["risk_score"]).sum()),
+    }
+
+
+def _merge(report, partial):
+    report["rows"] += partial["rows"]
+    report["shift"] += partial["shift"]
+    report["score_delta_sum"] += partial["score_delta_sum"]
+    for name, hits in partial["rule_hits"].items():
+        report["rule_hits"][name] = report["rule_hits"].get(name, 0) + hits
+
+
+def _format_report(report):
+    shift = report["shift"]
+    rows = report["rows"]
+    changed = int(rows - np.trace(shift))
+    return {
+        "rows": rows,
+        "before": {action: int(shift[i, :].sum()) for i, action in enumerate(ACTIONS)},
+        "after": {action: int(shift[:, j].sum()) for j, action in enumerate(ACTIONS)},
+        "shift": {
+            f"{ACTIONS[i]}->{ACTIONS[j]}": int(shift[i, j])
+            for i in range(len(ACTIONS)) for j in range(len(ACTIONS))
+            if i != j and shift[i, j]
+        },
+        "changed": changed,
+        "changed_ratio": changed / rows if rows else 0.0,
+        "mean_score_delta": report["score_delta_sum"] / rows if rows else 0.0,
+        "rule_hits": report["rule_hits"],
+    }
+
+
+def rescore(chunks, review_threshold=DEFAULT_REVIEW_THRESHOLD,
+            block_threshold=DEFAULT_BLOCK_THRESHOLD, rules=(), workers=1):
+    """Re-score an iterable of row chunks, fanning out to a process pool when workers > 1"""
+    if review_threshold > block_threshold:
+        raise ValueError("review_threshold must not exceed block_threshold")
+    rules = list(rules)
+    report = {
+        "rows": 0,
+        "shift": np.zeros((len(ACTIONS), len(ACTIONS)), dtype=np.int64),
+        "rule_hits": {},
+        "score_delta_sum": 0.0,
+    }
+
+    if workers <= 1:
+        for rows in chunks:
+            _merge(report, rescore_chunk(rows, review_threshold, block_threshold, rules))
+        return _format_report(report)
+
+    # Keep a bounded number of chunks in flight so the whole history is never in memory
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        for rows in chunks:
+            pending.append(pool.submit(rescore_chunk, rows, review_threshold, block_threshold, rules))
+            if len(pending) >= workers * 2:
+                _merge(report, pending.pop(0).result())
+        for future in pending:
+            _merge(report, future.result())
+    return _format_report(report)
+
+
+def main(argv=None):
+    review_threshold, block_threshold = get_thresholds()
+    parser = argparse.ArgumentParser(description="Re-score stored transaction analyses offline")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:///instance/transactions.db"))
+    parser.add_argument("--review-threshold", type=float, default=review_threshold)
+    parser.add_argument("--block-threshold", type=float, default=block_threshold)
+    parser.add_argument("--rules", help="JSON file with a list of rules")
+    parser.add_argument("--chunk-size", type=int, default=50000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args(argv)
+
+    rules = []
+    if args.rules:
+        with open(args.rules, "r", encoding="utf-8") as file:
+            rules = json.load(file)
+
+    report = rescore(
+        iter_chunks(args.database_url, args.chunk_size),
+        review_threshold=args.review_threshold,
+        block_threshold=args.block_threshold,
+        rules=rules,
+        workers=args.workers,
+    )
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
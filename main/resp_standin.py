@@ -0,0 +1,135 @@
+"""Minimal in-memory server speaking the subset of the Redis protocol used by RedisState.
+
+For tests and local multi-node runs without a Redis install:
+
+    python -m main.resp_standin --port 6380
+    SHARED_STATE_URL=redis://localhost:6380/0 flask run
+"""
+import argparse
+import socketserver
+import threading
+import time
+
+
+class Status(str):
+    """Simple string reply, as opposed to a bulk string"""
+
+
+OK = Status("OK")
+
+
+class StandinStore:
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def live(self, key, now):
+        entry = self.values.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= now:
+            del self.values[key]
+            return None
+        return entry
+
+    def execute(self, command, args):
+        now = time.time()
+        with self.lock:
+            if command == "PING":
+                return Status("PONG")
+            if command in ("AUTH", "SELECT"):
+                return OK
+            if command == "FLUSHDB":
+                self.values.clear()
+                return OK
+            if command == "GET":
+                entry = self.live(args[0], now)
+                return entry[0] if entry else None
+            if command == "SET":
+                key, value, options = args[0], args[1], [arg.upper() for arg in args[2:]]
+                expires_at = None
+                if "PX" in options:
+                    expires_at = now + int(args[2 + options.index("PX") + 1]) / 1000.0
+                elif "EX" in options:
+                    expires_at = now + int(args[2 + options.index("EX") + 1])
+                if "NX" in options and self.live(key, now) is not None:
+                    return None
+                self.values[key] = (value, expires_at)
+                return OK
+            if command == "DEL":
+                return sum(1 for key in args if self.values.pop(key, None) is not None)
+            if command in ("INCR", "INCRBY"):
+                entry = self.live(args[0], now) or ("0", None)
+                try:
+                    value = int(entry[0]) + (int(args[1]) if command == "INCRBY" else 1)
+                except ValueError:
+                    return Exception("ERR value is not an integer or out of range")
+                self.values[args[0]] = (str(value), entry[1])
+                return value
+            if command == "PEXPIRE":
+                entry = self.live(args[0], now)
+                if entry is None:
+                    return 0
+                self.values[args[0]] = (entry[0], now + int(args[1]) / 1000.0)
+                return 1
+        return Exception(f"ERR unknown command '{command}'")
+
+
+def _encode(reply):
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, Exception):
+        return b"-" + str(reply).encode("utf-8") + b"\r\n"
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if isinstance(reply, Status):
+        return b"+" + reply.encode("utf-8") + b"\r\n"
+    data = reply.encode("utf-8")
+    return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            if not line.startswith(b"*"):
+                self.wfile.write(b"-ERR inline commands are not supported\r\n")
+                continue
+            args = []
+            for _ in range(int(line[1:-2])):
+                length = int(self.rfile.readline()[1:-2])
+                args.append(self.rfile.read(length + 2)[:-2].decode("utf-8"))
+            self.wfile.write(_encode(self.server.store.execute(args[0].upper(), args[1:])))
+
+
+class StandinServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0):
+        super().__init__((host, port), _Handler)
+        self.store = StandinStore()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"redis://{host}:{port}/0"
+
+    def start(self):
+        """Serve from a daemon thread; returns self"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Redis-protocol stand-in for shared state")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6380)
+    args = parser.parse_args(argv)
+    server = StandinServer(args.host, args.port)
+    print(f"Serving {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import math
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RISK_BANDS = ("allow", "review", "block")
+RISK_LEVEL_ALIASES = {
+    "low": "allow",
+    "allow": "allow",
+    "medium": "review",
+    "review": "review",
+    "high": "block",
+    "block": "block",
+}
+
+DEFAULT_REVIEW_THRESHOLD = 0.3
+DEFAULT_BLOCK_THRESHOLD = 0.7
+
+
+def _setting(name, default):
+    from flask import current_app, has_app_context
+
+    if has_app_context() and name in current_app.config:
+        return float(current_app.config[name])
+    return float(os.getenv(name, default))
+
+
+def get_thresholds():
+    """Return (review_threshold, block_threshold) from app config, falling back to the environment"""
+    review_threshold = _setting("RISK_REVIEW_THRESHOLD", DEFAULT_REVIEW_THRESHOLD)
+    block_threshold = _setting("RISK_BLOCK_THRESHOLD", DEFAULT_BLOCK_THRESHOLD)
+    if not 0.0 <= review_threshold <= block_threshold <= 1.0:
+        raise ValueError("Risk thresholds must satisfy 0 <= review <= block <= 1")
+    return review_threshold, block_threshold
+
+
+def get_high_risk_threshold():
+    """Scores strictly above this value are treated as high risk"""
+    return get_thresholds()[1]
+
+
+def normalize_risk_level(risk_level):
+    """Map a risk_level query value to one of RISK_BANDS, or None if unknown"""
+    if risk_level is None:
+        return None
+    return RISK_LEVEL_ALIASES.get(risk_level.strip().lower())
+
+
+def band_for_score(score):
+    review_threshold, block_threshold = get_thresholds()
+    if score > block_threshold:
+        return "block"
+    if score > review_threshold:
+        return "review"
+    return "allow"
+
+
+def band_score_range(band):
+    """Return the (lower_exclusive, upper_inclusive) score range of a band"""
+    review_threshold, block_threshold = get_thresholds()
+    if band == "allow":
+        return None, review_threshold
+    if band == "review":
+        return review_threshold, block_threshold
+    if band == "block":
+        return block_threshold, None
+    raise ValueError(f"Unknown risk band: {band}")
+
+
+def score_bucket(score):
+    """Summary-table bucket for a score: ceil(score * 100), so band edges at 0.01 steps stay exact"""
+    try:
+        score = float(score)
+    except (TypeError, ValueError):
+        score = 0.0
+    bucket = math.ceil(round(score * 100, 6))
+    return min(max(bucket, 0), 100)
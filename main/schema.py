@@ -0,0 +1,118 @@
+import hashlib
+import os
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import inspect
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def ensure_indexes(db):
+    """Create indexes declared on models that are missing from existing tables.
+
+    db.create_all() only creates indexes together with new tables, so indexes
+    added to an existing model would otherwise never reach deployed databases.
+    """
+    existing_tables = set(inspect(db.engine).get_table_names())
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
+
+def ensure_columns(db):
+    """Add nullable columns declared on models that are missing from existing tables.
+
+    Only additive, nullable columns are handled; anything else needs a real migration.
+    """
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            if not column.nullable:
+                raise RuntimeError(f"Cannot add NOT NULL column {table.name}.{column.name} automatically")
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as conn:
+                conn.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}')
+
+
+def create_schema(db):
+    db.create_all()
+    ensure_columns(db)
+    ensure_indexes(db)
+
+
+def schema_fingerprint(db):
+    """Hash of the database URL and every declared table, column and index"""
+    parts = [str(db.engine.url)]
+    for table in db.metadata.sorted_tables:
+        parts.append(table.name)
+        parts.extend(f"{column.name}:{column.type}" for column in table.columns)
+        parts.extend(sorted(index.name for index in table.indexes))
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def _sqlite_file(db):
+    url = db.engine.url
+    if url.get_backend_name() != "sqlite":
+        return None
+    database = url.database
+    if not database or database == ":memory:" or database.startswith("file::memory:"):
+        return ":memory:"
+    return database
+
+
+def ensure_schema(app):
+    """Create the schema once per deployment rather than once per worker.
+
+    The first worker to start creates missing tables and indexes under a file
+    lock and leaves a marker in the instance folder keyed by the schema
+    fingerprint; later workers see the marker and skip the inspection queries.
+    """
+    from main import db
+
+    with app.app_context():
+        sqlite_file = _sqlite_file(db)
+        if sqlite_file == ":memory:":
+            create_schema(db)
+            return True
+
+        os.makedirs(app.instance_path, exist_ok=True)
+        marker = os.path.join(app.instance_path, f".schema-{schema_fingerprint(db)}")
+        database_missing = sqlite_file is not None and not os.path.exists(sqlite_file)
+        if os.path.exists(marker) and not database_missing:
+            return False
+
+        with open(marker + ".lock", "w") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                database_missing = sqlite_file is not None and not os.path.exists(sqlite_file)
+                if os.path.exists(marker) and not database_missing:
+                    return False
+                create_schema(db)
+                with open(marker, "w") as marker_file:
+                    marker_file.write(str(db.engine.url.render_as_string(hide_password=True)))
+                return True
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@click.command("init-db")
+@with_appcontext
+def init_db_command():
+    """Create missing tables, columns and indexes (use with SCHEMA_AUTO_CREATE=0)."""
+    from main import db
+
+    create_schema(db)
+    click.echo("Database schema is up to date.")
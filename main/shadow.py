@@ -0,0 +1,89 @@
+import os
+import random
+import time
+from dotenv import load_dotenv
+from .background import BackgroundQueue
+from .database_manager import DatabaseManager
+from .providers import get_provider
+
+load_dotenv()
+
+# Candidate in provider[:prompt[:model]] form, e.g. "deepseek:inline" or "openai:file"
+SHADOW_CANDIDATE = os.getenv("SHADOW_CANDIDATE", "")
+SHADOW_SAMPLE_RATE = float(os.getenv("SHADOW_SAMPLE_RATE", "0.0"))
+
+shadow_queue = BackgroundQueue(
+    "shadow-eval",
+    maxsize=int(os.getenv("SHADOW_QUEUE_SIZE", "100")),
+    workers=int(os.getenv("SHADOW_WORKERS", "2"))
+)
+
+
+def maybe_shadow(data, primary_result, primary_latency_ms, candidate=None, sample_rate=None):
+    """Queue a sampled transaction for scoring by the candidate; never blocks the caller"""
+    candidate = SHADOW_CANDIDATE if candidate is None else candidate
+    sample_rate = SHADOW_SAMPLE_RATE if sample_rate is None else sample_rate
+    if not candidate or sample_rate <= 0 or random.random() >= sample_rate:
+        return False
+    if not isinstance(primary_result, dict):
+        return False
+    return shadow_queue.submit(run_shadow, candidate, data, dict(primary_result), primary_latency_ms)
+
+
+def run_shadow(candidate, data, primary_result, primary_latency_ms):
+    candidate_result = None
+    error = None
+    started = time.perf_counter()
+    try:
+        candidate_result = get_provider(candidate)(data)
+    except Exception as e:
+        error = getattr(e, "description", None) or str(e)
+    latency_ms = (time.perf_counter() - started) * 1000
+
+    DatabaseManager.save_shadow_analysis(
+        primary_result.get("analysis_id"), candidate, primary_result, candidate_result,
+        latency_ms, primary_latency_ms, error
+    )
+
+
+def _percentile(values, percentile):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(percentile / 100.0 * (len(values) - 1)))))
+    return round(values[index], 1)
+
+
+def build_shadow_report(rows):
+    """Agreement and latency comparison per candidate"""
+    by_candidate = {}
+    for row in rows:
+        by_candidate.setdefault(row.candidate, []).append(row)
+
+    report = []
+    for candidate, candidate_rows in sorted(by_candidate.items()):
+        scored = [row for row in candidate_rows if row.error is None and row.risk_score is not None]
+        agreements = sum(1 for row in scored if row.recommended_action == row.primary_action)
+        score_diffs = [
+            abs(row.risk_score - row.primary_risk_score)
+            for row in scored if row.primary_risk_score is not None
+        ]
+        latencies = [row.latency_ms for row in scored if row.latency_ms is not None]
+        primary_latencies = [row.primary_latency_ms for row in candidate_rows if row.primary_latency_ms is not None]
+        transitions = {}
+        for row in scored:
+            if row.recommended_action != row.primary_action:
+                key = f"{row.primary_action}->{row.recommended_action}"
+                transitions[key] = transitions.get(key, 0) + 1
+
+        report.append({
+            "candidate": candidate,
+            "samples": len(candidate_rows),
+            "errors": len(candidate_rows) - len(scored),
+            "action_agreement": agreements / len(scored) if scored else None,
+            "disagreements": transitions,
+            "mean_abs_score_diff": sum(score_diffs) / len(score_diffs) if score_diffs else None,
+            "latency_ms": {"p50": _percentile(latencies, 50), "p95": _percentile(latencies, 95)},
+            "primary_latency_ms": {"p50": _percentile(primary_latencies, 50), "p95": _percentile(primary_latencies, 95)}
+        })
+    return report
@@ -0,0 +1,312 @@
+"""Key/value state shared by every process serving the app.
+
+SHARED_STATE_URL selects the backend:
+    memory://                  per process (default, single node)
+    sqlite:///path/state.db    every process on one host
+    redis://host:6379/0        every node; any server speaking the Redis protocol
+
+Values are JSON-serialisable; ttl is in seconds.
+"""
+import json
+import os
+import select
+import socket
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse, unquote
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SHARED_STATE_URL = os.getenv("SHARED_STATE_URL", "memory://")
+
+
+class SharedStateError(Exception):
+    """The shared state backend failed or returned an error"""
+
+
+class MemoryState:
+    """Process-local implementation of the shared state interface"""
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key, now):
+        entry = self._values.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= now:
+            del self._values[key]
+            return None
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live(key, time.time())
+            return entry[0] if entry else None
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._values[key] = (value, time.time() + ttl if ttl else None)
+
+    def add(self, key, value, ttl=None):
+        """Set only if absent; True if this call set it"""
+        with self._lock:
+            now = time.time()
+            if self._live(key, now) is not None:
+                return False
+            self._values[key] = (value, now + ttl if ttl else None)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._values.pop(key, None)
+
+    def incr(self, key, amount=1, ttl=None):
+        """Atomically add to an integer; ttl applies when the key is created"""
+        with self._lock:
+            now = time.time()
+            entry = self._live(key, now)
+            if entry is None:
+                entry = (0, now + ttl if ttl else None)
+            value = int(entry[0]) + amount
+            self._values[key] = (value, entry[1])
+            return value
+
+
+class SQLiteState:
+    """Shared state in a SQLite file, for several processes on one host"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS shared_state "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self, work):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = work(conn, time.time())
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _read(conn, key, now):
+        row = conn.execute("SELECT value, expires_at FROM shared_state WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= now):
+            return None
+        return row
+
+    def get(self, key):
+        row = self._read(self._connect(), key, time.time())
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        self._connect().execute(
+            "INSERT OR REPLACE INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), expires_at)
+        )
+
+    def add(self, key, value, ttl=None):
+        def work(conn, now):
+            if self._read(conn, key, now) is not None:
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), now + ttl if ttl else None)
+            )
+            return True
+        return self._transaction(work)
+
+    def delete(self, key):
+        self._connect().execute("DELETE FROM shared_state WHERE key = ?", (key,))
+
+    def incr(self, key, amount=1, ttl=None):
+        def work(conn, now):
+            row = self._read(conn, key, now)
+            value = (int(json.loads(row[0])) if row else 0) + amount
+            expires_at = row[1] if row else (now + ttl if ttl else None)
+            conn.execute(
+                "INSERT OR REPLACE INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at)
+            )
+            return value
+        return self._transaction(work)
+
+
+class _NotSent(Exception):
+    """A command failed before any of its bytes reached the server, so it is safe to resend"""
+
+
+class RedisState:
+    """Shared state over the Redis protocol (RESP2), one connection per thread, no client library needed"""
+
+    def __init__(self, url, timeout=2.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.strip("/") or 0)
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None and select.select([connection[0]], [], [], 0)[0]:
+            # Readable while idle: the server closed the connection (or sent something unexpected)
+            self._reset()
+            connection = None
+        if connection is None:
+            try:
+                sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            except OSError as e:
+                raise _NotSent(str(e))
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = (sock, sock.makefile("rb"))
+            self._local.connection = connection
+            if self.password:
+                self._command("AUTH", self.password)
+            if self.db:
+                self._command("SELECT", self.db)
+        return connection
+
+    def _reset(self):
+        connection = getattr(self._local, "connection", None)
+        self._local.connection = None
+        if connection is not None:
+            try:
+                connection[1].close()
+                connection[0].close()
+            except OSError:
+                pass
+
+    @staticmethod
+    def _encode(args):
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    def _reply(self, reader):
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by shared state server")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode("utf-8")
+        if kind == b"-":
+            raise SharedStateError(body.decode("utf-8"))
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2].decode("utf-8")
+        if kind == b"*":
+            length = int(body)
+            return None if length < 0 else [self._reply(reader) for _ in range(length)]
+        raise SharedStateError(f"Unexpected reply {line!r}")
+
+    def _command(self, *args):
+        sock, reader = self._local.connection
+        data = self._encode(args)
+        sent = 0
+        try:
+            while sent < len(data):
+                sent += sock.send(data[sent:])
+        except OSError as e:
+            if not sent:
+                raise _NotSent(str(e))
+            raise
+        return self._reply(reader)
+
+    def execute(self, *args):
+        """Run one command, retrying once on a new connection only if none of it was sent.
+
+        A command that may have reached the server is never resent, since
+        INCRBY and similar commands are not idempotent.
+        """
+        for attempt in (0, 1):
+            try:
+                self._connection()
+                return self._command(*args)
+            except _NotSent as e:
+                self._reset()
+                if attempt:
+                    raise SharedStateError(f"Shared state server unavailable: {str(e)}")
+            except (ConnectionError, socket.timeout, OSError) as e:
+                self._reset()
+                raise SharedStateError(f"Shared state command failed: {str(e)}")
+
+    def get(self, key):
+        value = self.execute("GET", key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        args = ["SET", key, json.dumps(value)]
+        if ttl:
+            args += ["PX", int(ttl * 1000)]
+        self.execute(*args)
+
+    def add(self, key, value, ttl=None):
+        args = ["SET", key, json.dumps(value), "NX"]
+        if ttl:
+            args += ["PX", int(ttl * 1000)]
+        return self.execute(*args) == "OK"
+
+    def delete(self, key):
+        self.execute("DEL", key)
+
+    def incr(self, key, amount=1, ttl=None):
+        value = self.execute("INCRBY", key, amount)
+        if ttl and value == amount:
+            # First increment created the key
+            self.execute("PEXPIRE", key, int(ttl * 1000))
+        return value
+
+
+def create_shared_state(url):
+    scheme = urlparse(url).scheme
+    if scheme == "memory":
+        return MemoryState()
+    if scheme == "sqlite":
+        path = url[len("sqlite:///"):] if url.startswith("sqlite:///") else urlparse(url).path
+        return SQLiteState(path)
+    if scheme in ("redis", "resp"):
+        return RedisState(url)
+    raise ValueError(f"Unsupported SHARED_STATE_URL scheme: {scheme!r}")
+
+
+_state = None
+_state_lock = threading.Lock()
+
+
+def get_shared_state():
+    """Process-wide backend for SHARED_STATE_URL"""
+    global _state
+    with _state_lock:
+        if _state is None:
+            _state = create_shared_state(SHARED_STATE_URL)
+        return _state
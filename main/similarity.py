@@ -0,0 +1,256 @@
+import json
+import math
+import os
+import random
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from dotenv import load_dotenv
+from flask import current_app, has_app_context
+from .local_scorer import CATEGORY_RISK, extract_features
+from .risk_config import get_thresholds
+
+load_dotenv()
+
+# off: no lookups; fewshot: add close neighbours to the prompt; reuse: also skip the LLM for near-duplicates
+SIMILARITY_MODE = os.getenv("SIMILARITY_MODE", "off")
+REUSE_SIMILARITY = float(os.getenv("SIMILARITY_REUSE_THRESHOLD", "0.98"))
+FEWSHOT_SIMILARITY = float(os.getenv("SIMILARITY_FEWSHOT_THRESHOLD", "0.9"))
+# Only verdicts at least this far from both band thresholds are reused
+CONFIDENCE_MARGIN = float(os.getenv("SIMILARITY_CONFIDENCE_MARGIN", "0.15"))
+FEWSHOT_K = int(os.getenv("SIMILARITY_FEWSHOT_K", "3"))
+INDEX_SIZE = int(os.getenv("SIMILARITY_INDEX_SIZE", "50000"))
+LSH_TABLES = int(os.getenv("SIMILARITY_LSH_TABLES", "8"))
+LSH_BITS = int(os.getenv("SIMILARITY_LSH_BITS", "10"))
+
+CATEGORIES = tuple(sorted(CATEGORY_RISK))
+PAYMENT_TYPES = ("credit_card", "debit_card", "bank_transfer", "digital_wallet")
+AMOUNT_BANDS = 8
+COUNTRY_BUCKETS = 16
+
+
+def _country_slot(country):
+    return zlib.crc32(country.encode("utf-8")) % COUNTRY_BUCKETS if country else None
+
+
+def feature_vector(transaction, features=None):
+    """Unit-length vector over the local features; near-identical transactions map to near-identical vectors"""
+    if features is None:
+        features = extract_features(transaction)
+    payment_type = str((transaction.get("payment_method") or {}).get("type", "")).lower()
+
+    category = [1.0 if features["category"] == name else 0.0 for name in CATEGORIES]
+    category.append(0.0 if features["category"] in CATEGORIES else 1.0)
+    payment = [1.0 if payment_type == name else 0.0 for name in PAYMENT_TYPES]
+    payment.append(0.0 if payment_type in PAYMENT_TYPES else 1.0)
+    # Half-decade amount bands, plus the continuous log amount to separate neighbours within a band
+    band = min(AMOUNT_BANDS - 1, int(features["log_amount"] * 2))
+    amount = [1.0 if band == index else 0.0 for index in range(AMOUNT_BANDS)]
+    amount.append(features["log_amount"] / 4.0)
+    countries = [0.0] * (2 * COUNTRY_BUCKETS)
+    for offset, country in ((0, features["customer_country"]), (COUNTRY_BUCKETS, features["payment_country"])):
+        slot = _country_slot(country)
+        if slot is not None:
+            countries[offset + slot] = 1.0
+    flags = [float(features["cross_border"]), float(features["high_risk_country"]), float(features["off_hours"])]
+
+    vector = category + payment + amount + countries + flags
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return tuple(value / norm for value in vector)
+
+
+def cosine(a, b):
+    return sum(x * y for x, y in zip(a, b))
+
+
+class SimilarityIndex:
+    """Random-hyperplane LSH over feature vectors with incremental inserts and FIFO eviction.
+
+    Each table hashes a vector to the signs of its projections on LSH_BITS
+    random hyperplanes; candidates from all tables are re-ranked by exact
+    cosine similarity.
+    """
+
+    def __init__(self, dimensions, tables=LSH_TABLES, bits=LSH_BITS, capacity=INDEX_SIZE, seed=7):
+        rng = random.Random(seed)
+        self.capacity = capacity
+        self._planes = [
+            [[rng.gauss(0.0, 1.0) for _ in range(dimensions)] for _ in range(bits)]
+            for _ in range(tables)
+        ]
+        self._buckets = [{} for _ in range(tables)]
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def _signatures(self, vector):
+        signatures = []
+        for planes in self._planes:
+            signature = 0
+            for plane in planes:
+                signature = (signature << 1) | (cosine(plane, vector) >= 0.0)
+            signatures.append(signature)
+        return signatures
+
+    def add(self, key, vector, verdict):
+        signatures = self._signatures(vector)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (vector, verdict, signatures)
+            for buckets, signature in zip(self._buckets, signatures):
+                buckets.setdefault(signature, []).append(key)
+            while len(self._entries) > self.capacity:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        _, _, signatures = self._entries.pop(key)
+        for buckets, signature in zip(self._buckets, signatures):
+            bucket = buckets.get(signature)
+            if bucket is not None:
+                bucket.remove(key)
+                if not bucket:
+                    del buckets[signature]
+
+    def query(self, vector, k=FEWSHOT_K, min_similarity=0.0):
+        """Up to k (similarity, verdict) pairs, most similar first"""
+        signatures = self._signatures(vector)
+        with self._lock:
+            candidates = set()
+            for buckets, signature in zip(self._buckets, signatures):
+                candidates.update(buckets.get(signature, ()))
+            scored = [(cosine(vector, self._entries[key][0]), self._entries[key][1]) for key in candidates]
+        scored = [pair for pair in scored if pair[0] >= min_similarity]
+        scored.sort(key=lambda pair: -pair[0])
+        return scored[:k]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_index = None
+_index_lock = threading.Lock()
+_loader = None
+_next_load_at = 0.0
+# Seconds before a failed warm-up is retried
+LOAD_RETRY_SECONDS = 30.0
+
+
+def _load_index(app, index):
+    global _next_load_at
+    from .database_manager import DatabaseManager
+    try:
+        with app.app_context():
+            for analysis_id, transaction_data, result in DatabaseManager.get_recent_verdicts(INDEX_SIZE):
+                remember(analysis_id, transaction_data, result, index=index)
+        index.loaded = True
+    except Exception as e:
+        _next_load_at = time.monotonic() + LOAD_RETRY_SECONDS
+        print(f"Similarity index warm-up failed: {str(e)}")
+
+
+def get_similarity_index():
+    """Process-wide index; the first call inside an app context starts filling it from stored analyses.
+
+    The fill runs on a background thread (INDEX_SIZE inserts take seconds), so
+    callers never wait for it; see ready_index.
+    """
+    global _index, _loader
+    with _index_lock:
+        if _index is None:
+            _index = SimilarityIndex(len(feature_vector({})))
+        if (not _index.loaded and (_loader is None or not _loader.is_alive())
+                and time.monotonic() >= _next_load_at and has_app_context()):
+            _loader = threading.Thread(target=_load_index, args=(current_app._get_current_object(), _index),
+                                       name="similarity-warmup", daemon=True)
+            _loader.start()
+    return _index
+
+
+def ready_index():
+    """The process-wide index once filled, else None: lookups are served as misses until then"""
+    index = get_similarity_index()
+    return index if index.loaded else None
+
+
+def compact_verdict(analysis_id, result):
+    return {
+        "analysis_id": analysis_id,
+        "risk_score": result.get("risk_score"),
+        "recommended_action": result.get("recommended_action"),
+        "risk_factors": list(result.get("risk_factors") or [])[:3],
+        "reasoning": result.get("reasoning"),
+    }
+
+
+def remember(analysis_id, transaction, result, index=None):
+    """Add an LLM verdict to the index; reused, local and provisional verdicts are not indexed"""
+    if isinstance(transaction, str):
+        try:
+            transaction = json.loads(transaction)
+        except ValueError:
+            return
+    if not isinstance(transaction, dict) or not isinstance(result, dict):
+        return
+    if result.get("reused_from") is not None or result.get("scorer") == "local" or result.get("provisional"):
+        return
+    if index is None:
+        if SIMILARITY_MODE not in ("fewshot", "reuse"):
+            return
+        index = get_similarity_index()
+    index.add(analysis_id, feature_vector(transaction), compact_verdict(analysis_id, result))
+
+
+def is_confident(verdict):
+    """True when the score sits well inside its band"""
+    try:
+        score = float(verdict["risk_score"])
+    except (KeyError, TypeError, ValueError):
+        return False
+    return all(abs(score - threshold) >= CONFIDENCE_MARGIN for threshold in get_thresholds())
+
+
+def _reused(verdict):
+    return {
+        "risk_score": verdict["risk_score"],
+        "risk_factors": verdict["risk_factors"],
+        "reasoning": verdict["reasoning"],
+        "recommended_action": verdict["recommended_action"],
+        "reused_from": verdict["analysis_id"],
+        "scorer": "similar"
+    }
+
+
+def nearest_verdict(transaction):
+    """Closest stored verdict above the few-shot similarity, regardless of confidence; None when disabled"""
+    if SIMILARITY_MODE not in ("fewshot", "reuse") or not isinstance(transaction, dict):
+        return None
+    index = ready_index()
+    if index is None:
+        return None
+    neighbours = index.query(feature_vector(transaction), k=1, min_similarity=FEWSHOT_SIMILARITY)
+    return _reused(neighbours[0][1]) if neighbours else None
+
+
+def find_similar(transaction, mode=None, index=None):
+    """(reusable verdict or None, few-shot cases) for a transaction about to be scored"""
+    mode = SIMILARITY_MODE if mode is None else mode
+    if mode not in ("fewshot", "reuse") or not isinstance(transaction, dict):
+        return None, []
+    index = ready_index() if index is None else index
+    if index is None:
+        return None, []
+    neighbours = index.query(feature_vector(transaction), k=FEWSHOT_K, min_similarity=FEWSHOT_SIMILARITY)
+
+    if mode == "reuse" and neighbours:
+        close = [verdict for similarity, verdict in neighbours if similarity >= REUSE_SIMILARITY]
+        if close and is_confident(close[0]) and len({verdict["recommended_action"] for verdict in close}) == 1:
+            return _reused(close[0]), []
+
+    cases = [
+        {"similarity": round(similarity, 3), "risk_score": verdict["risk_score"],
+         "recommended_action": verdict["recommended_action"], "risk_factors": verdict["risk_factors"]}
+        for similarity, verdict in neighbours
+    ]
+    return None, cases
@@ -0,0 +1,233 @@
+"""Per-statement SQL timing, fingerprints, repeated-statement (N+1) and slow-query detection.
+
+Every statement executed through SQLAlchemy is timed and aggregated by
+fingerprint: the statement with literals and IN-lists normalised, so queries
+differing only in parameters share one entry (GET /admin/sql). Within one
+request, a fingerprint executed SQL_REPEAT_THRESHOLD times is flagged as a
+likely N+1 pattern; a statement slower than SQL_SLOW_MS has its query plan
+logged once per fingerprint. Rows returned by ORM SELECTs are only counted
+with SQL_COUNT_ROWS=1, since counting buffers every result.
+"""
+import contextvars
+import hashlib
+import os
+import re
+import threading
+import time
+from functools import lru_cache
+from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from . import profiling
+
+load_dotenv()
+
+SQL_INSTRUMENTATION = os.getenv("SQL_INSTRUMENTATION", "1") == "1"
+SQL_SLOW_MS = float(os.getenv("SQL_SLOW_MS", "100"))
+SQL_REPEAT_THRESHOLD = int(os.getenv("SQL_REPEAT_THRESHOLD", "10"))
+SQL_EXPLAIN = os.getenv("SQL_EXPLAIN", "1") == "1"
+# Buffer ORM SELECT results within profiled requests to count their rows (off: rows stay None)
+SQL_COUNT_ROWS = os.getenv("SQL_COUNT_ROWS", "0") == "1"
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+_scope = contextvars.ContextVar("sql_scope", default=None)
+_local = threading.local()
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(statement):
+    """(digest, normalised statement) with literals replaced and IN-lists collapsed"""
+    normalized = _WHITESPACE.sub(" ", statement).strip()
+    normalized = _STRING_LITERAL.sub("?", normalized)
+    normalized = _NUMBER_LITERAL.sub("?", normalized)
+    normalized = re.sub(r"%\(\w+\)s|:\w+|\$\d+|%s", "?", normalized)
+    normalized = _PLACEHOLDER_LIST.sub("(?)", normalized)
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:12], normalized
+
+
+class StatementRecord:
+    """One executed statement; rows is filled in once the ORM has fetched the result"""
+    __slots__ = ("fingerprint", "statement", "seconds", "rows")
+
+    def __init__(self, digest, statement, seconds, rows):
+        self.fingerprint = digest
+        self.statement = statement
+        self.seconds = seconds
+        self.rows = rows
+
+
+class StatementStats:
+    """Process-wide totals per statement fingerprint"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def _entry(self, digest, normalized):
+        entry = self._entries.get(digest)
+        if entry is None:
+            entry = self._entries[digest] = {
+                "fingerprint": digest, "statement": normalized, "count": 0, "total_ms": 0.0,
+                "max_ms": 0.0, "rows": 0, "repeated_requests": 0, "slow": 0, "plan": None
+            }
+        return entry
+
+    def record(self, digest, normalized, seconds, rows):
+        ms = seconds * 1000
+        with self._lock:
+            entry = self._entry(digest, normalized)
+            entry["count"] += 1
+            entry["total_ms"] += ms
+            entry["max_ms"] = max(entry["max_ms"], ms)
+            entry["rows"] += rows or 0
+            slow = ms >= SQL_SLOW_MS
+            if slow:
+                entry["slow"] += 1
+            return slow and entry["plan"] is None
+
+    def add_rows(self, digest, rows):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                entry["rows"] += rows
+
+    def flag_repeated(self, digest):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                entry["repeated_requests"] += 1
+
+    def set_plan(self, digest, plan):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                entry["plan"] = plan
+
+    def report(self, order_by="total_ms", limit=20):
+        if order_by not in ("total_ms", "count", "max_ms", "rows", "repeated_requests"):
+            raise ValueError(f"Unknown order_by: {order_by}")
+        with self._lock:
+            entries = [dict(entry) for entry in self._entries.values()]
+        for entry in entries:
+            entry["mean_ms"] = round(entry["total_ms"] / entry["count"], 3) if entry["count"] else None
+            entry["total_ms"] = round(entry["total_ms"], 3)
+            entry["max_ms"] = round(entry["max_ms"], 3)
+        entries.sort(key=lambda entry: entry[order_by], reverse=True)
+        return entries[:limit] if limit else entries
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+
+
+sql_stats = StatementStats()
+
+
+def begin_scope():
+    """Start counting statements for one request; returns a token for end_scope"""
+    if not SQL_INSTRUMENTATION:
+        return None
+    return _scope.set({})
+
+
+def end_scope(token):
+    """Stop counting; returns {normalised statement: executions} for statements repeated in the scope"""
+    if token is None:
+        return {}
+    counts = _scope.get()
+    try:
+        _scope.reset(token)
+    except ValueError:
+        return {}
+    return {
+        fingerprint_and_text[1]: count
+        for fingerprint_and_text, count in (counts or {}).items()
+        if count >= SQL_REPEAT_THRESHOLD
+    }
+
+
+def _explain(conn, cursor, statement, parameters):
+    if conn.dialect.name == "sqlite":
+        explain = cursor.connection.execute("EXPLAIN QUERY PLAN " + statement, parameters or ())
+        return [row[-1] for row in explain.fetchall()]
+    explain = cursor.connection.cursor()
+    try:
+        explain.execute("EXPLAIN " + statement, parameters)
+        return [str(row[0]) for row in explain.fetchall()]
+    finally:
+        explain.close()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if SQL_INSTRUMENTATION:
+        conn.info.setdefault("sql_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("sql_started")
+    if not started:
+        return
+    seconds = time.perf_counter() - started.pop()
+    digest, normalized = fingerprint(statement)
+    rows = cursor.rowcount if cursor.rowcount is not None and cursor.rowcount >= 0 else None
+    record = StatementRecord(digest, statement, seconds, rows)
+    _local.last = record
+
+    needs_plan = sql_stats.record(digest, normalized, seconds, rows)
+    profile = profiling.current_profile()
+    if profile is not None:
+        profile.add_statement(record)
+
+    counts = _scope.get()
+    if counts is not None:
+        key = (digest, normalized)
+        counts[key] = counts.get(key, 0) + 1
+        if counts[key] == SQL_REPEAT_THRESHOLD:
+            sql_stats.flag_repeated(digest)
+            print(f"Repeated SQL ({SQL_REPEAT_THRESHOLD}x in one request, possible N+1): {normalized}")
+
+    if needs_plan and SQL_EXPLAIN and not executemany and normalized.upper().startswith(("SELECT", "WITH")):
+        try:
+            plan = _explain(conn, cursor, statement, parameters)
+        except Exception as e:
+            plan = [f"EXPLAIN failed: {str(e)}"]
+        sql_stats.set_plan(digest, plan)
+        print(f"Slow SQL ({seconds * 1000:.1f} ms): {normalized}\n  plan: {' | '.join(plan)}")
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context):
+    # after_cursor_execute does not run for a failed statement
+    started = context.connection.info.get("sql_started") if context.connection is not None else None
+    if started and context.statement is not None:
+        started.pop()
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _count_rows(orm_execute_state):
+    """Buffer ORM SELECT results so the rows returned can be attributed to the statement.
+
+    Only with SQL_COUNT_ROWS and inside a profiled request: freezing copies
+    every result into a buffer, which defeats streaming and column-only reads.
+    """
+    if not SQL_INSTRUMENTATION or not SQL_COUNT_ROWS or not orm_execute_state.is_select:
+        return None
+    if profiling.current_profile() is None:
+        return None
+    options = orm_execute_state.execution_options
+    if options.get("yield_per") or options.get("stream_results"):
+        return None
+    _local.last = None
+    frozen = orm_execute_state.invoke_statement().freeze()
+    record = getattr(_local, "last", None)
+    if record is not None and record.rows is None:
+        record.rows = len(frozen.data)
+        sql_stats.add_rows(record.fingerprint, record.rows)
+    return frozen()
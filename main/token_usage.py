@@ -0,0 +1,103 @@
+import contextvars
+import hashlib
+import json
+import os
+from collections import Counter
+from contextlib import contextmanager
+from flask import has_request_context, request
+from dotenv import load_dotenv
+from .database_manager import DatabaseManager
+
+load_dotenv()
+
+# USD per million (prompt, completion) tokens; override with LLM_PRICES='{"model": [in, out]}'
+DEFAULT_PRICES = {
+    "deepseek/deepseek-chat:free": (0.0, 0.0),
+    "gpt-4o": (2.5, 10.0),
+}
+
+
+def _load_prices():
+    prices = dict(DEFAULT_PRICES)
+    override = os.getenv("LLM_PRICES")
+    if override:
+        try:
+            prices.update({model: tuple(price) for model, price in json.loads(override).items()})
+        except (ValueError, TypeError) as e:
+            print(f"Ignoring invalid LLM_PRICES: {str(e)}")
+    return prices
+
+
+MODEL_PRICES = _load_prices()
+
+# Callers that completions in the current context are made for, when that is not the
+# current request (combined batches are sent from the batcher's dispatcher thread)
+_attributed_keys = contextvars.ContextVar("usage_api_key_ids", default=None)
+
+
+def api_key_id(api_key=None):
+    """Stable, non-reversible identifier for the calling API key"""
+    if api_key is None and has_request_context():
+        api_key = request.headers.get("X-API-KEY")
+    if not api_key:
+        return "internal"
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+@contextmanager
+def attribute_usage(api_key_ids):
+    """Attribute usage recorded inside the block to these api_key_id values, one entry per transaction"""
+    token = _attributed_keys.set(list(api_key_ids))
+    try:
+        yield
+    finally:
+        _attributed_keys.reset(token)
+
+
+def record_usage(provider, model, usage, purpose="score"):
+    """Persist the token usage block of a completion; never fails the calling request.
+
+    A completion made for several callers (see attribute_usage) is split between
+    them in proportion to their transactions, one row per api key.
+    """
+    if not usage:
+        return None
+    try:
+        if not isinstance(usage, dict):
+            usage = {
+                "prompt_tokens": getattr(usage, "prompt_tokens", 0),
+                "completion_tokens": getattr(usage, "completion_tokens", 0),
+            }
+        prompt_tokens = int(usage.get("prompt_tokens") or 0)
+        completion_tokens = int(usage.get("completion_tokens") or 0)
+        key_ids = _attributed_keys.get() or [api_key_id()]
+        shares = Counter(key_ids)
+
+        usage_id = None
+        prompt_left, completion_left = prompt_tokens, completion_tokens
+        for position, (key_id, share) in enumerate(shares.items()):
+            if position == len(shares) - 1:
+                prompt_part, completion_part = prompt_left, completion_left
+            else:
+                prompt_part = prompt_tokens * share // len(key_ids)
+                completion_part = completion_tokens * share // len(key_ids)
+            prompt_left -= prompt_part
+            completion_left -= completion_part
+            usage_id = DatabaseManager.save_llm_usage(
+                api_key_id=key_id,
+                provider=provider,
+                model=model,
+                purpose=purpose,
+                prompt_tokens=prompt_part,
+                completion_tokens=completion_part,
+                cost=estimate_cost(model, prompt_part, completion_part),
+            )
+        return usage_id
+    except Exception as e:
+        print(f"Failed to record token usage: {str(e)}")
+        return None
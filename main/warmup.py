@@ -0,0 +1,189 @@
+"""Startup warm-up and background health probes for LLM providers.
+
+create_app calls start_warmup (unless TESTING is set), which loads prompts and reference data and,
+from a daemon thread, opens pooled keep-alive connections to the configured
+providers and starts filling the similarity index. The thread then probes
+each provider every WARMUP_PROBE_INTERVAL
+seconds: this keeps the connections from idling out and marks failing
+providers unhealthy before a request has to find out.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from dotenv import load_dotenv
+
+load_dotenv()
+
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "1") == "1"
+# Providers to pre-connect and probe: "deepseek" (openrouter) and/or "openai"
+WARMUP_PROVIDERS = [name.strip() for name in os.getenv("WARMUP_PROVIDERS", "deepseek").split(",") if name.strip()]
+# Connections opened per provider, so a burst after deploy does not pay for handshakes
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", "2"))
+# Below typical load balancer and server keep-alive timeouts; 0 disables the periodic probe
+WARMUP_PROBE_INTERVAL = float(os.getenv("WARMUP_PROBE_INTERVAL", "45"))
+WARMUP_PROBE_TIMEOUT = float(os.getenv("WARMUP_PROBE_TIMEOUT", "5"))
+OPENROUTER_PROBE_URL = os.getenv("OPENROUTER_PROBE_URL", "https://openrouter.ai/api/v1/auth/key")
+# Consecutive failed probes before a provider is reported unhealthy
+UNHEALTHY_AFTER = int(os.getenv("PROVIDER_UNHEALTHY_AFTER", "2"))
+
+
+class ProviderHealth:
+    """Probe results per provider"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states = {}
+
+    def record(self, provider, ok, latency_ms=None, error=None):
+        with self._lock:
+            state = self._states.setdefault(provider, {"consecutive_failures": 0, "probes": 0})
+            state["probes"] += 1
+            state["last_probe_at"] = datetime.utcnow().isoformat()
+            state["latency_ms"] = round(latency_ms, 1) if latency_ms is not None else None
+            state["error"] = error
+            state["consecutive_failures"] = 0 if ok else state["consecutive_failures"] + 1
+            state["healthy"] = state["consecutive_failures"] < UNHEALTHY_AFTER
+
+    def is_healthy(self, provider):
+        """False only once probes have failed; unprobed providers are assumed healthy"""
+        with self._lock:
+            state = self._states.get(provider)
+            return state is None or state["healthy"]
+
+    def snapshot(self):
+        with self._lock:
+            return {provider: dict(state) for provider, state in self._states.items()}
+
+    def reset(self):
+        with self._lock:
+            self._states.clear()
+
+
+provider_health = ProviderHealth()
+
+
+def _probe_openrouter():
+    from . import llm_int_deepseek
+    if not llm_int_deepseek.API_KEY:
+        return "DEEPSEEK_API_KEY2 is not set"
+    response = llm_int_deepseek.http.get(OPENROUTER_PROBE_URL, headers=llm_int_deepseek.headers,
+                                         timeout=WARMUP_PROBE_TIMEOUT)
+    response.close()
+    if response.status_code in (401, 403):
+        return f"Authentication rejected ({response.status_code})"
+    if response.status_code >= 500:
+        return f"Provider error ({response.status_code})"
+    return None
+
+
+def _probe_openai():
+    from .llm_integrator import api_key, get_client
+    if not api_key:
+        return "OPENAI_API_KEY is not set"
+    get_client().with_options(timeout=WARMUP_PROBE_TIMEOUT).models.list()
+    return None
+
+
+PROBES = {"deepseek": _probe_openrouter, "openai": _probe_openai}
+
+
+def probed_providers(providers=None):
+    """Configured providers that talk to a real endpoint; mock and replay backends need no warming"""
+    from .llm_int_deepseek import LLM_BACKEND
+    return [
+        provider for provider in (WARMUP_PROVIDERS if providers is None else providers)
+        if provider in PROBES and (provider != "deepseek" or LLM_BACKEND == "openrouter")
+    ]
+
+
+def probe(provider):
+    """Probe one provider and record the outcome; returns True if it is usable"""
+    started = time.perf_counter()
+    try:
+        error = PROBES[provider]()
+    except Exception as e:
+        error = str(e)
+    provider_health.record(provider, error is None, (time.perf_counter() - started) * 1000, error)
+    return error is None
+
+
+def preconnect(providers=None, connections=None):
+    """Open keep-alive connections by probing each provider concurrently"""
+    providers = probed_providers(providers)
+    connections = max(1, WARMUP_CONNECTIONS if connections is None else connections)
+    if not providers:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(providers) * connections, thread_name_prefix="warmup") as pool:
+        outcomes = [(provider, pool.submit(probe, provider)) for provider in providers for _ in range(connections)]
+    results = {}
+    for provider, outcome in outcomes:
+        results[provider] = results.get(provider, False) or outcome.result()
+    return results
+
+
+def preload(app):
+    """Read prompts and reference data into memory before the first request needs them"""
+    from .llm_int_deepseek import load_prompt_template
+    from .risk_config import get_thresholds
+
+    load_prompt_template()
+    with app.app_context():
+        get_thresholds()
+
+
+def preload_similarity(app):
+    """Start filling the similarity index; runs on the warm-up thread, off create_app"""
+    from .similarity import SIMILARITY_MODE, get_similarity_index
+
+    if SIMILARITY_MODE != "off":
+        with app.app_context():
+            get_similarity_index()
+
+
+def _probe_loop(interval, stop):
+    while not stop.wait(interval):
+        for provider in probed_providers():
+            probe(provider)
+
+
+_started = threading.Event()
+_stop = threading.Event()
+
+
+def start_warmup(app, interval=None):
+    """Preload prompts synchronously, then warm the similarity index, pre-connect and keep probing
+    from a daemon thread (once per process)"""
+    if _started.is_set():
+        return False
+    _started.set()
+    try:
+        preload(app)
+    except Exception as e:
+        print(f"Warm-up preload failed: {str(e)}")
+
+    interval = WARMUP_PROBE_INTERVAL if interval is None else interval
+
+    def run():
+        try:
+            preload_similarity(app)
+        except Exception as e:
+            print(f"Similarity warm-up failed: {str(e)}")
+        preconnect()
+        if interval > 0:
+            _probe_loop(interval, _stop)
+
+    threading.Thread(target=run, name="provider-warmup", daemon=True).start()
+    return True
+
+
+def health_report():
+    from .llm_int_deepseek import LLM_BACKEND
+    providers = provider_health.snapshot()
+    return {
+        "status": "ok" if all(state["healthy"] for state in providers.values()) else "degraded",
+        "llm_backend": LLM_BACKEND,
+        "warmed_up": _started.is_set(),
+        "providers": providers
+    }
@@ -0,0 +1,141 @@
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
+from .validator import validate_transaction
+from .local_scorer import extract_features, local_score
+
+load_dotenv()
+
+POOL_SIZE = int(os.getenv("WORKER_POOL_SIZE", str(os.cpu_count() or 1)))
+BATCH_SIZE = int(os.getenv("WORKER_POOL_BATCH_SIZE", "500"))
+MAX_QUEUED_BATCHES = int(os.getenv("WORKER_POOL_MAX_QUEUE", "256"))
+
+
+class PoolSaturated(Exception):
+    """Too many batches are already queued for the worker pool"""
+
+
+def score_records(records):
+    """Validate, extract features and locally score a list of transactions"""
+    results = []
+    for record in records:
+        try:
+            validate_transaction(record)
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            results.append({
+                "transaction_id": record.get("transaction_id") if isinstance(record, dict) else None,
+                "error": str(e)
+            })
+            continue
+        result = local_score(record, extract_features(record))
+        result["transaction_id"] = record["transaction_id"]
+        results.append(result)
+    return results
+
+
+class ScoringPool:
+    """Process pool for CPU-bound validation, feature extraction and local scoring.
+
+    Batches go to the workers as plain submit() arguments: the executor pickles
+    them on its own queue feeder thread, so request threads only split the
+    batch, wait and collect results.
+    """
+
+    def __init__(self, max_workers=POOL_SIZE, batch_size=BATCH_SIZE, max_queued_batches=MAX_QUEUED_BATCHES):
+        self.max_workers = max(1, max_workers)
+        self.batch_size = max(1, batch_size)
+        self.max_queued_batches = max_queued_batches
+        self._executor = None
+        self._lock = threading.Lock()
+        self._metrics = {
+            "submitted_batches": 0,
+            "completed_batches": 0,
+            "failed_batches": 0,
+            "records_scored": 0,
+            "in_flight_batches": 0,
+            "task_seconds_total": 0.0,
+        }
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: forking a threaded web server can copy held locks into the children
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def _submit(self, records):
+        started = time.perf_counter()
+        future = self._get_executor().submit(score_records, records)
+
+        def release(done):
+            with self._lock:
+                self._metrics["in_flight_batches"] -= 1
+                self._metrics["task_seconds_total"] += time.perf_counter() - started
+                if done.exception() is None:
+                    self._metrics["completed_batches"] += 1
+                    self._metrics["records_scored"] += len(records)
+                else:
+                    self._metrics["failed_batches"] += 1
+
+        future.add_done_callback(release)
+        return future
+
+    def score_batch(self, records, timeout=None):
+        """Score records across the pool, preserving input order"""
+        chunks = [records[i:i + self.batch_size] for i in range(0, len(records), self.batch_size)]
+        with self._lock:
+            if self._metrics["in_flight_batches"] + len(chunks) > self.max_queued_batches:
+                raise PoolSaturated("Scoring worker pool queue is full")
+            self._metrics["in_flight_batches"] += len(chunks)
+            self._metrics["submitted_batches"] += len(chunks)
+
+        futures = []
+        try:
+            for chunk in chunks:
+                futures.append(self._submit(chunk))
+        except Exception:
+            with self._lock:
+                self._metrics["in_flight_batches"] -= len(chunks) - len(futures)
+            raise
+
+        results = []
+        for future in futures:
+            results.extend(future.result(timeout=timeout))
+        return results
+
+    def metrics(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+        completed = metrics["completed_batches"] + metrics["failed_batches"]
+        metrics["avg_batch_seconds"] = metrics["task_seconds_total"] / completed if completed else 0.0
+        metrics["pool_size"] = self.max_workers
+        metrics["batch_size"] = self.batch_size
+        metrics["max_queued_batches"] = self.max_queued_batches
+        metrics["started"] = self._executor is not None
+        return metrics
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+_scoring_pool = None
+_scoring_pool_lock = threading.Lock()
+
+
+def get_scoring_pool():
+    global _scoring_pool
+    with _scoring_pool_lock:
+        if _scoring_pool is None:
+            _scoring_pool = ScoringPool()
+            atexit.register(_scoring_pool.shutdown)
+        return _scoring_pool
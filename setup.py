@@ -16,4 +16,8 @@ setup(
         'pytest-mock',
         'sqlalchemy'
     ],
+    extras_require={
+        "rescore": ["numpy"],
+        "compression": ["brotli"],
+    },
 )
\ No newline at end of file
@@ -0,0 +1,102 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+import json
+import threading
+import time
+from flask import Flask
+from main import llm_int_deepseek
+from main.batching import MicroBatcher
+from main.prompt_payload import render_batch_prompt
+
+
+def completion(content):
+    return {"choices": [{"message": {"content": content}}]}
+
+def test_window_adapts_to_arrival_rate():
+    batcher = MicroBatcher("test-window", lambda items: items, max_batch=8, max_wait_ms=20)
+    assert batcher.window() == 0.0
+    batcher._interarrival = 0.5
+    assert batcher.window() == 0.0
+    batcher._interarrival = 0.001
+    assert batcher.window() == 0.007
+    batcher._interarrival = 0.01
+    assert batcher.window() == 0.02
+    batcher._dispatch_seconds = 0.1
+    assert batcher.window() == 0.0
+
+def test_batch_size_adapts_to_latency_and_load():
+    batcher = MicroBatcher("test-size", lambda items: items, max_batch=32, max_wait_ms=20, concurrency=4)
+    assert batcher.batch_size() == 32
+    # Sparse arrivals: nothing else comes within the window, so batches stay single
+    batcher._interarrival = 0.5
+    assert batcher.batch_size() == 1
+    # A 2 ms stream fills the 20 ms budget with 11 items
+    batcher._interarrival = 0.002
+    assert batcher.batch_size() == 11
+    # Slow calls: 4 concurrent 1 s calls only keep up with 500 items/s in batches of 125, capped at 32
+    batcher._dispatch_seconds = 1.0
+    assert batcher.batch_size() == 32
+    # Fast calls keep up with single items, and the budget shrinks to 5% of their latency
+    batcher._dispatch_seconds = 0.005
+    assert batcher.batch_size() == 1
+    assert batcher.metrics()["batch_size"] == 1
+
+def test_concurrent_submits_are_grouped_and_routed_back():
+    def dispatch(items):
+        time.sleep(0.01)
+        return [ValueError("odd") if item % 2 else item * 10 for item in items]
+
+    batcher = MicroBatcher("test-group", dispatch, max_batch=8, max_wait_ms=50)
+    batcher._interarrival = 0.001
+    futures = {}
+    barrier = threading.Barrier(16)
+
+    def submit(value):
+        barrier.wait()
+        futures[value] = batcher.submit(value)
+
+    threads = [threading.Thread(target=submit, args=(value,)) for value in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for value, future in futures.items():
+        if value % 2:
+            assert isinstance(future.exception(timeout=2), ValueError)
+        else:
+            assert future.result(timeout=2) == value * 10
+    metrics = batcher.metrics()
+    assert metrics["items"] == 16
+    assert metrics["batches"] < 16
+
+def test_batch_prompt_numbers_transactions():
+    prompt = render_batch_prompt("Data:\n{transaction_data}", [{"amount": 1}, {"amount": 2}])
+    assert '0: {"amount":1}\n1: {"amount":2}' in prompt
+    assert "## Batch of 2 transactions" in prompt
+
+def test_combined_scoring_falls_back_to_single_calls(mocker):
+    post = mocker.patch("main.llm_int_deepseek._post_completion", side_effect=[
+        json.dumps({"results": [{"risk_score": 0.1}, {"risk_score": 0.9}]}),
+    ])
+    items = [(Flask(__name__), "{transaction_data}", {"amount": amount}, "m", "internal") for amount in (1, 2)]
+
+    results = llm_int_deepseek._dispatch_combined(items)
+    assert [result["risk_score"] for result in results] == [0.1, 0.9]
+    assert post.call_args_list[0].kwargs["purpose"] == "score_batch"
+
+    # A batch answer with the wrong number of results is re-scored one by one, concurrently
+    def answer(payload, purpose="score"):
+        if purpose == "score_batch":
+            return json.dumps({"results": [{"risk_score": 0.2}]})
+        time.sleep(0.2)
+        amount = json.loads(payload["messages"][0]["content"])["amount"]
+        return json.dumps({"risk_score": amount / 10})
+
+    post.side_effect = answer
+    started = time.perf_counter()
+    results = llm_int_deepseek._dispatch_combined(items)
+    assert [result["risk_score"] for result in results] == [0.1, 0.2]
+    assert time.perf_counter() - started < 0.35
+    assert post.call_count == 4
@@ -0,0 +1,32 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+import pytest
+from flask import Flask
+from main.controller import main_bp
+
+@pytest.fixture
+def app(request, tmp_path):
+    """App on an in-memory database; parametrise indirectly with a URI ({tmp_path} is filled in) to change it"""
+    uri = getattr(request, "param", "sqlite:///:memory:")
+    app = Flask(__name__)
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri.format(tmp_path=tmp_path)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+    from main import db
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+
+    app.register_blueprint(main_bp)
+    return app
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def api_key():
+    return os.getenv('SECRET_API_KEY', 'test-api-key')
@@ -10,32 +10,13 @@ import os
 from dotenv import load_dotenv
 from main.validator import validate_transaction, json_schema_validator, transaction_id_validator
 import time
+import json
 
 load_dotenv()
 
-@pytest.fixture
-def app():
-    app = Flask(__name__)
-    app.config['TESTING'] = True
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'  
-    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-    
-    from main import db
-    db.init_app(app)
-    
-    with app.app_context():
-        db.create_all()
-        
-    app.register_blueprint(main_bp)
-    return app
-
-@pytest.fixture
-def client(app):
-    return app.test_client()
-
-@pytest.fixture
-def api_key():
-    return os.getenv('SECRET_API_KEY', 'test-api-key')
+# For tests where background threads write concurrently: the in-memory
+# database shares a single connection across threads
+FILE_DATABASE = "sqlite:///{tmp_path}/transactions.db"
 
 def test_create_transaction(client, api_key,mocker):
     mocker.patch(
@@ -382,4 +363,648 @@ def test_no_high_risk_transactions(client, api_key):
     # Either we should get an empty list or our low-risk transaction should not be included
     high_risk_analyses = data["analyses"]
     for analysis in high_risk_analyses:
-        assert analysis["transaction_id"] != low_risk_transaction["transaction_id"], "Low-risk transaction incorrectly classified as high risk"
\ No newline at end of file
+        assert analysis["transaction_id"] != low_risk_transaction["transaction_id"], "Low-risk transaction incorrectly classified as high risk"
+
+def test_filter_analyses_by_configured_band(client, api_key):
+    """risk_level bands follow the configured thresholds and summary counts are kept on write"""
+    from main.models import RiskSummary
+    client.application.config['RISK_BLOCK_THRESHOLD'] = 0.6
+    transaction = {"transaction_id": "tx_band", "amount": 10.0}
+    with client.application.app_context():
+        for score, action in [(0.1, "allow"), (0.45, "review"), (0.65, "review"), (0.9, "block")]:
+            DatabaseManager.save_transaction_analysis(
+                {**transaction, "transaction_id": f"tx_band_{score}"},
+                {"risk_score": score, "recommended_action": action, "risk_factors": []}
+            )
+
+        response = client.get("/analyses?risk_level=review", headers={"X-API-KEY": api_key})
+        assert response.status_code == 200
+        scores = sorted(a["risk_score"] for a in response.get_json()["analyses"])
+        assert scores == [0.45]
+
+        response = client.get("/analyses?risk_level=high", headers={"X-API-KEY": api_key})
+        scores = sorted(a["risk_score"] for a in response.get_json()["analyses"])
+        assert scores == [0.65, 0.9]
+
+        response = client.get("/analyses?recommended_action=review", headers={"X-API-KEY": api_key})
+        assert sorted(a["risk_score"] for a in response.get_json()["analyses"]) == [0.45, 0.65]
+
+        response = client.get("/analyses?risk_level=unknown", headers={"X-API-KEY": api_key})
+        assert response.status_code == 400
+
+        response = client.get("/analyses/summary", headers={"X-API-KEY": api_key})
+        data = response.get_json()
+        assert data["bands"] == {"allow": 1, "review": 1, "block": 2}
+        assert data["recommended_actions"] == {"allow": 1, "review": 2, "block": 1}
+
+        # History saved before the summary table existed is counted by a rebuild
+        RiskSummary.query.delete()
+        assert DatabaseManager.rebuild_risk_summary() == 4
+        assert client.get("/analyses/summary", headers={"X-API-KEY": api_key}).get_json()["bands"] == \
+            {"allow": 1, "review": 1, "block": 2}
+
+def test_analyses_conditional_get_and_compression(client, api_key):
+    """Unchanged history revalidates with 304, large payloads are gzipped and fields= projects"""
+    with client.application.app_context():
+        for i in range(20):
+            DatabaseManager.save_transaction_analysis(
+                {"transaction_id": f"tx_etag_{i}", "amount": 10.0, "notes": "x" * 100},
+                {"risk_score": 0.2, "recommended_action": "allow", "risk_factors": []}
+            )
+
+        response = client.get("/analyses", headers={"X-API-KEY": api_key, "Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert response.headers["Content-Encoding"] == "gzip"
+        etag = response.headers["ETag"]
+
+        response = client.get("/analyses", headers={"X-API-KEY": api_key, "If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.data == b""
+
+        DatabaseManager.save_transaction_analysis(
+            {"transaction_id": "tx_etag_new", "amount": 10.0},
+            {"risk_score": 0.2, "recommended_action": "allow", "risk_factors": []}
+        )
+        response = client.get("/analyses", headers={"X-API-KEY": api_key, "If-None-Match": etag})
+        assert response.status_code == 200
+
+        response = client.get("/analyses?fields=transaction_id,risk_score", headers={"X-API-KEY": api_key})
+        analysis = response.get_json()["analyses"][0]
+        assert set(analysis) == {"transaction_id", "risk_score"}
+
+def test_alert_stream_resumes_from_last_event_id(client, api_key, mocker):
+    """High-risk writes are pushed to SSE subscribers and missed events are replayed"""
+    from main.alert_stream import AlertBroker
+    broker = AlertBroker(buffer_size=4, history_size=1)
+    mocker.patch("main.controller.alert_broker", broker)
+    mocker.patch("main.database_manager.alert_broker", broker)
+
+    with client.application.app_context():
+        for i, score in enumerate([0.9, 0.2, 0.95]):
+            DatabaseManager.save_transaction_analysis(
+                {"transaction_id": f"tx_stream_{i}", "amount": 10.0},
+                {"risk_score": score, "recommended_action": "block" if score > 0.7 else "allow", "risk_factors": []}
+            )
+
+    # The in-memory history only holds the last event, so event 1 comes from the database
+    response = client.get("/admin/notifications/stream",
+                          headers={"X-API-KEY": api_key, "Last-Event-ID": "0"}, buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    chunks = iter(response.response)
+    assert next(chunks).startswith(b"retry:")
+    first, second = next(chunks), next(chunks)
+    assert first.startswith(b"id: 1\n") and b"tx_stream_0" in first
+    assert second.startswith(b"id: 3\n") and b"tx_stream_2" in second
+    assert broker.subscriber_count == 1
+    response.close()
+    assert broker.subscriber_count == 0
+
+def test_alert_stream_refills_lagged_buffer_without_last_event_id(client, api_key, mocker):
+    """A subscriber that connected without Last-Event-ID still gets events dropped from its full buffer"""
+    from main.alert_stream import AlertBroker
+    broker = AlertBroker(buffer_size=1, history_size=1)
+    mocker.patch("main.controller.alert_broker", broker)
+    mocker.patch("main.database_manager.alert_broker", broker)
+
+    with client.application.app_context():
+        DatabaseManager.save_transaction_analysis(
+            {"transaction_id": "tx_before", "amount": 10.0},
+            {"risk_score": 0.9, "recommended_action": "block", "risk_factors": []}
+        )
+
+    response = client.get("/admin/notifications/stream", headers={"X-API-KEY": api_key}, buffered=False)
+    chunks = iter(response.response)
+    assert next(chunks).startswith(b"retry:")
+
+    with client.application.app_context():
+        for i in range(3):
+            DatabaseManager.save_transaction_analysis(
+                {"transaction_id": f"tx_lagged_{i}", "amount": 10.0},
+                {"risk_score": 0.9, "recommended_action": "block", "risk_factors": []}
+            )
+
+    received = [next(chunks) for _ in range(3)]
+    assert [chunk.split(b"\n")[0] for chunk in received] == [b"id: 2", b"id: 3", b"id: 4"]
+    response.close()
+
+def test_alert_stream_polls_alerts_published_by_other_processes(client, api_key, mocker):
+    """With polling on, alerts saved by another process (its own broker) still reach the stream in id order"""
+    import threading
+    from main.alert_stream import AlertBroker
+    broker = AlertBroker(poll_seconds=0.05)
+    mocker.patch("main.controller.alert_broker", broker)
+    # Another process's broker: alerts it publishes only reach this one through the database
+    mocker.patch("main.database_manager.alert_broker", AlertBroker(poll_seconds=0))
+
+    response = client.get("/admin/notifications/stream", headers={"X-API-KEY": api_key}, buffered=False)
+    chunks = iter(response.response)
+    assert next(chunks).startswith(b"retry:")
+    other = client.get("/admin/notifications/stream", headers={"X-API-KEY": api_key}, buffered=False)
+    other_chunks = iter(other.response)
+    assert next(other_chunks).startswith(b"retry:")
+    # Both streams are fed by one poller instead of a query each
+    assert [thread.name for thread in threading.enumerate()].count("alert-poller") == 1
+
+    with client.application.app_context():
+        for i in range(2):
+            DatabaseManager.save_transaction_analysis(
+                {"transaction_id": f"tx_other_node_{i}", "amount": 10.0},
+                {"risk_score": 0.9, "recommended_action": "block", "risk_factors": []}
+            )
+
+    for stream in (chunks, other_chunks):
+        received = [next(stream) for _ in range(2)]
+        assert [chunk.split(b"\n")[0] for chunk in received] == [b"id: 1", b"id: 2"]
+    other.close()
+    response.close()
+    # The poller stops once nobody is subscribed
+    for _ in range(100):
+        if "alert-poller" not in [thread.name for thread in threading.enumerate()]:
+            break
+        time.sleep(0.01)
+    assert broker._poller is None
+
+def test_shadow_candidate_scored_off_request_path(client, api_key, mocker):
+    """Sampled transactions are re-scored by the candidate in the background and compared"""
+    from main.shadow import shadow_queue
+    mocker.patch("main.shadow.SHADOW_CANDIDATE", "local")
+    mocker.patch("main.shadow.SHADOW_SAMPLE_RATE", 1.0)
+    mocker.patch(
+        "main.get_financial_risk.analyse_transaction_deepseek",
+        return_value={"risk_score": 0.9, "recommended_action": "block", "risk_factors": []}
+    )
+    transaction = {
+        "transaction_id": "tx_shadow",
+        "timestamp": "2025-05-07T14:30:45Z",
+        "amount": 50000.00,
+        "currency": "USD",
+        "customer": {"id": "cust_98765", "country": "US", "ip_address": "192.168.1.1"},
+        "payment_method": {"type": "credit_card", "last_four": "4242", "country_of_issue": "CA"},
+        "merchant": {"id": "merch_12345", "name": "Example Store", "category": "electronics"}
+    }
+
+    response = client.post("/transaction", json=transaction, headers={"X-API-KEY": api_key})
+    assert response.status_code == 201
+    assert response.get_json()["llm_result"]["risk_score"] == 0.9
+    shadow_queue.join()
+
+    response = client.get("/admin/shadow/report", headers={"X-API-KEY": api_key})
+    report = response.get_json()["candidates"]
+    assert len(report) == 1
+    assert report[0]["candidate"] == "local"
+    assert report[0]["samples"] == 1
+    assert report[0]["errors"] == 0
+    # The rule-based candidate lands on the block threshold (0.7), so it only recommends review
+    assert report[0]["action_agreement"] == 0.0
+    assert report[0]["disagreements"] == {"block->review": 1}
+    assert report[0]["latency_ms"]["p50"] is not None
+
+def test_profiles_updated_incrementally(client, api_key):
+    """Merchant/customer profiles keep a running mean/variance and feed the prompt"""
+    from main.profiles import profile_cache, attach_profiles
+    profile_cache.invalidate()
+    amounts = [100.0, 200.0, 600.0]
+    with client.application.app_context():
+        for i, (amount, action) in enumerate(zip(amounts, ["allow", "review", "block"])):
+            DatabaseManager.save_transaction_analysis(
+                {"transaction_id": f"tx_profile_{i}", "amount": amount,
+                 "customer": {"id": "cust_p", "country": ["US", "FR", "US"][i], "ip_address": f"10.0.0.{i}"},
+                 "merchant": {"id": "merch_p"}},
+                {"risk_score": 0.5, "recommended_action": action, "risk_factors": []}
+            )
+            # Saves drop the cached profile instead of racing other writers to overwrite it
+            assert profile_cache.get(("merchant", "merch_p")) is None
+            DatabaseManager.get_profile("merchant", "merch_p")
+
+        profile = DatabaseManager.get_profile("merchant", "merch_p")
+        assert profile["count"] == 3
+        assert profile["amount_mean"] == pytest.approx(300.0)
+        assert profile["amount_variance"] == pytest.approx(70000.0)
+        assert profile["block_rate"] == pytest.approx(1 / 3)
+        assert profile["recent_countries"] == ["US", "FR"]
+        assert profile["recent_ips"] == ["10.0.0.2", "10.0.0.1", "10.0.0.0"]
+
+        enriched = attach_profiles({"amount": 300.0, "customer": {"id": "cust_p", "country": "DE"},
+                                    "merchant": {"id": "merch_p"}}, DatabaseManager.get_profile)
+        assert enriched["merchant_history"]["transactions"] == 3
+        assert enriched["customer_history"]["new_country"] is True
+        assert profile_cache.stats()["hits"] >= 1
+
+        # A rebuild folds stored history into the same profile
+        assert DatabaseManager.rebuild_risk_profiles() == 3
+        rebuilt = DatabaseManager.get_profile("merchant", "merch_p")
+        assert {key: rebuilt[key] for key in ("count", "block_rate", "recent_countries", "recent_ips")} == \
+            {key: profile[key] for key in ("count", "block_rate", "recent_countries", "recent_ips")}
+        assert rebuilt["amount_variance"] == pytest.approx(70000.0)
+
+    response = client.get("/profiles/cust_p?type=customer", headers={"X-API-KEY": api_key})
+    assert response.status_code == 200
+    assert set(response.get_json()["profiles"]) == {"customer"}
+    assert client.get("/profiles/nobody", headers={"X-API-KEY": api_key}).status_code == 404
+
+@pytest.mark.parametrize("app", [FILE_DATABASE], indirect=True)
+def test_overload_sheds_or_degrades_to_provisional_verdict(client, api_key, mocker):
+    """Saturated scoring returns 503 + Retry-After, or a provisional local verdict rescored later"""
+    from main.admission import AdmissionController, deferred_queue
+    mocker.patch("main.get_financial_risk.scoring_admission", AdmissionController(max_in_flight=0, max_waiting=0))
+    mocker.patch(
+        "main.llm_int_deepseek.analyse_transaction_deepseek",
+        return_value={"risk_score": 0.9, "recommended_action": "block", "risk_factors": ["Rescored"]}
+    )
+    transaction = {
+        "transaction_id": "tx_overload",
+        "timestamp": "2025-05-07T14:30:45Z",
+        "amount": 50.00,
+        "currency": "USD",
+        "customer": {"id": "cust_98765", "country": "US", "ip_address": "192.168.1.1"},
+        "payment_method": {"type": "credit_card", "last_four": "4242", "country_of_issue": "US"},
+        "merchant": {"id": "merch_12345", "name": "Example Store", "category": "books"}
+    }
+
+    response = client.post("/transaction", json=transaction, headers={"X-API-KEY": api_key})
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+
+    mocker.patch("main.get_financial_risk.DEGRADED_MODE", "local")
+    response = client.post("/transaction", json=transaction, headers={"X-API-KEY": api_key})
+    assert response.status_code == 202
+    result = response.get_json()["llm_result"]
+    assert result["provisional"] is True
+    assert result["recommended_action"] == "allow"
+    deferred_queue.join()
+
+    response = client.get("/analyses", headers={"X-API-KEY": api_key})
+    analyses = response.get_json()["analyses"]
+    assert [(a["transaction_id"], a["risk_score"], a["recommended_action"]) for a in analyses] == [("tx_overload", 0.9, "block")]
+    response = client.get("/analyses/summary", headers={"X-API-KEY": api_key})
+    assert response.get_json()["recommended_actions"] == {"allow": 0, "block": 1}
+
+@pytest.mark.parametrize("app", [FILE_DATABASE], indirect=True)
+def test_failed_rescore_is_swept_and_lowered_alert_resolved(client, api_key, mocker):
+    """A provisional verdict survives a failed rescore, is retried by the sweeper and its alert closed"""
+    from main import admission, db
+    from main.alert_stream import AlertBroker
+    from main.models import AlertState
+    alert_broker = mocker.patch("main.database_manager.alert_broker", AlertBroker())
+    mocker.patch("main.get_financial_risk.scoring_admission", admission.AdmissionController(max_in_flight=0, max_waiting=0))
+    mocker.patch("main.get_financial_risk.DEGRADED_MODE", "local")
+    mocker.patch("main.admission.RESCORE_BACKOFF_SECONDS", 0.0)
+    mocker.patch("main.admission.local_score", return_value={
+        "risk_score": 0.9, "recommended_action": "block", "risk_factors": ["Local rules"], "scorer": "local"
+    })
+    analyse = mocker.patch("main.llm_int_deepseek.analyse_transaction_deepseek",
+                           side_effect=admission.BudgetExceeded("LLM call exceeded its budget"))
+    transaction = {
+        "transaction_id": "tx_provisional",
+        "timestamp": "2025-05-07T14:30:45Z",
+        "amount": 50.00,
+        "currency": "USD",
+        "customer": {"id": "cust_98765", "country": "US", "ip_address": "192.168.1.1"},
+        "payment_method": {"type": "credit_card", "last_four": "4242", "country_of_issue": "US"},
+        "merchant": {"id": "merch_12345", "name": "Example Store", "category": "books"}
+    }
+
+    response = client.post("/transaction", json=transaction, headers={"X-API-KEY": api_key})
+    analysis_id = response.get_json()["llm_result"]["analysis_id"]
+    admission.deferred_queue.join()
+    with client.application.app_context():
+        assert [row.id for row in DatabaseManager.get_provisional_analyses()] == [analysis_id]
+        assert alert_broker.replay_since(analysis_id - 1)[-1]["id"] == analysis_id
+
+        analyse.side_effect = None
+        analyse.return_value = {"risk_score": 0.1, "recommended_action": "allow", "risk_factors": []}
+        assert admission.sweep_provisional() == 1
+        admission.deferred_queue.join()
+        assert DatabaseManager.get_provisional_analyses() == []
+        assert db.session.get(TransactionAnalysis, analysis_id).recommended_action == "allow"
+        assert db.session.get(AlertState, analysis_id).status == "resolved"
+        assert analysis_id not in [event["id"] for event in alert_broker.replay_since(analysis_id - 1) or []]
+        assert admission.sweep_provisional() == 0
+
+def test_background_scoring_leaves_reserved_slots_to_live_traffic():
+    from main.admission import AdmissionController, Overloaded
+    controller = AdmissionController(max_in_flight=2, max_waiting=2, live_reserve=1)
+    with controller.admit(background=True):
+        with pytest.raises(Overloaded):
+            with controller.admit(background=True):
+                pass
+        with controller.admit(timeout=0.1):
+            assert controller.metrics()["in_flight"] == 2
+
+@pytest.mark.parametrize("app", [FILE_DATABASE], indirect=True)
+def test_deadline_header_bounds_llm_wait(client, api_key, mocker):
+    """A request whose budget runs out gets the best available verdict early and is scored later"""
+    from main.admission import deferred_queue
+    mocker.patch("main.llm_int_deepseek.LLM_BACKEND", "mock")
+    mocker.patch("main.mock_llm.MOCK_LATENCY_MS", 300.0)
+    mocker.patch("main.mock_llm.MOCK_LATENCY_SIGMA", 0.01)
+    transaction = {
+        "transaction_id": "tx_deadline",
+        "timestamp": "2025-05-07T14:30:45Z",
+        "amount": 50.00,
+        "currency": "USD",
+        "customer": {"id": "cust_98765", "country": "US", "ip_address": "192.168.1.1"},
+        "payment_method": {"type": "credit_card", "last_four": "4242", "country_of_issue": "US"},
+        "merchant": {"id": "merch_12345", "name": "Example Store", "category": "books"}
+    }
+
+    started = time.perf_counter()
+    response = client.post("/transaction", json=transaction,
+                           headers={"X-API-KEY": api_key, "X-Request-Timeout-Ms": "120"})
+    assert time.perf_counter() - started < 0.25
+    assert response.status_code == 202
+    assert response.headers["X-Deadline-Exceeded"] == "llm_call"
+    result = response.get_json()["llm_result"]
+    assert result["provisional"] is True
+    assert result["scorer"] == "local"
+    assert "analysis_id" not in result
+
+    response = client.post("/transaction", json=transaction,
+                           headers={"X-API-KEY": api_key, "X-Request-Timeout-Ms": "0"})
+    assert response.headers["X-Deadline-Exceeded"] == "scoring"
+
+    deferred_queue.join()
+    response = client.get("/analyses", headers={"X-API-KEY": api_key})
+    assert response.get_json()["count"] == 2
+
+def test_alert_states_and_bulk_acknowledgement(client, api_key):
+    """Only unacknowledged alerts after the cursor are returned; acks are applied in bulk"""
+    headers = {"X-API-KEY": api_key}
+    with client.application.app_context():
+        ids = [
+            DatabaseManager.save_transaction_analysis(
+                {"transaction_id": f"tx_alert_{i}", "amount": 10.0},
+                {"risk_score": score, "recommended_action": "block" if score > 0.7 else "allow", "risk_factors": []}
+            )
+            for i, score in enumerate([0.9, 0.1, 0.95, 0.85])
+        ]
+
+    data = client.get("/admin/notifications?status=open", headers=headers).get_json()
+    assert [alert["transaction_id"] for alert in data["notifications"]] == ["tx_alert_0", "tx_alert_2", "tx_alert_3"]
+    assert data["cursor"] == ids[3]
+    assert client.get("/admin/notifications?status=open&limit=-1", headers=headers).get_json()["count"] == 1
+
+    response = client.post("/admin/notifications/ack", json={"ids": [ids[0], ids[2]]}, headers=headers)
+    assert response.get_json()["updated"] == 2
+    data = client.get("/admin/notifications?status=open", headers=headers).get_json()
+    assert [alert["id"] for alert in data["notifications"]] == [ids[3]]
+    assert client.get(f"/admin/notifications?since={ids[3]}", headers=headers).get_json()["count"] == 0
+
+    response = client.post("/admin/notifications/ack", json={"up_to": ids[3], "status": "assigned", "assignee": "analyst"},
+                           headers=headers)
+    assert response.get_json()["updated"] == 1
+    assigned = client.get("/admin/notifications?status=assigned", headers=headers).get_json()["notifications"]
+    assert assigned[0]["assignee"] == "analyst"
+
+    assert client.post("/admin/notifications/ack", json={"ids": [1], "status": "bogus"}, headers=headers).status_code == 400
+    assert client.post("/admin/notifications/ack", json={}, headers=headers).status_code == 400
+
+def test_risk_analytics_served_from_rollups(client, api_key):
+    """Trend queries are answered from the rollups and match a rebuild from stored analyses"""
+    from main.models import RiskRollup
+    headers = {"X-API-KEY": api_key}
+    rows = [("electronics", "US", 0.9, "block"), ("electronics", "NG", 0.5, "review"),
+            ("books", "US", 0.1, "allow"), ("books", "US", 0.2, "allow")]
+    with client.application.app_context():
+        for i, (category, country, score, action) in enumerate(rows):
+            DatabaseManager.save_transaction_analysis(
+                {"transaction_id": f"tx_trend_{i}", "amount": 10.0,
+                 "customer": {"country": country}, "merchant": {"category": category}},
+                {"risk_score": score, "recommended_action": action, "risk_factors": []}
+            )
+        maintained = sorted((r.day, r.dimension, r.value, r.recommended_action, r.count, round(r.score_sum, 6))
+                            for r in RiskRollup.query.all())
+        assert DatabaseManager.rebuild_risk_rollups() == 4
+        rebuilt = sorted((r.day, r.dimension, r.value, r.recommended_action, r.count, round(r.score_sum, 6))
+                         for r in RiskRollup.query.all())
+        assert maintained == rebuilt
+
+    trends = client.get("/analytics/risk?group_by=category", headers=headers).get_json()["trends"]
+    assert [(t["category"], t["total"], t["block_rate"]) for t in trends] == [("books", 2, 0.0), ("electronics", 2, 0.5)]
+
+    trends = client.get("/analytics/risk?group_by=day&category=Electronics", headers=headers).get_json()["trends"]
+    assert len(trends) == 1 and trends[0]["total"] == 2
+    assert trends[0]["mean_score"] == pytest.approx(0.7)
+
+    trends = client.get("/analytics/risk?group_by=score_bucket", headers=headers).get_json()["trends"]
+    assert [t["score_bucket"] for t in trends] == ["010", "020", "050", "090"]
+
+    assert client.get("/analytics/risk?group_by=merchant", headers=headers).status_code == 400
+    assert client.get("/analytics/risk?group_by=category&customer_country=US", headers=headers).status_code == 400
+
+@pytest.mark.parametrize("app", [FILE_DATABASE], indirect=True)
+def test_rollup_rebuild_does_not_lose_concurrent_writes(app, mocker):
+    """A save racing a rebuild waits for it instead of incrementing rows the rebuild replaces"""
+    import threading
+    from main.models import RiskRollup
+    transaction = {"transaction_id": "tx_rebuild", "amount": 10.0, "merchant": {"category": "books"}}
+    verdict = {"risk_score": 0.2, "recommended_action": "allow", "risk_factors": []}
+    with app.app_context():
+        for _ in range(2):
+            DatabaseManager.save_transaction_analysis(transaction, verdict)
+
+    scanning = threading.Event()
+    iter_chunks = DatabaseManager._iter_analysis_chunks
+
+    def slow_chunks(*columns, **kwargs):
+        chunks = list(iter_chunks(*columns, **kwargs))
+        scanning.set()
+        time.sleep(0.3)
+        yield from chunks
+
+    mocker.patch.object(DatabaseManager, "_iter_analysis_chunks", side_effect=slow_chunks)
+
+    def rebuild():
+        with app.app_context():
+            DatabaseManager.rebuild_risk_rollups()
+
+    rebuilder = threading.Thread(target=rebuild)
+    rebuilder.start()
+    assert scanning.wait(5)
+    with app.app_context():
+        DatabaseManager.save_transaction_analysis(transaction, verdict)
+    rebuilder.join()
+
+    with app.app_context():
+        assert RiskRollup.query.filter_by(dimension="total").one().count == 3
+
+def test_cascade_escalates_only_uncertain_scores(client, api_key, mocker):
+    """The cheap tier answers clear cases; review-range scores go to the stronger model"""
+    mocker.patch("main.cascade.CASCADE_ENABLED", True)
+    mocker.patch("main.cascade.CASCADE_ESCALATE", "openai")
+    first_tier = mocker.patch("main.llm_int_deepseek._score_with_llm", side_effect=[
+        {"risk_score": 0.1, "recommended_action": "allow", "risk_factors": []},
+        {"risk_score": 0.5, "recommended_action": "review", "risk_factors": []},
+    ])
+    escalated = mocker.patch("main.llm_integrator.analyse_transaction", return_value={
+        "risk_score": 0.9, "recommended_action": "block", "risk_factors": ["Confirmed by stronger model"]
+    })
+    headers = {"X-API-KEY": api_key}
+    transaction = {
+        "transaction_id": "tx_cascade",
+        "timestamp": "2025-05-07T14:30:45Z",
+        "amount": 120.00,
+        "currency": "USD",
+        "customer": {"id": "cust_cascade", "country": "US", "ip_address": "192.168.1.1"},
+        "payment_method": {"type": "credit_card", "last_four": "4242", "country_of_issue": "US"},
+        "merchant": {"id": "merch_cascade", "name": "Example Store", "category": "books"}
+    }
+
+    clear = client.post("/transaction", json=transaction, headers=headers).get_json()["llm_result"]
+    assert clear["decision_path"] == "deepseek"
+    assert escalated.call_count == 0
+
+    uncertain = client.post("/transaction", json={**transaction, "transaction_id": "tx_cascade_2"},
+                            headers=headers).get_json()["llm_result"]
+    assert uncertain["decision_path"] == "deepseek>openai"
+    assert uncertain["recommended_action"] == "block"
+    assert uncertain["first_tier_score"] == 0.5
+    assert first_tier.call_count == 2 and escalated.call_count == 1
+
+    with client.application.app_context():
+        paths = {a.decision_path for a in TransactionAnalysis.query.all()}
+    assert paths == {"deepseek", "deepseek>openai"}
+    metrics = client.get("/admin/admission", headers=headers).get_json()["cascade"]
+    assert metrics["escalated"] == 1 and metrics["band"] == [0.3, 0.7]
+
+    escalated.side_effect = Exception("provider down")
+    first_tier.side_effect = [{"risk_score": 0.4, "recommended_action": "review", "risk_factors": []}]
+    kept = client.post("/transaction", json={**transaction, "transaction_id": "tx_cascade_3"},
+                       headers=headers).get_json()["llm_result"]
+    assert kept["decision_path"] == "deepseek>openai!"
+    assert kept["risk_score"] == 0.4
+
+def test_slow_requests_captured_with_stages_and_sql(client, api_key, mocker):
+    """Requests over the threshold land in the ring buffer; the sampling profiler reports stacks"""
+    from main.profiling import slow_requests
+    slow_requests.clear()
+    headers = {"X-API-KEY": api_key}
+    with client.application.app_context():
+        DatabaseManager.save_transaction_analysis(
+            {"transaction_id": "tx_slow", "amount": 10.0}, {"risk_score": 0.2, "recommended_action": "allow"})
+
+    mocker.patch("main.profiling.SLOW_REQUEST_MS", 10000.0)
+    assert client.get("/analyses", headers=headers).status_code == 200
+    assert client.get("/admin/slow-requests", headers=headers).get_json()["slow_requests"] == []
+
+    mocker.patch("main.profiling.SLOW_REQUEST_MS", 0.001)
+    assert client.get("/analyses", headers=headers).status_code == 200
+    entry = client.get("/admin/slow-requests?limit=1", headers=headers).get_json()["slow_requests"][0]
+    assert entry["path"] == "/analyses" and entry["status"] == 200
+    assert set(entry["stages"]) == {"query", "serialize"}
+    assert entry["sql"]["count"] >= 1
+    assert any("FROM transaction_analyses" in s["statement"] for s in entry["sql"]["statements"])
+
+    assert client.post("/admin/profiler", json={"seconds": 1000}, headers=headers).status_code == 400
+    assert client.post("/admin/profiler", json={"seconds": 5, "interval_ms": 1}, headers=headers).status_code == 202
+    assert client.post("/admin/profiler", json={"seconds": 5}, headers=headers).status_code == 409
+    time.sleep(0.05)
+    status = client.delete("/admin/profiler", headers=headers).get_json()["profiler"]
+    assert status["running"] is False and status["samples"] > 0
+    collapsed = client.get("/admin/profiler?format=collapsed", headers=headers).get_data(as_text=True)
+    stack, count = collapsed.splitlines()[0].rsplit(" ", 1)
+    assert ";" in stack and int(count) > 0
+
+def test_sql_statements_fingerprinted_and_repeats_flagged(client, api_key, mocker):
+    """Statements are aggregated by fingerprint with rows and plans; repeats within a request are flagged"""
+    from main.sql_instrumentation import fingerprint, sql_stats
+    from main.profiling import slow_requests
+    assert fingerprint("SELECT * FROM t WHERE id IN (?, ?, ?) AND name = 'x'")[1] == \
+        fingerprint("SELECT *  FROM t WHERE id IN (?, ?) AND name = 'y'")[1] == \
+        "SELECT * FROM t WHERE id IN (?) AND name = ?"
+
+    mocker.patch("main.sql_instrumentation.SQL_REPEAT_THRESHOLD", 2)
+    mocker.patch("main.sql_instrumentation.SQL_COUNT_ROWS", True)
+    mocker.patch("main.sql_instrumentation.SQL_SLOW_MS", 0.0)
+    mocker.patch("main.profiling.SLOW_REQUEST_MS", 0.001)
+    mocker.patch("main.llm_int_deepseek._score_with_llm",
+                 return_value={"risk_score": 0.2, "recommended_action": "allow", "risk_factors": []})
+    sql_stats.reset()
+    slow_requests.clear()
+    headers = {"X-API-KEY": api_key}
+    transaction = {
+        "transaction_id": "tx_sql",
+        "timestamp": "2025-05-07T14:30:45Z",
+        "amount": 120.00,
+        "currency": "USD",
+        "customer": {"id": "cust_sql", "country": "US", "ip_address": "192.168.1.1"},
+        "payment_method": {"type": "credit_card", "last_four": "4242", "country_of_issue": "US"},
+        "merchant": {"id": "merch_sql", "name": "Example Store", "category": "books"}
+    }
+    for i in range(2):
+        assert client.post("/transaction", json={**transaction, "transaction_id": f"tx_sql_{i}"},
+                           headers=headers).status_code == 201
+
+    # The profile upsert runs once for the merchant and once for the customer
+    repeated = slow_requests.entries(1)[0]["sql"]["repeated"]
+    assert any(statement.startswith("INSERT INTO risk_profiles") for statement in repeated)
+    assert any(entry["repeated_requests"] == 2 for entry in sql_stats.report(order_by="repeated_requests"))
+
+    assert client.get("/analyses", headers=headers).status_code == 200
+    statements = client.get("/admin/sql?order_by=count&limit=0", headers=headers).get_json()["statements"]
+    history = [s for s in statements if s["statement"].startswith("SELECT") and "FROM transaction_analyses ORDER BY" in s["statement"]]
+    assert history[0]["rows"] == 2
+    assert history[0]["plan"] and "transaction_analyses" in " ".join(history[0]["plan"])
+    assert client.get("/admin/sql?order_by=bogus", headers=headers).status_code == 400
+
+    # A failing statement does not leave its start time behind on the connection
+    from main import db
+    from sqlalchemy import text
+    with client.application.app_context():
+        with pytest.raises(Exception):
+            db.session.execute(text("SELECT * FROM no_such_table"))
+        db.session.rollback()
+        assert not db.session.connection().info.get("sql_started")
+
+def test_history_export_streams_filtered_rows(client, api_key):
+    """The export streams stored payloads newest first and resumes from before_id"""
+    headers = {"X-API-KEY": api_key}
+    with client.application.app_context():
+        for i, (score, action) in enumerate([(0.1, "allow"), (0.9, "block"), (0.95, "block")]):
+            DatabaseManager.save_transaction_analysis(
+                {"transaction_id": f"tx_export_{i}", "amount": 10.0 + i},
+                {"risk_score": score, "recommended_action": action, "risk_factors": []}
+            )
+
+    response = client.get("/analyses/export", headers=headers)
+    assert response.mimetype == "application/x-ndjson"
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [r["transaction_id"] for r in records] == ["tx_export_2", "tx_export_1", "tx_export_0"]
+    assert records[0]["transaction_details"] == {"transaction_id": "tx_export_2", "amount": 12.0}
+
+    response = client.get(f"/analyses/export?format=json&risk_level=high&fields=id,risk_score"
+                          f"&before_id={records[0]['id']}", headers=headers)
+    assert response.get_json() == [{"id": records[1]["id"], "risk_score": 0.9}]
+    assert client.get("/analyses/export?fields=llm_response", headers=headers).status_code == 400
+    assert client.get("/analyses/export?risk_level=extreme", headers=headers).status_code == 400
+
+def test_cascade_skips_unhealthy_escalation_provider(client, api_key, mocker):
+    """A provider failing its health probes is not called; the first tier's verdict stands"""
+    from main.warmup import provider_health
+    mocker.patch("main.cascade.CASCADE_ENABLED", True)
+    mocker.patch("main.cascade.CASCADE_ESCALATE", "openai")
+    mocker.patch("main.llm_int_deepseek._score_with_llm",
+                 return_value={"risk_score": 0.5, "recommended_action": "review", "risk_factors": []})
+    escalated = mocker.patch("main.llm_integrator.analyse_transaction")
+    provider_health.reset()
+    for _ in range(3):
+        provider_health.record("openai", False, error="connection refused")
+    try:
+        transaction = {
+            "transaction_id": "tx_unhealthy",
+            "timestamp": "2025-05-07T14:30:45Z",
+            "amount": 120.00,
+            "currency": "USD",
+            "customer": {"id": "cust_1", "country": "US", "ip_address": "192.168.1.1"},
+            "payment_method": {"type": "credit_card", "last_four": "4242", "country_of_issue": "US"},
+            "merchant": {"id": "merch_1", "name": "Example Store", "category": "books"}
+        }
+        result = client.post("/transaction", json=transaction, headers={"X-API-KEY": api_key}).get_json()
+        assert result["llm_result"]["decision_path"] == "deepseek>openai!"
+        assert escalated.call_count == 0
+        assert client.get("/health").get_json() == {"status": "degraded"}
+        providers = client.get("/admin/providers", headers={"X-API-KEY": api_key}).get_json()["providers"]
+        assert providers["openai"]["error"] == "connection refused"
+    finally:
+        provider_health.reset()
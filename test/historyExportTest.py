@@ -0,0 +1,40 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+import json
+from datetime import datetime
+from types import SimpleNamespace
+from main.history_export import encode_history_row, measure_memory_per_row
+
+
+def test_rows_encode_without_decoding_the_payload():
+    payload = '{"transaction_id": "tx_\\"quoted\\"", "customer": {"id": "cust_1"}}'
+    row = SimpleNamespace(id=7, transaction_id='tx_"quoted"', transaction_data=payload, risk_score=0.8,
+                          recommended_action="block",
+                          decision_path=None, created_at=datetime(2025, 5, 7, 14, 30))
+    record = json.loads(encode_history_row(row))
+    assert record["transaction_id"] == 'tx_"quoted"'
+    assert record["transaction_details"] == json.loads(payload)
+    assert record["created_at"] == "2025-05-07T14:30:00"
+    assert list(json.loads(encode_history_row(row, ["risk_score", "id"]))) == ["risk_score", "id"]
+    assert json.loads(encode_history_row(SimpleNamespace(transaction_id=None), ["transaction_id"])) == \
+        {"transaction_id": ""}
+
+def test_export_reads_the_top_level_transaction_id(app):
+    """A transaction_id nested in the payload ahead of the top-level key is not exported"""
+    from main import db
+    from main.database_manager import DatabaseManager
+    from main.models import TransactionAnalysis
+    with app.app_context():
+        for payload in ('{"merchant": {"transaction_id": "nested"}, "transaction_id": "tx_top"}',
+                        '{"merchant": {"transaction_id": "nested"}}', 'not json'):
+            db.session.add(TransactionAnalysis(transaction_data=payload, llm_response="{}", risk_score=0.5,
+                                               recommended_action="review", risk_factors="[]"))
+        db.session.commit()
+        records = [json.loads(encode_history_row(row, ["id", "transaction_id"]))
+                   for row in DatabaseManager.iter_history_rows()]
+    assert [record["transaction_id"] for record in records] == ["", "", "tx_top"]
+
+def test_streaming_export_uses_a_fraction_of_the_orm_memory():
+    report = measure_memory_per_row(rows=3000)
+    assert report["streaming_export"]["peak_bytes_per_row"] * 5 < report["orm_to_dict"]["peak_bytes_per_row"]
@@ -12,9 +12,7 @@ load_dotenv()
 
 @pytest.fixture
 def app():
-    app = create_app()
-    app.config['TESTING'] = True
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:'})
     
     with app.app_context():
         db.create_all()
@@ -194,4 +192,53 @@ def test_invalid_transaction_data(client, api_key):
     
     assert response.status_code == 422
     data = response.get_json()
-    assert "error" in data
\ No newline at end of file
+    assert "error" in data
+
+def test_schema_is_created_once_per_deployment(tmp_path):
+    """The first worker creates the schema; later workers skip the inspection"""
+    from flask import Flask
+    from main.schema import ensure_schema
+
+    def make_worker_app():
+        worker_app = Flask("main", instance_path=str(tmp_path))
+        worker_app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'workers.db'}"
+        db.init_app(worker_app)
+        return worker_app
+
+    assert ensure_schema(make_worker_app()) is True
+    assert ensure_schema(make_worker_app()) is False
+
+    os.remove(tmp_path / 'workers.db')
+    assert ensure_schema(make_worker_app()) is True
+
+def test_schema_adds_new_nullable_columns_to_existing_tables(tmp_path):
+    """Columns added to a model reach databases created before they existed"""
+    import sqlite3
+    from flask import Flask
+    from sqlalchemy import inspect
+    from main.schema import create_schema
+
+    path = tmp_path / 'existing.db'
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE transaction_analyses (id INTEGER PRIMARY KEY, transaction_data TEXT NOT NULL, "
+        "llm_response TEXT NOT NULL, risk_score FLOAT NOT NULL, recommended_action VARCHAR(20) NOT NULL, "
+        "risk_factors TEXT, created_at DATETIME, updated_at DATETIME)"
+    )
+    connection.commit()
+    connection.close()
+
+    existing_app = Flask("main", instance_path=str(tmp_path))
+    existing_app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{path}"
+    db.init_app(existing_app)
+    with existing_app.app_context():
+        create_schema(db)
+        columns = {column["name"] for column in inspect(db.engine).get_columns("transaction_analyses")}
+    assert "decision_path" in columns
+
+def test_testing_app_does_not_start_background_threads(mocker):
+    sweeper = mocker.patch("main.admission.start_rescore_sweeper")
+    warmup = mocker.patch("main.warmup.start_warmup")
+    create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:'})
+    sweeper.assert_not_called()
+    warmup.assert_not_called()
@@ -0,0 +1,58 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+import time
+import pytest
+from main import llm_int_deepseek
+from main.llm_log import LLMLog, ReplayMiss, request_hash, replay_completion
+
+
+def payload(content):
+    return {"model": "deepseek/deepseek-chat:free", "messages": [{"role": "user", "content": content}]}
+
+@pytest.fixture
+def llm_log(tmp_path, mocker):
+    log = LLMLog(str(tmp_path / "llm-log"))
+    mocker.patch("main.llm_log._log", log)
+    return log
+
+def test_request_hash_ignores_key_order():
+    assert request_hash({"a": 1, "b": [1, 2]}) == request_hash({"b": [1, 2], "a": 1})
+    assert request_hash(payload("x")) != request_hash(payload("y"))
+
+def test_recorded_calls_replay_offline(llm_log, mocker):
+    mocker.patch("main.llm_int_deepseek.LLM_BACKEND", "mock")
+    mocker.patch("main.llm_int_deepseek.LLM_RECORD", True)
+    mocker.patch("main.mock_llm.MOCK_LATENCY_MS", 40.0)
+    mocker.patch("main.mock_llm.MOCK_LATENCY_SIGMA", 0.01)
+    recorded = [llm_int_deepseek._send_completion(payload(f"transaction {i}")) for i in range(3)]
+    assert llm_log.stats()["records"] == 3
+
+    mocker.patch("main.llm_int_deepseek.LLM_BACKEND", "replay")
+    mocker.patch("main.llm_int_deepseek.LLM_RECORD", False)
+    started = time.perf_counter()
+    replayed = [llm_int_deepseek._send_completion(payload(f"transaction {i}")) for i in range(3)]
+    assert replayed == recorded
+    assert time.perf_counter() - started >= 0.1
+
+    started = time.perf_counter()
+    assert replay_completion(payload("transaction 0"), speed=0) == recorded[0]
+    assert time.perf_counter() - started < 0.03
+
+    with pytest.raises(ReplayMiss):
+        replay_completion(payload("never recorded"), speed=0)
+
+def test_records_survive_reopening(llm_log):
+    llm_log.append(payload("a"), {"choices": [{"message": {"content": "first"}}]}, 12.5)
+    llm_log.append(payload("a"), {"choices": [{"message": {"content": "second"}}]}, 20.0)
+
+    reopened = LLMLog(llm_log.directory)
+    contents = [reopened.lookup(payload("a"))[0]["choices"][0]["message"]["content"] for _ in range(3)]
+    assert contents == ["first", "second", "first"]
+    assert [record["latency_ms"] for record in reopened.records()] == [12.5, 20.0]
+
+def test_records_are_appended_without_fcntl(llm_log, mocker):
+    """Platforms without fcntl (Windows) still record, relying on the in-process lock"""
+    mocker.patch("main.llm_log.fcntl", None)
+    llm_log.append(payload("a"), {"choices": [{"message": {"content": "only"}}]}, 5.0)
+    assert LLMLog(llm_log.directory).lookup(payload("a"))[0]["choices"][0]["message"]["content"] == "only"
@@ -0,0 +1,64 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+import pytest
+from flask import Flask
+from main.llm_parsing import extract_json_object, parse_llm_result, LLMResponseError
+
+def test_bare_json():
+    assert extract_json_object('{"risk_score": 0.2}') == {"risk_score": 0.2}
+
+def test_fenced_json_keeps_leading_characters():
+    """A fenced block whose content starts with characters from the fence is not truncated"""
+    text = '```json\n{"js": 1, "risk_score": 0.4}\n```'
+    assert extract_json_object(text) == {"js": 1, "risk_score": 0.4}
+
+def test_json_embedded_in_prose_with_braces_in_strings():
+    text = 'Here is my analysis: {"reasoning": "amount {high} \\" quoted", "risk_score": 0.9} hope it helps'
+    assert extract_json_object(text)["risk_score"] == 0.9
+
+def test_no_json_raises():
+    with pytest.raises(LLMResponseError):
+        extract_json_object("I cannot help with that")
+    with pytest.raises(LLMResponseError):
+        extract_json_object("   ")
+
+def test_coercion_of_score_and_action():
+    result = parse_llm_result('{"risk_score": "85%", "recommended_action": " Decline ", "risk_factors": "cross-border"}')
+    assert result["risk_score"] == 0.85
+    assert result["recommended_action"] == "block"
+    assert result["risk_factors"] == ["cross-border"]
+    assert result["reasoning"] == ""
+
+def test_scores_above_one_are_clamped_not_rescaled():
+    """Only an explicit percentage is rescaled; 1.2 or 5 on a 0-1 scale means very high risk"""
+    assert parse_llm_result('{"risk_score": 1.2}')["risk_score"] == 1.0
+    assert parse_llm_result('{"risk_score": 1.2}')["recommended_action"] == "block"
+    assert parse_llm_result('{"risk_score": 5}')["risk_score"] == 1.0
+    assert parse_llm_result('{"risk_score": 5}')["recommended_action"] == "block"
+    assert parse_llm_result('{"risk_score": "85%"}')["risk_score"] == 0.85
+    assert parse_llm_result('{"risk_score": "85%"}')["recommended_action"] == "block"
+
+def test_missing_action_is_derived_from_thresholds():
+    app = Flask(__name__)
+    app.config['RISK_REVIEW_THRESHOLD'] = 0.2
+    with app.app_context():
+        assert parse_llm_result('{"risk_score": 0.25}')["recommended_action"] == "review"
+
+def test_missing_score_raises():
+    with pytest.raises(LLMResponseError):
+        parse_llm_result('{"recommended_action": "allow"}')
+
+def test_deepseek_repairs_instead_of_failing(mocker):
+    from main import llm_int_deepseek
+    post = mocker.patch("main.llm_int_deepseek._post_completion", side_effect=[
+        "The transaction looks risky, score about 0.8, block it.",
+        '{"risk_score": 0.8, "risk_factors": [], "reasoning": "risky", "recommended_action": "block"}'
+    ])
+    app = Flask(__name__)
+    with app.app_context():
+        result = llm_int_deepseek.analyse_transaction_deepseek({"transaction_id": "tx_1"}, save_to_db=False)
+    assert result["recommended_action"] == "block"
+    assert post.call_count == 2
+    repair_payload = post.call_args_list[1].args[0]
+    assert "risky" in repair_payload["messages"][1]["content"]
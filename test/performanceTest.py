@@ -0,0 +1,191 @@
+"""Performance regression tier.
+
+Skipped unless PERF_TESTS=1. Each metric is compared with
+test/performance_baseline.json and fails when it is worse than the baseline
+by more than PERF_TOLERANCE (default from the baseline file). Refresh the
+baseline on the reference machine with PERF_UPDATE_BASELINE=1:
+
+    PERF_TESTS=1 python -m pytest -q test/performanceTest.py
+    PERF_TESTS=1 PERF_UPDATE_BASELINE=1 python -m pytest -q test/performanceTest.py
+    PERF_TESTS=1 PERF_ANALYSES_ROWS=10000 python -m pytest -q test/performanceTest.py
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+import json
+import statistics
+import time
+from datetime import datetime
+import pytest
+from flask import Flask
+from main.controller import main_bp
+from main.database_manager import DatabaseManager
+from main.models import TransactionAnalysis
+from main.validator import validate_transaction
+
+pytestmark = pytest.mark.skipif(os.getenv("PERF_TESTS", "0") != "1", reason="set PERF_TESTS=1 to run")
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "performance_baseline.json")
+UPDATE_BASELINE = os.getenv("PERF_UPDATE_BASELINE", "0") == "1"
+ANALYSES_ROWS = [int(rows) for rows in os.getenv("PERF_ANALYSES_ROWS", "10000,100000,1000000").split(",")]
+
+with open(BASELINE_PATH, "r", encoding="utf-8") as baseline_file:
+    BASELINE = json.load(baseline_file)
+TOLERANCE = float(os.getenv("PERF_TOLERANCE", BASELINE["tolerance"]))
+# The latest page and the review band each walk one index and stop at the limit, so their latency
+# at the largest history may be at most this multiple of the latency at the smallest; a full scan
+# or a sort of every match grows with the row count instead
+LATEST_PAGE_MAX_GROWTH = float(os.getenv("PERF_LATEST_PAGE_MAX_GROWTH", "3"))
+
+measured = {}
+page_ms = {"latest": {}, "review_band": {}}
+
+
+def make_transaction(i):
+    return {
+        "transaction_id": f"tx_perf_{i}",
+        "timestamp": "2025-05-07T14:30:45Z",
+        "amount": 100.0 + i % 900,
+        "currency": "USD",
+        "customer": {"id": f"cust_{i % 5000}", "country": "US", "ip_address": "192.168.1.1"},
+        "payment_method": {"type": "credit_card", "last_four": "4242", "country_of_issue": "CA"},
+        "merchant": {"id": f"merch_{i % 700}", "name": "Example Store", "category": "electronics"}
+    }
+
+def make_app(path):
+    app = Flask(__name__)
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{path}"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    from main import db
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+    app.register_blueprint(main_bp)
+    return app
+
+@pytest.fixture(scope="module", autouse=True)
+def baseline_writer():
+    yield
+    if UPDATE_BASELINE and measured:
+        metrics = dict(BASELINE["metrics"])
+        metrics.update(measured)
+        with open(BASELINE_PATH, "w", encoding="utf-8") as baseline_file:
+            json.dump({"tolerance": BASELINE["tolerance"], "metrics": metrics}, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write("\n")
+
+@pytest.fixture
+def benchmark():
+    """Median wall time of fn over rounds after warmup calls, pytest-benchmark style"""
+    def run(fn, rounds=5, warmup=1):
+        for _ in range(warmup):
+            fn()
+        timings = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - started)
+        return statistics.median(timings)
+    return run
+
+def check_against_baseline(name, value, higher_is_better):
+    measured[name] = {"value": round(value, 3), "higher_is_better": higher_is_better}
+    expected = BASELINE["metrics"].get(name)
+    if UPDATE_BASELINE or expected is None:
+        return
+    if higher_is_better:
+        floor = expected["value"] * (1 - TOLERANCE)
+        assert value >= floor, f"{name} regressed: {value:.3f} < {floor:.3f} (baseline {expected['value']})"
+    else:
+        ceiling = expected["value"] * (1 + TOLERANCE)
+        assert value <= ceiling, f"{name} regressed: {value:.3f} > {ceiling:.3f} (baseline {expected['value']})"
+
+
+def test_validate_transaction_throughput(benchmark):
+    transactions = [make_transaction(i) for i in range(100000)]
+
+    def validate_all():
+        for transaction in transactions:
+            validate_transaction(transaction)
+
+    seconds = benchmark(validate_all, rounds=3)
+    check_against_baseline("validate_records_per_second", len(transactions) / seconds, higher_is_better=True)
+
+def test_to_dict_cost_per_row(benchmark):
+    now = datetime.utcnow()
+    analyses = [
+        TransactionAnalysis(id=i, transaction_data=json.dumps(make_transaction(i)),
+                            llm_response='{"risk_score": 0.5, "recommended_action": "review"}',
+                            risk_score=0.5, recommended_action="review", risk_factors='["a", "b"]',
+                            created_at=now, updated_at=now)
+        for i in range(10000)
+    ]
+    seconds = benchmark(lambda: [analysis.to_dict() for analysis in analyses])
+    check_against_baseline("to_dict_microseconds_per_row", seconds / len(analyses) * 1e6, higher_is_better=False)
+
+def test_save_transaction_analysis_inserts_per_second(tmp_path):
+    app = make_app(tmp_path / "inserts.db")
+    count = 500
+    with app.app_context():
+        DatabaseManager.save_transaction_analysis(make_transaction(-1), {"risk_score": 0.1, "recommended_action": "allow"})
+        started = time.perf_counter()
+        for i in range(count):
+            DatabaseManager.save_transaction_analysis(
+                make_transaction(i),
+                {"risk_score": (i % 100) / 100.0, "recommended_action": "review", "risk_factors": ["perf"]}
+            )
+        seconds = time.perf_counter() - started
+    check_against_baseline("save_inserts_per_second", count / seconds, higher_is_better=True)
+
+@pytest.fixture(scope="module")
+def history_app(tmp_path_factory):
+    """One file database grown to each size in ANALYSES_ROWS in turn"""
+    app = make_app(tmp_path_factory.mktemp("history") / "history.db")
+    app.stored_rows = 0
+    return app
+
+def grow_history(app, rows):
+    from main import db
+    with app.app_context():
+        now = datetime.utcnow()
+        for start in range(app.stored_rows, rows, 50000):
+            db.session.execute(TransactionAnalysis.__table__.insert(), [
+                {"transaction_data": json.dumps(make_transaction(i)),
+                 "llm_response": '{"risk_score": 0.5, "recommended_action": "review"}',
+                 "risk_score": (i % 100) / 100.0, "recommended_action": ("allow", "review", "block")[i % 3],
+                 "risk_factors": "[]", "created_at": now, "updated_at": now}
+                for i in range(start, min(start + 50000, rows))
+            ])
+            db.session.commit()
+    app.stored_rows = rows
+
+@pytest.mark.parametrize("rows", ANALYSES_ROWS)
+def test_analyses_latency(history_app, rows, benchmark):
+    grow_history(history_app, rows)
+    client = history_app.test_client()
+    headers = {"X-API-KEY": os.getenv('SECRET_API_KEY', 'test-api-key')}
+
+    def latest_page():
+        assert client.get("/analyses", headers=headers).status_code == 200
+
+    def filtered_page():
+        assert client.get("/analyses?recommended_action=review&limit=100", headers=headers).status_code == 200
+
+    def review_band_page():
+        assert client.get("/analyses?risk_level=review&limit=100", headers=headers).status_code == 200
+
+    page_ms["latest"][rows] = benchmark(latest_page) * 1000
+    page_ms["review_band"][rows] = benchmark(review_band_page) * 1000
+    check_against_baseline(f"analyses_latest_ms_{rows}", page_ms["latest"][rows], higher_is_better=False)
+    check_against_baseline(f"analyses_filtered_ms_{rows}", benchmark(filtered_page) * 1000, higher_is_better=False)
+    check_against_baseline(f"analyses_review_band_ms_{rows}", page_ms["review_band"][rows], higher_is_better=False)
+
+@pytest.mark.parametrize("page", ["latest", "review_band"])
+def test_page_latency_does_not_grow_with_history(page):
+    timings = page_ms[page]
+    if len(timings) < 2:
+        pytest.skip("needs test_analyses_latency at two or more history sizes")
+    smallest, largest = min(timings), max(timings)
+    growth = timings[largest] / timings[smallest]
+    assert growth <= LATEST_PAGE_MAX_GROWTH, \
+        f"{page} page took {growth:.1f}x longer at {largest} rows than at {smallest} rows"
@@ -0,0 +1,79 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+import json
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+import pytest
+from flask import Flask
+from werkzeug.serving import make_server
+from main.controller import main_bp
+from main.replay import iter_corpus, schedule, run
+
+@pytest.fixture
+def api_key():
+    return os.getenv('SECRET_API_KEY', 'test-api-key')
+
+@pytest.fixture
+def corpus_url(tmp_path):
+    db_path = tmp_path / "corpus.db"
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "CREATE TABLE transaction_analyses (id INTEGER PRIMARY KEY, transaction_data TEXT, created_at DATETIME)"
+    )
+    start = datetime(2025, 5, 7, 14, 0, 0)
+    for i in range(5):
+        transaction = {
+            "transaction_id": f"tx_{i}",
+            "timestamp": "2025-05-07T14:30:45Z",
+            "amount": 100.0 * (i + 1),
+            "currency": "USD",
+            "customer": {"id": "cust_1", "country": "US", "ip_address": "192.168.1.1"},
+            "payment_method": {"type": "credit_card", "last_four": "4242", "country_of_issue": "US"},
+            "merchant": {"id": "merch_1", "name": "Example Store", "category": "electronics"}
+        }
+        conn.execute("INSERT INTO transaction_analyses VALUES (?, ?, ?)",
+                     (i + 1, json.dumps(transaction), str(start + timedelta(seconds=10 * i))))
+    conn.commit()
+    conn.close()
+    return f"sqlite:///{db_path}"
+
+@pytest.fixture
+def server(tmp_path, mocker):
+    """Live instance on an ephemeral port with the mock LLM backend"""
+    mocker.patch("main.llm_int_deepseek.LLM_BACKEND", "mock")
+    mocker.patch("main.mock_llm.MOCK_LATENCY_MS", 5.0)
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'target.db'}"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    from main import db
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+    app.register_blueprint(main_bp)
+
+    http_server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{http_server.server_port}"
+    http_server.shutdown()
+
+def test_speedup_compresses_original_spacing(corpus_url):
+    arrivals = list(schedule(lambda: iter_corpus(corpus_url), speedup=10))
+    assert [offset for offset, _ in arrivals] == [0.0, 1.0, 2.0, 3.0, 4.0]
+
+def test_rate_schedule_loops_the_corpus(corpus_url):
+    arrivals = schedule(lambda: iter_corpus(corpus_url), rate=100, loop=True)
+    offsets = [next(arrivals)[0] for _ in range(12)]
+    assert offsets[-1] == pytest.approx(0.12)
+
+def test_replay_against_live_instance(corpus_url, server, api_key):
+    arrivals = schedule(lambda: iter_corpus(corpus_url), rate=200, loop=True)
+    summary = run(arrivals, server, api_key, concurrency=8, max_requests=20)
+
+    assert summary["requests"] == 20
+    assert summary["statuses"] == {"201": 20}
+    assert summary["error_rate"] == 0.0
+    assert summary["latency_ms"]["p50"] >= summary["service_time_ms"]["p50"] * 0.5
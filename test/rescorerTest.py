@@ -0,0 +1,97 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+import json
+import sqlite3
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from main.rescorer import rescore, rescore_chunk, iter_chunks
+
+
+def stored_row(row_id, amount, customer_country, payment_country, category, risk_score, action):
+    transaction = {
+        "transaction_id": f"tx_{row_id}",
+        "amount": amount,
+        "customer": {"id": "cust_1", "country": customer_country, "ip_address": "192.168.1.1"},
+        "payment_method": {"type": "credit_card", "last_four": "4242", "country_of_issue": payment_country},
+        "merchant": {"id": "merch_1", "name": "Example Store", "category": category}
+    }
+    return (row_id, json.dumps(transaction), risk_score, action)
+
+STORED_ROWS = [
+    stored_row(1, 50.0, "US", "US", "food", 0.1, "allow"),
+    stored_row(2, 999.99, "US", "CA", "electronics", 0.5, "review"),
+    stored_row(3, 50000.0, "US", "CA", "electronics", 0.8, "block"),
+    stored_row(4, 20.0, "FR", "FR", "food", 0.65, "review"),
+]
+
+@pytest.fixture
+def history_url(tmp_path):
+    db_path = tmp_path / "history.db"
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "CREATE TABLE transaction_analyses (id INTEGER PRIMARY KEY, transaction_data TEXT, "
+        "risk_score FLOAT, recommended_action VARCHAR(20))"
+    )
+    conn.executemany("INSERT INTO transaction_analyses VALUES (?, ?, ?, ?)", STORED_ROWS)
+    conn.commit()
+    conn.close()
+    return f"sqlite:///{db_path}"
+
+@pytest.fixture
+def rows(history_url):
+    return [row for chunk in iter_chunks(history_url) for row in chunk]
+
+def test_threshold_change_shifts_actions(rows):
+    """Lowering the block threshold moves borderline reviews to block"""
+    report = rescore([rows], review_threshold=0.3, block_threshold=0.6)
+
+    assert report["rows"] == 4
+    assert report["before"] == {"allow": 1, "review": 2, "block": 1}
+    assert report["after"] == {"allow": 1, "review": 1, "block": 2}
+    assert report["shift"] == {"review->block": 1}
+    assert report["changed"] == 1
+
+def test_rules_are_applied_vectorised(rows):
+    """Rules add their delta to every matching row and report hit counts"""
+    rules = [
+        {"name": "cross_border", "when": "cross_border", "delta": 0.25},
+        {"name": "big_ticket", "when": "amount_gte", "value": 10000, "delta": 0.5},
+    ]
+    partial = rescore_chunk(rows, rules=rules)
+
+    assert partial["rule_hits"] == {"cross_border": 2, "big_ticket": 1}
+    # Only row 2 crosses a band (0.5 + 0.25 -> block); row 3 was already blocked
+    assert partial["shift"][1, 2] == 1
+    assert partial["shift"].sum() == 4
+
+def test_unknown_rule_raises(rows):
+    with pytest.raises(ValueError):
+        rescore_chunk(rows, rules=[{"when": "moon_phase"}])
+
+def test_multiprocess_matches_single_process(rows):
+    chunks = [rows[:2], rows[2:]]
+    single = rescore(chunks, block_threshold=0.6)
+    multi = rescore(chunks, block_threshold=0.6, workers=2)
+    assert single == multi
+
+def test_iter_chunks_reads_history(history_url):
+    chunks = list(iter_chunks(history_url, chunk_size=3))
+    assert [len(chunk) for chunk in chunks] == [3, 1]
+    assert chunks[0][1] == (2, 999.99, "US", "CA", "electronics", 0.5, "review")
+    assert rescore(chunks)["changed"] == 0
+
+def test_iter_chunks_tolerates_malformed_payloads(tmp_path):
+    db_path = tmp_path / "broken.db"
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "CREATE TABLE transaction_analyses (id INTEGER PRIMARY KEY, transaction_data TEXT, "
+        "risk_score FLOAT, recommended_action VARCHAR(20))"
+    )
+    conn.execute("INSERT INTO transaction_analyses VALUES (1, 'not json', 0.4, 'review')")
+    conn.commit()
+    conn.close()
+
+    assert list(iter_chunks(f"sqlite:///{db_path}")) == [[(1, 0.0, "", "", "", 0.4, "review")]]
@@ -0,0 +1,89 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+import socket
+import threading
+import time
+import pytest
+from main.shared_state import create_shared_state, SharedStateError
+from main.resp_standin import StandinServer
+from main.profiles import SharedProfileCache
+
+@pytest.fixture(scope="module")
+def standin():
+    server = StandinServer().start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def state_url(request, tmp_path):
+    if request.param == "memory":
+        return "memory://"
+    if request.param == "sqlite":
+        return f"sqlite:///{tmp_path / 'state.db'}"
+    server = request.getfixturevalue("standin")
+    create_shared_state(server.url).execute("FLUSHDB")
+    return server.url
+
+def test_basic_operations_and_expiry(state_url):
+    state = create_shared_state(state_url)
+    assert state.get("missing") is None
+    state.set("profile", {"count": 3, "rates": [0.5]})
+    assert state.get("profile") == {"count": 3, "rates": [0.5]}
+    state.delete("profile")
+    assert state.get("profile") is None
+
+    assert state.add("lock", "node-a", ttl=0.05) is True
+    assert state.add("lock", "node-b", ttl=0.05) is False
+    time.sleep(0.08)
+    assert state.get("lock") is None
+    assert state.add("lock", "node-b") is True
+
+def test_increments_are_atomic_across_connections(state_url):
+    # Separate backend instances stand in for separate processes or nodes
+    nodes = [create_shared_state(state_url) for _ in range(4)] if not state_url.startswith("memory") \
+        else [create_shared_state(state_url)] * 4
+
+    def work(node):
+        for _ in range(50):
+            node.incr("velocity:cust_1", ttl=60)
+
+    threads = [threading.Thread(target=work, args=(node,)) for node in nodes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert nodes[0].incr("velocity:cust_1", 0) == 200
+
+def test_profile_cache_is_coherent_across_nodes(state_url):
+    if state_url.startswith("memory"):
+        pytest.skip("memory state is per process")
+    node_a = SharedProfileCache(lambda state=create_shared_state(state_url): state)
+    node_b = SharedProfileCache(lambda state=create_shared_state(state_url): state)
+
+    node_a.put(("merchant", "merch_1"), {"count": 1})
+    assert node_b.get(("merchant", "merch_1")) == {"count": 1}
+    node_b.invalidate(("merchant", "merch_1"))
+    assert node_a.get(("merchant", "merch_1")) is None
+
+    node_a.put(("customer", "cust_1"), {"count": 2})
+    node_a.invalidate()
+    assert node_b.get(("customer", "cust_1")) is None
+    assert node_b.stats()["hits"] == 1
+
+def test_commands_that_may_have_been_sent_are_not_retried(standin, mocker):
+    state = create_shared_state(standin.url)
+    state.execute("FLUSHDB")
+    assert state.incr("velocity:cust_2") == 1
+
+    # The server closed the idle connection: detected before sending, so the command goes out once
+    state._local.connection[0].shutdown(socket.SHUT_RD)
+    assert state.incr("velocity:cust_2") == 2
+
+    # The reply timed out after the command went out: INCRBY must not be sent again
+    mocker.patch.object(state, "_reply", side_effect=socket.timeout("timed out"))
+    with pytest.raises(SharedStateError):
+        state.incr("velocity:cust_2")
+    mocker.stopall()
+    assert create_shared_state(standin.url).get("velocity:cust_2") == 3
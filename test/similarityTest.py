@@ -0,0 +1,102 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+import pytest
+from main.similarity import SimilarityIndex, feature_vector, find_similar, remember, cosine
+
+
+def make_transaction(amount=120.0, category="electronics", customer_country="US", payment_country="US"):
+    return {
+        "transaction_id": "tx_similar",
+        "timestamp": "2025-05-07T14:30:45Z",
+        "amount": amount,
+        "currency": "USD",
+        "customer": {"id": "cust_1", "country": customer_country, "ip_address": "192.168.1.1"},
+        "payment_method": {"type": "credit_card", "country_of_issue": payment_country},
+        "merchant": {"id": "merch_1", "name": "Example Store", "category": category}
+    }
+
+@pytest.fixture
+def index():
+    return SimilarityIndex(len(feature_vector({})), capacity=100)
+
+def test_vectors_separate_structurally_different_transactions():
+    base = feature_vector(make_transaction())
+    assert cosine(base, feature_vector(make_transaction(amount=125.0))) > 0.99
+    assert cosine(base, feature_vector(make_transaction(category="jewelry"))) < 0.9
+    assert cosine(base, feature_vector(make_transaction(payment_country="NG"))) < 0.9
+
+def test_confident_neighbour_is_reused(index):
+    remember(1, make_transaction(), {"risk_score": 0.05, "recommended_action": "allow",
+                                     "risk_factors": [], "reasoning": "Domestic purchase"}, index=index)
+
+    result, cases = find_similar(make_transaction(amount=121.0), mode="reuse", index=index)
+    assert result["reused_from"] == 1
+    assert result["recommended_action"] == "allow"
+    assert cases == []
+
+    result, cases = find_similar(make_transaction(amount=121.0), mode="fewshot", index=index)
+    assert result is None
+    assert cases[0]["recommended_action"] == "allow"
+
+def test_borderline_or_distant_neighbours_are_not_reused(index):
+    remember(1, make_transaction(), {"risk_score": 0.32, "recommended_action": "review",
+                                     "risk_factors": ["Borderline"], "reasoning": ""}, index=index)
+
+    result, cases = find_similar(make_transaction(), mode="reuse", index=index)
+    assert result is None
+    assert cases[0]["risk_score"] == 0.32
+
+    result, cases = find_similar(make_transaction(category="crypto", payment_country="NG"), mode="reuse", index=index)
+    assert result is None
+    assert cases == []
+
+def test_capacity_evicts_oldest_entries():
+    index = SimilarityIndex(len(feature_vector({})), capacity=2)
+    for analysis_id in range(3):
+        remember(analysis_id, make_transaction(), {"risk_score": 0.05, "recommended_action": "allow"}, index=index)
+    assert len(index) == 2
+    assert {verdict["analysis_id"] for _, verdict in index.query(feature_vector(make_transaction()))} == {1, 2}
+
+def test_global_index_loads_in_background_and_serves_misses_until_ready(mocker):
+    import threading
+    from flask import Flask
+    from main import similarity
+    release = threading.Event()
+    calls = []
+
+    def recent_verdicts(limit):
+        calls.append(limit)
+        if len(calls) == 1:
+            raise RuntimeError("database unavailable")
+        release.wait(5)
+        return [(1, make_transaction(), {"risk_score": 0.05, "recommended_action": "allow",
+                                         "risk_factors": [], "reasoning": ""})]
+
+    mocker.patch("main.database_manager.DatabaseManager.get_recent_verdicts", side_effect=recent_verdicts)
+    mocker.patch.object(similarity, "_index", None)
+    mocker.patch.object(similarity, "_loader", None)
+    mocker.patch.object(similarity, "_next_load_at", 0.0)
+    mocker.patch.object(similarity, "LOAD_RETRY_SECONDS", 0.0)
+
+    with Flask(__name__).app_context():
+        similarity.get_similarity_index()
+        similarity._loader.join(5)
+        assert not similarity._index.loaded
+
+        index = similarity.get_similarity_index()
+        assert find_similar(make_transaction(amount=121.0), mode="reuse") == (None, [])
+        release.set()
+        similarity._loader.join(5)
+        assert index.loaded
+        result, _ = find_similar(make_transaction(amount=121.0), mode="reuse")
+        assert result["reused_from"] == 1
+
+def test_local_and_provisional_verdicts_are_not_indexed(index):
+    verdict = {"risk_score": 0.05, "recommended_action": "allow", "risk_factors": [], "reasoning": ""}
+    remember(1, make_transaction(), dict(verdict, scorer="local"), index=index)
+    remember(2, make_transaction(), dict(verdict, provisional=True), index=index)
+    assert len(index) == 0
+
+    remember(3, make_transaction(), verdict, index=index)
+    assert len(index) == 1
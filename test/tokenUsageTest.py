@@ -0,0 +1,108 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+import json
+import pytest
+from main.prompt_payload import minimize_transaction, serialize_for_prompt, SHORT_KEY_LEGEND
+
+@pytest.fixture
+def transaction():
+    return {
+        "transaction_id": "tx_12345",
+        "timestamp": "2025-05-07T14:30:45Z",
+        "amount": 129.99,
+        "currency": "USD",
+        "customer": {"id": "cust_98765", "country": "US", "ip_address": "192.168.1.1"},
+        "payment_method": {"type": "credit_card", "last_four": "4242", "country_of_issue": "CA"},
+        "merchant": {"id": "merch_12345", "name": "Example Store", "category": "electronics"},
+        "internal_notes": "not used by the prompt"
+    }
+
+def test_minimizer_keeps_only_prompt_fields(transaction):
+    minimized = minimize_transaction(transaction)
+    assert minimized == {
+        "timestamp": "2025-05-07T14:30:45Z",
+        "amount": 129.99,
+        "currency": "USD",
+        "customer_country": "US",
+        "ip_address": "192.168.1.1",
+        "payment_type": "credit_card",
+        "payment_country": "CA",
+        "merchant_name": "Example Store",
+        "merchant_category": "electronics"
+    }
+    assert len(serialize_for_prompt(transaction, minimize=True)) < len(json.dumps(transaction)) * 0.6
+
+def test_short_keys_include_legend(transaction):
+    text = serialize_for_prompt(transaction, minimize=True, short_keys=True)
+    legend, payload = text.split("\n")
+    assert legend == SHORT_KEY_LEGEND
+    assert json.loads(payload)["pm_cc"] == "CA"
+
+def test_usage_is_recorded_and_reported(app, api_key, transaction, mocker):
+    response = mocker.Mock(status_code=200)
+    response.json.return_value = {
+        "choices": [{"message": {"content": '{"risk_score": 0.2, "recommended_action": "allow"}'}}],
+        "usage": {"prompt_tokens": 300, "completion_tokens": 50}
+    }
+    post = mocker.patch("main.llm_int_deepseek.http.post", return_value=response)
+
+    client = app.test_client()
+    for _ in range(2):
+        result = client.post("/transaction", json=transaction, headers={"X-API-KEY": api_key})
+        assert result.status_code == 201
+
+    sent_prompt = post.call_args.kwargs["json"]["messages"][0]["content"]
+    assert "internal_notes" not in sent_prompt and "4242" not in sent_prompt
+
+    report = client.get("/admin/usage?group_by=model", headers={"X-API-KEY": api_key}).get_json()
+    assert report["usage"] == [{
+        "model": "deepseek/deepseek-chat:free",
+        "calls": 2,
+        "prompt_tokens": 600,
+        "completion_tokens": 100,
+        "total_tokens": 700,
+        "tokens_per_call": 350.0,
+        "cost": 0.0
+    }]
+
+    report = client.get("/admin/usage?since=2999-01-01", headers={"X-API-KEY": api_key}).get_json()
+    assert report["usage"] == []
+    assert client.get("/admin/usage?group_by=color", headers={"X-API-KEY": api_key}).status_code == 400
+
+def test_combined_batch_usage_is_split_between_callers(app, mocker):
+    """A batch completion sent from the dispatcher thread is charged to the api keys of its transactions"""
+    from main import llm_int_deepseek
+    from main.token_usage import api_key_id
+    response = mocker.Mock(status_code=200)
+    response.json.return_value = {
+        "choices": [{"message": {"content": json.dumps({"results": [{"risk_score": 0.1}] * 3})}}],
+        "usage": {"prompt_tokens": 301, "completion_tokens": 60}
+    }
+    mocker.patch("main.llm_int_deepseek.http.post", return_value=response)
+
+    key_a, key_b = api_key_id("key-a"), api_key_id("key-b")
+    items = [(app, "{transaction_data}", {"amount": amount}, "m", key)
+             for amount, key in ((1, key_a), (2, key_b), (3, key_a))]
+    llm_int_deepseek._dispatch_combined(items)
+
+    with app.app_context():
+        usage = {row["api_key"]: row for row in llm_int_deepseek.DatabaseManager.get_llm_usage_report()}
+    assert set(usage) == {key_a, key_b}
+    assert usage[key_a]["prompt_tokens"] == 200 and usage[key_a]["completion_tokens"] == 40
+    assert usage[key_b]["prompt_tokens"] == 101 and usage[key_b]["completion_tokens"] == 20
+
+@pytest.mark.parametrize("app", ["sqlite:///{tmp_path}/usage.db"], indirect=True)
+def test_usage_is_written_outside_the_request_session(app):
+    """Recording usage mid-request neither commits nor rolls back the request's own work"""
+    from main import db
+    from main.models import RiskSummary
+    from main.token_usage import record_usage
+    from main.database_manager import DatabaseManager
+    with app.app_context():
+        db.session.add(RiskSummary(bucket=1, recommended_action="allow", count=1))
+        assert record_usage("deepseek", "m", {"prompt_tokens": 10, "completion_tokens": 2}) is not None
+        db.session.rollback()
+
+        assert RiskSummary.query.count() == 0
+        assert DatabaseManager.get_llm_usage_report()[0]["prompt_tokens"] == 10
@@ -0,0 +1,88 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from main import warmup
+from main.warmup import provider_health, preconnect, probe
+
+
+class ProbeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    status = 200
+
+    def do_GET(self):
+        self.server.peers.add(self.client_address)
+        body = b'{"data": {}}'
+        self.send_response(self.status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def probe_server(mocker):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ProbeHandler)
+    server.peers = set()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    mocker.patch("main.warmup.OPENROUTER_PROBE_URL", f"http://127.0.0.1:{server.server_address[1]}/auth/key")
+    mocker.patch("main.llm_int_deepseek.LLM_BACKEND", "openrouter")
+    mocker.patch("main.llm_int_deepseek.API_KEY", "test-key")
+    provider_health.reset()
+    yield server
+    server.shutdown()
+    server.server_close()
+    provider_health.reset()
+
+def test_preconnect_opens_reusable_connections(probe_server):
+    assert preconnect(["deepseek"], connections=2) == {"deepseek": True}
+    opened = set(probe_server.peers)
+    assert 1 <= len(opened) <= 2
+
+    for _ in range(3):
+        assert probe("deepseek")
+    # Later probes ride on the pooled keep-alive connections
+    assert probe_server.peers == opened
+    assert provider_health.snapshot()["deepseek"]["probes"] == 5
+
+def test_failing_provider_marked_unhealthy(probe_server, mocker):
+    mocker.patch.object(ProbeHandler, "status", 503)
+    mocker.patch("main.warmup.UNHEALTHY_AFTER", 2)
+    assert probe("deepseek") is False
+    assert provider_health.is_healthy("deepseek")
+    probe("deepseek")
+    assert not provider_health.is_healthy("deepseek")
+    assert warmup.health_report()["status"] == "degraded"
+
+    mocker.patch.object(ProbeHandler, "status", 200)
+    probe("deepseek")
+    assert provider_health.is_healthy("deepseek")
+
+def test_mock_backend_is_not_probed(mocker):
+    mocker.patch("main.llm_int_deepseek.LLM_BACKEND", "mock")
+    assert preconnect(["deepseek"]) == {}
+
+def test_similarity_preload_runs_off_create_app(mocker):
+    loading = threading.Event()
+    release = threading.Event()
+
+    def slow_index():
+        loading.set()
+        release.wait(5)
+
+    mocker.patch("main.similarity.SIMILARITY_MODE", "reuse")
+    mocker.patch("main.similarity.get_similarity_index", side_effect=slow_index)
+    mocker.patch("main.warmup.preconnect")
+    mocker.patch.object(warmup, "_started", threading.Event())
+    from flask import Flask
+
+    started = time.perf_counter()
+    assert warmup.start_warmup(Flask(__name__), interval=0) is True
+    assert time.perf_counter() - started < 1.0
+    assert loading.wait(5)
+    release.set()
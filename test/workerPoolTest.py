@@ -0,0 +1,57 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../')))
+import time
+import pytest
+from main.local_scorer import extract_features, local_score
+from main.worker_pool import ScoringPool, PoolSaturated, score_records
+
+@pytest.fixture
+def transaction():
+    return {
+        "transaction_id": "tx_12345",
+        "timestamp": "2025-05-07T02:30:45Z",
+        "amount": 50000.00,
+        "currency": "USD",
+        "customer": {"id": "cust_98765", "country": "US", "ip_address": "192.168.1.1"},
+        "payment_method": {"type": "credit_card", "last_four": "4242", "country_of_issue": "CA"},
+        "merchant": {"id": "merch_12345", "name": "Example Store", "category": "electronics"}
+    }
+
+def test_local_score_flags_prompt_risk_factors(transaction):
+    features = extract_features(transaction)
+    assert features["cross_border"] and features["off_hours"]
+    result = local_score(transaction, features)
+    assert result["recommended_action"] == "block"
+    assert len(result["risk_factors"]) == 4
+
+def test_score_records_reports_invalid_transactions(transaction):
+    results = score_records([transaction, {"transaction_id": "bad"}])
+    assert results[0]["transaction_id"] == "tx_12345"
+    assert "error" in results[1]
+
+def test_pool_scores_batches_in_order(transaction):
+    pool = ScoringPool(max_workers=2, batch_size=3)
+    try:
+        records = [dict(transaction, transaction_id=f"tx_{i}", amount=float(i * 1000)) for i in range(10)]
+        results = pool.score_batch(records, timeout=60)
+        assert [r["transaction_id"] for r in results] == [f"tx_{i}" for i in range(10)]
+        assert results == score_records(records)
+
+        # Bookkeeping runs in the future's done callback, just after result() wakes up
+        deadline = time.time() + 5
+        while pool.metrics()["in_flight_batches"] and time.time() < deadline:
+            time.sleep(0.01)
+        metrics = pool.metrics()
+        assert metrics["submitted_batches"] == 4
+        assert metrics["completed_batches"] == 4
+        assert metrics["records_scored"] == 10
+        assert metrics["in_flight_batches"] == 0
+    finally:
+        pool.shutdown()
+
+def test_pool_rejects_when_queue_is_full(transaction):
+    pool = ScoringPool(max_workers=1, batch_size=1, max_queued_batches=2)
+    with pytest.raises(PoolSaturated):
+        pool.score_batch([transaction] * 3)
+    assert pool.metrics()["started"] is False